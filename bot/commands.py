@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 import discord
-from storyteller.engine import FileStoryRepository, StoryEngine, Chains
+from storyteller.engine import AsyncStoryRepository, StoryEngine, Chains
 import storyteller.engine
 import storyteller.commands
 import uuid
@@ -145,7 +145,7 @@ class NewStoryCommand(BotCommand):
     def __init__(
         self,
         set_channel_story: Callable,
-        story_repository: FileStoryRepository,
+        story_repository: AsyncStoryRepository,
         chargen_prompt: str,
     ):
         self.set_channel_story = set_channel_story
@@ -170,7 +170,7 @@ class NewStoryCommand(BotCommand):
         channel_id = str(ctx.message.channel.id)
         new_story_id = str(uuid.uuid4())
         full_story_id = f"{channel_id}-{new_story_id}"
-        self.story_repository.save(full_story_id, story)
+        await self.story_repository.save(full_story_id, story)
         self.set_channel_story(channel_id, new_story_id)
 
         await ctx.send(
@@ -186,7 +186,7 @@ class NewStoryCommand(BotCommand):
                 ctx.chains, NoOpResponse(), self.chargen_prompt
             ),
         )
-        generated_characters = self.story_repository.load(full_story_id).characters
+        generated_characters = (await ctx.story_engine.load(full_story_id)).characters
         file = discord.File(
             fp=StringIO(self._character_bios(generated_characters)),
             filename="characters.md",
@@ -200,10 +200,16 @@ class NewStoryCommand(BotCommand):
 class WriteStoryCommand(BotCommand):
     help_text = "[text] - write the next section of the story, and the storyteller will continue from there."
 
+    def __init__(self, candidates: int = 1):
+        self.candidates = candidates
+
     async def execute(self, ctx: CommandContext, args: str) -> None:
         response = DiscordResponse.to_channel(ctx.message)
         await ctx.story_engine.run_command(
-            ctx.story_id, storyteller.commands.ChatCommand(ctx.chains, response, args)
+            ctx.story_id,
+            storyteller.commands.ChatCommand(
+                ctx.chains, response, args, self.candidates
+            ),
         )
 
 
@@ -212,10 +218,14 @@ class RetryCommand(BotCommand):
         "- regenerate the last storyteller response, in case you didn't like it."
     )
 
+    def __init__(self, candidates: int = 1):
+        self.candidates = candidates
+
     async def execute(self, ctx: CommandContext, args: str) -> None:
         response = DiscordResponse.to_channel(ctx.message)
         await ctx.story_engine.run_command(
-            ctx.story_id, storyteller.commands.RetryCommand(ctx.chains, response)
+            ctx.story_id,
+            storyteller.commands.RetryCommand(ctx.chains, response, self.candidates),
         )
 
 
@@ -361,11 +371,8 @@ class OocCommand(BotCommand):
 class DumpStoryCommand(BotCommand):
     help_text = "- dump the current story data to a file."
 
-    def __init__(self, story_repository: FileStoryRepository):
-        self.story_repository = story_repository
-
     async def execute(self, ctx: CommandContext, args: str) -> None:
-        story = self.story_repository.load(ctx.story_id)
+        story = await ctx.story_engine.export(ctx.story_id)
         await ctx.message.author.send(
             f"Story data for {ctx.message.channel.name}.",
             file=discord.File(
@@ -13,7 +13,12 @@ from storyteller.commands import (
     SummarizeCommand,
     SuggestOpeningCommand,
 )
-from storyteller.common import load_file, add_standard_model_args, init_model
+from storyteller.common import (
+    load_file,
+    add_standard_model_args,
+    init_model,
+    init_routes,
+)
 import os
 import logging
 import asyncio
@@ -25,6 +30,7 @@ DEBUG = os.getenv("DEBUG", "false").lower() == "true"
 STORYTELLER_CLI_STORY = os.getenv("STORYTELLER_CLI_STORY", "floop-{provider}")
 HISTORY_MIN_TOKENS = int(os.getenv("HISTORY_MIN_TOKENS", "1024"))
 HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "4096"))
+CHAT_CANDIDATES = int(os.getenv("CHAT_CANDIDATES", "1"))
 
 logger = logging.getLogger(__name__)
 if DEBUG:
@@ -74,7 +80,7 @@ async def main():
     model = init_model(args)
 
     context = init_context(prompt_dir)
-    chains = Chains(model=model, prompts=context.prompts)
+    chains = Chains(model=model, prompts=context.prompts, routes=init_routes(args))
     repo = FileStoryRepository(repo_dir=os.path.expanduser("~/story_repo"))
     story_name = STORYTELLER_CLI_STORY.format(provider=args.provider)
     response = StdoutResponse()
@@ -108,7 +114,9 @@ async def main():
                 print("\nGoodbye!")
                 break
             elif user_input.lower() == "retry":
-                cmd = RetryCommand(chains, response=response)
+                cmd = RetryCommand(
+                    chains, response=response, candidates=CHAT_CANDIDATES
+                )
             elif user_input.lower() == "rewind":
                 cmd = RewindCommand(chains, response=response)
             elif user_input.startswith("fix"):
@@ -131,20 +139,27 @@ async def main():
                     chapter_title=title,
                 )
             else:
-                cmd = ChatCommand(chains, response=response, user_input=user_input)
+                cmd = ChatCommand(
+                    chains,
+                    response=response,
+                    user_input=user_input,
+                    candidates=CHAT_CANDIDATES,
+                )
 
             # summarize after running command so that we don't accidentally summarize something that
             # needs replaying/rewriting.
             try:
-                await engine.run_command(story_id, cmd)
-                await engine.run_command(
+                await engine.run_commands(
                     story_id,
-                    SummarizeCommand(
-                        chains,
-                        response=response,
-                        min_tokens=HISTORY_MIN_TOKENS,
-                        max_tokens=HISTORY_MAX_TOKENS,
-                    ),
+                    [
+                        cmd,
+                        SummarizeCommand(
+                            chains,
+                            response=response,
+                            min_tokens=HISTORY_MIN_TOKENS,
+                            max_tokens=HISTORY_MAX_TOKENS,
+                        ),
+                    ],
                 )
 
             except Exception as e:
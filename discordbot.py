@@ -1,6 +1,23 @@
 import discord
-from storyteller.engine import FileStoryRepository, StoryEngine, Chains, create_prompts
-from storyteller.common import load_file, add_standard_model_args, init_model
+from storyteller.engine import (
+    FileStoryRepository,
+    StoryEngine,
+    StoryRepository,
+    Chains,
+    create_prompts,
+)
+from storyteller.sqlite import SqliteStoryRepository
+from storyteller.cache import StoryCache, FlushPolicy
+from storyteller.scheduler import SummaryScheduler
+from storyteller.responsecache import ResponseCache
+from storyteller.looplag import LoopLagMonitor
+from storyteller.storyqueue import StoryQueues
+from storyteller.common import (
+    load_file,
+    add_standard_model_args,
+    init_model,
+    init_routes,
+)
 import storyteller.commands
 import re
 import os
@@ -10,6 +27,7 @@ from threading import Lock
 from dotenv import load_dotenv
 import bot.commands as bot_commands
 import argparse
+import asyncio
 
 load_dotenv()
 
@@ -22,10 +40,22 @@ client = discord.Client(intents=intents)
 COMMAND_REGEX = re.compile(r"^~(\w+)(?:\s+)?([\s\S]*)$", re.MULTILINE)
 HISTORY_MIN_TOKENS = int(os.getenv("HISTORY_MIN_TOKENS", "1024"))
 HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "4096"))
+SUMMARY_DEBOUNCE_MS = int(os.getenv("SUMMARY_DEBOUNCE_MS", "1500"))
 
 STORE_DIR = os.path.expanduser("~/story_repo")
 PROMPT_DIR = os.getenv("PROMPT_DIR", "prompts/storyteller/prompts")
 STORY_DIR = os.getenv("STORY_DIR", "prompts/storyteller/stories/genfantasy")
+STORY_JOURNAL = os.getenv("STORY_JOURNAL", "false").lower() == "true"
+STORY_BACKEND = os.getenv("STORY_BACKEND", "file")
+STORY_CACHE_MB = int(os.getenv("STORY_CACHE_MB", "0"))
+STORY_CACHE_FLUSH = os.getenv("STORY_CACHE_FLUSH", "every_command")
+STORY_CACHE_FLUSH_MS = int(os.getenv("STORY_CACHE_FLUSH_MS", "1000"))
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", "")
+RESPONSE_CACHE_TTL_S = int(os.getenv("RESPONSE_CACHE_TTL_S", "86400"))
+RESPONSE_CACHE_MB = int(os.getenv("RESPONSE_CACHE_MB", "64"))
+CHAT_CANDIDATES = int(os.getenv("CHAT_CANDIDATES", "1"))
+STORY_QUEUE_DEPTH = int(os.getenv("STORY_QUEUE_DEPTH", "8"))
+STORY_QUEUE_TIMEOUT_S = int(os.getenv("STORY_QUEUE_TIMEOUT_S", "120"))
 
 
 class ChannelConfig(BaseModel):
@@ -81,11 +111,39 @@ async def on_ready():
 
 parser = argparse.ArgumentParser(description="Tell a story")
 add_standard_model_args(parser)
-model = init_model(parser.parse_args())
-
-story_repository = FileStoryRepository(STORE_DIR)
-story_engine = StoryEngine(story_repository)
-chains = Chains(model, prompts)
+args = parser.parse_args()
+model = init_model(args)
+
+story_repository: StoryRepository
+if STORY_BACKEND == "sqlite":
+    story_repository = SqliteStoryRepository(os.path.join(STORE_DIR, "stories.db"))
+else:
+    story_repository = FileStoryRepository(STORE_DIR, journaled=STORY_JOURNAL)
+story_cache = (
+    StoryCache(
+        STORY_CACHE_MB * 1024 * 1024,
+        FlushPolicy(STORY_CACHE_FLUSH),
+        STORY_CACHE_FLUSH_MS,
+    )
+    if STORY_CACHE_MB > 0
+    else None
+)
+story_engine = StoryEngine(
+    story_repository,
+    story_cache,
+    StoryQueues(STORY_QUEUE_DEPTH, STORY_QUEUE_TIMEOUT_S),
+)
+response_cache = (
+    ResponseCache(
+        RESPONSE_CACHE_DIR, RESPONSE_CACHE_TTL_S, RESPONSE_CACHE_MB * 1024 * 1024
+    )
+    if RESPONSE_CACHE_DIR
+    else None
+)
+chains = Chains(model, prompts, init_routes(args), response_cache)
+summary_scheduler = SummaryScheduler(
+    chains, HISTORY_MIN_TOKENS, HISTORY_MAX_TOKENS, SUMMARY_DEBOUNCE_MS
+)
 
 channel_configs = ChannelConfigRegistry(STORE_DIR)
 
@@ -119,10 +177,10 @@ chargen_prompt = load_file(STORY_DIR, STORY_DIR, "chargen.md")
 
 story_commands: dict[str, bot_commands.BotCommand] = {
     "newstory": bot_commands.NewStoryCommand(
-        set_channel_story, story_repository, chargen_prompt
+        set_channel_story, story_engine.story_repository, chargen_prompt
     ),
-    "s": bot_commands.WriteStoryCommand(),
-    "retry": bot_commands.RetryCommand(),
+    "s": bot_commands.WriteStoryCommand(CHAT_CANDIDATES),
+    "retry": bot_commands.RetryCommand(CHAT_CANDIDATES),
     "rewind": bot_commands.RewindCommand(),
     "fix": bot_commands.FixCommand(fix_prompt=prompts.fix_prompt),
     "replace": bot_commands.ReplaceCommand(),
@@ -130,13 +188,13 @@ story_commands: dict[str, bot_commands.BotCommand] = {
     "about": bot_commands.AboutCommand(model.model_name),
     "yolo": bot_commands.YoloCommand(set_channel_yolo, get_channel_yolo),
     "ooc": bot_commands.OocCommand(),
-    "dump": bot_commands.DumpStoryCommand(story_repository),
+    "dump": bot_commands.DumpStoryCommand(),
 }
 story_commands["help"] = bot_commands.HelpCommand(story_commands)
 
 no_story_commands: dict[str, bot_commands.BotCommand] = {
     "newstory": bot_commands.NewStoryCommand(
-        set_channel_story, story_repository, chargen_prompt
+        set_channel_story, story_engine.story_repository, chargen_prompt
     ),
     "yolo": bot_commands.YoloCommand(set_channel_yolo, get_channel_yolo),
     "about": bot_commands.AboutCommand(model.model_name),
@@ -149,19 +207,10 @@ dm_commands: dict[str, bot_commands.BotCommand] = {
 dm_commands["help"] = bot_commands.HelpCommand(story_commands)
 
 
-async def _run_summary(
-    story_id: str | None,
-    story_engine: StoryEngine,
-    chains: Chains,
-    channel: discord.TextChannel,
-) -> None:
+def _schedule_summary(story_id: str | None, channel: discord.TextChannel) -> None:
     if story_id:
-        response = bot_commands.SummaryDiscordResponse(channel)
-        await story_engine.run_command(
-            story_id,
-            storyteller.commands.SummarizeCommand(
-                chains, response, HISTORY_MIN_TOKENS, HISTORY_MAX_TOKENS
-            ),
+        summary_scheduler.schedule(
+            story_engine, story_id, bot_commands.SummaryDiscordResponse(channel)
         )
 
 
@@ -197,15 +246,33 @@ async def on_message(message):
                 ctx = bot_commands.CommandContext(
                     story_id, message, story_engine, chains
                 )
+                if story_id:
+                    await summary_scheduler.wait_for_running(story_id)
                 await cmd_dict[command].execute(ctx, args)
-                await _run_summary(story_id, story_engine, chains, message.channel)
+                _schedule_summary(story_id, message.channel)
         elif cfg and cfg.yolo_mode:
             ctx = bot_commands.CommandContext(story_id, message, story_engine, chains)
+            await summary_scheduler.wait_for_running(story_id)
             await cmd_dict["s"].execute(ctx, content)
-            await _run_summary(story_id, story_engine, chains, message.channel)
+            _schedule_summary(story_id, message.channel)
     except Exception as e:
         await message.channel.send(f"Error: {e}")
         raise e
 
 
-client.run(os.getenv("DISCORD_TOKEN"))
+async def main():
+    async with client:
+        # Logs a warning whenever something holds up the event loop.
+        loop_lag = LoopLagMonitor()
+        loop_lag.start()
+        try:
+            await client.start(os.getenv("DISCORD_TOKEN"))
+        finally:
+            await loop_lag.stop()
+            # Finish any pending summaries, then write back anything still
+            # in the story cache.
+            await summary_scheduler.drain()
+            await story_engine.close()
+
+
+asyncio.run(main())
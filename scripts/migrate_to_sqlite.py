@@ -0,0 +1,26 @@
+import argparse
+import os
+from storyteller.engine import FileStoryRepository
+from storyteller.sqlite import SqliteStoryRepository, import_file_repository
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Import the story-*.json files in each repository directory into a SQLite database"
+    )
+    parser.add_argument(
+        "repo_dirs", nargs="+", help="Story repository directories to import"
+    )
+    parser.add_argument(
+        "--db-name",
+        default="stories.db",
+        help="Name of the database file created in each directory (default: stories.db)",
+    )
+    args = parser.parse_args()
+
+    for repo_dir in args.repo_dirs:
+        repo_dir = os.path.expanduser(repo_dir)
+        imported = import_file_repository(
+            FileStoryRepository(repo_dir),
+            SqliteStoryRepository(os.path.join(repo_dir, args.db_name)),
+        )
+        print(f"{repo_dir}: imported {len(imported)} stories")
@@ -0,0 +1,145 @@
+from .models import Story
+
+from pydantic import BaseModel
+from enum import StrEnum
+from collections import OrderedDict
+from collections.abc import Hashable
+
+import time
+
+
+class FlushPolicy(StrEnum):
+    """When a story engine writes changed stories in its cache back to the
+    repository. Whatever the policy, changed stories are also written when
+    they are evicted from the cache, and when the engine is closed."""
+
+    EveryCommand = "every_command"
+    Interval = "interval"
+    OnEviction = "on_eviction"
+
+
+class CacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    flushes: int = 0
+    stories: int = 0
+    size: int = 0
+
+
+class CachedStory:
+    def __init__(self, story: Story, size: int, dirty: bool, version: Hashable = None):
+        self.story = story
+        self.size = size
+        self.dirty = dirty
+        self.dirty_since = time.monotonic() if dirty else None
+        # The repository's version of the story this was loaded from or
+        # last written back as.
+        self.version = version
+
+
+def approximate_size(story: Story) -> int:
+    """A cheap estimate of the memory a story takes, in characters of text."""
+    return (
+        sum(len(str(message.content)) for message in story.current_messages)
+        + sum(len(str(message.content)) for message in story.old_messages)
+        + sum(len(c.name) + len(c.role) + len(c.bio) for c in story.characters)
+        + sum(len(s.time_and_location) + len(s.events) for s in story.scenes)
+        + sum(len(c.title) + len(c.summary) for c in story.chapters)
+    )
+
+
+class StoryCache:
+    """An LRU cache of loaded stories, bounded by their approximate size.
+
+    The cache only does the bookkeeping: it's up to the story engine to
+    write back the dirty stories it evicts."""
+
+    def __init__(
+        self,
+        max_size: int,
+        flush_policy: FlushPolicy = FlushPolicy.EveryCommand,
+        flush_interval_ms: int = 1000,
+    ):
+        self.max_size = max_size
+        self.flush_policy = flush_policy
+        self.flush_interval_ms = flush_interval_ms
+        self.entries: OrderedDict[str, CachedStory] = OrderedDict()
+        self.size = 0
+        self.stats = CacheStats()
+
+    def get(self, story_id: str) -> Story | None:
+        entry = self.entries.get(story_id)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        self.entries.move_to_end(story_id)
+        return entry.story
+
+    def put(
+        self, story_id: str, story: Story, dirty: bool, version: Hashable = None
+    ) -> None:
+        previous = self.entries.pop(story_id, None)
+        if previous is not None:
+            self.size -= previous.size
+            if previous.dirty and dirty:
+                # Keep the time of the oldest unflushed change.
+                entry = CachedStory(
+                    story, approximate_size(story), dirty, previous.version
+                )
+                entry.dirty_since = previous.dirty_since
+                self._add(story_id, entry)
+                return
+
+        self._add(story_id, CachedStory(story, approximate_size(story), dirty, version))
+
+    def _add(self, story_id: str, entry: CachedStory) -> None:
+        self.entries[story_id] = entry
+        self.size += entry.size
+
+    def mark_clean(self, story_id: str, story: Story, version: Hashable = None) -> None:
+        """Record that a story was written back, as the given version,
+        unless it has changed again since."""
+        entry = self.entries.get(story_id)
+        if entry is not None and entry.story is story:
+            entry.dirty = False
+            entry.dirty_since = None
+            entry.version = version
+            self.stats.flushes += 1
+
+    def remove(self, story_id: str) -> None:
+        entry = self.entries.pop(story_id, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def eviction_candidates(self) -> list[tuple[str, CachedStory]]:
+        """The least recently used stories that need to go to bring the
+        cache back under its size limit."""
+        candidates = []
+        excess = self.size - self.max_size
+        for story_id, entry in self.entries.items():
+            if excess <= 0:
+                break
+            candidates.append((story_id, entry))
+            excess -= entry.size
+        return candidates
+
+    def evict(self, story_id: str) -> None:
+        self.remove(story_id)
+        self.stats.evictions += 1
+
+    def dirty(self, older_than_ms: int = 0) -> list[tuple[str, CachedStory]]:
+        cutoff = time.monotonic() - older_than_ms / 1000
+        return [
+            (story_id, entry)
+            for story_id, entry in self.entries.items()
+            if entry.dirty and entry.dirty_since is not None
+            if entry.dirty_since <= cutoff
+        ]
+
+    def current_stats(self) -> CacheStats:
+        return self.stats.model_copy(
+            update={"stories": len(self.entries), "size": self.size}
+        )
@@ -1,4 +1,7 @@
 from .engine import Command, Chains, Response, run_chat
+from .taskgraph import TaskGraph
+from .render import story_context
+from .responsecache import BYPASS_CACHE
 from .models import (
     Character,
     Scenes,
@@ -8,68 +11,115 @@ from .models import (
     Scene,
     OpeningSuggestions,
 )
+from .tokens import TokenLedger, Tokenizer, approximate_tokens
 from langchain_core.messages import BaseMessage, AIMessage, HumanMessage
-from langchain_core.messages.utils import count_tokens_approximately
+
+import asyncio
+import contextlib
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class CommandError(Exception):
     pass
 
 
-def _make_chapters(chapters: list[Chapter]):
-    summary = ""
-    for idx, chapter in enumerate(chapters):
-        summary = (
-            summary + f"## Chapter {idx + 1}: {chapter.title}\n {chapter.summary}\n\n"
-        )
+class _HiddenResponse(Response):
+    """Response for candidates that the user only sees if they retry."""
 
-    return summary
+    async def send_message(self, msg: str):
+        pass
 
+    async def start_stream(self):
+        pass
 
-def _make_scenes(scenes: list[Scene]):
-    summary = ""
-    for idx, scene in enumerate(scenes):
-        summary = summary + f"### {scene.time_and_location}\n{scene.events}\n\n"
+    async def end_stream(self):
+        pass
 
-    return summary
+    async def append(self, msg: str):
+        pass
 
 
 class ChatCommand(Command):
-    def __init__(self, chains: Chains, response: Response, user_input: str):
+    def __init__(
+        self,
+        chains: Chains,
+        response: Response,
+        user_input: str,
+        candidates: int = 1,
+    ):
         self.chains: Chains = chains
         self.response: Response = response
         self.user_input: str = user_input
+        self.candidates: int = candidates
 
     async def run(self, story: Story) -> None:
-        chat_chain = self.chains.chat_chain
-        merged = await run_chat(
-            chat_chain=chat_chain,
-            context={
-                "characters": story.characters,
-                "scenes": f"## Chapter {len(story.chapters) + 1}\n\n {_make_scenes(story.scenes)}",
-                "chapters": _make_chapters(story.chapters),
-            },
-            current_messages=story.current_messages,
-            user_input=self.user_input,
-            response=self.response,
-        )
+        context = story_context(story).render(story)
+
+        def generate(response: Response):
+            return run_chat(
+                chat_chain=self.chains.chat_chain,
+                context=context,
+                current_messages=story.current_messages,
+                user_input=self.user_input,
+                response=response,
+            )
 
+        # Extra candidates are generated alongside the one streamed to the
+        # user, and kept for RetryCommand to swap in.
+        extras = asyncio.gather(
+            *[generate(_HiddenResponse()) for _ in range(self.candidates - 1)],
+            return_exceptions=True,
+        )
+        try:
+            merged = await generate(self.response)
+        except BaseException:
+            extras.cancel()
+            # Wait for the extras to stop, so their errors are retrieved
+            # and none of them keep running after the command has failed.
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await extras
+            raise
+
+        alternatives = []
+        for candidate in await extras:
+            if isinstance(candidate, BaseException):
+                logger.warning(
+                    f"Generating an alternative response failed: {candidate}"
+                )
+            elif len(candidate) == 1:
+                alternatives.append(candidate[0])
+
+        story.alternatives = alternatives
         story.current_messages.append(HumanMessage(self.user_input))
         story.current_messages.extend(merged)
 
 
 class RetryCommand(Command):
-    def __init__(self, chains: Chains, response: Response):
+    def __init__(self, chains: Chains, response: Response, candidates: int = 1):
         self.chains = chains
         self.response = response
+        self.candidates = candidates
 
     async def run(self, story: Story):
         if len(story.current_messages) < 2:
             raise CommandError("There is no message to retry!")
 
+        if story.alternatives:
+            alternative = story.alternatives[0]
+            story.alternatives = story.alternatives[1:]
+            story.current_messages[-1] = alternative
+            await self.response.start_stream()
+            await self.response.append(alternative.text())
+            await self.response.end_stream()
+            return
+
         user_input = story.current_messages[-2]
         story.current_messages = story.current_messages[0:-2]
-        await ChatCommand(self.chains, self.response, user_input.text()).run(story)
+        await ChatCommand(
+            self.chains, self.response, user_input.text(), self.candidates
+        ).run(story)
 
 
 class RewindCommand(Command):
@@ -83,6 +133,7 @@ class RewindCommand(Command):
 
         await self.response.send_message("⌛ Rewinding…\n\n")
         story.current_messages = story.current_messages[0:-2]
+        story.alternatives = []
 
         if len(story.current_messages) > 0:
             await self.response.send_message(
@@ -107,11 +158,7 @@ class FixCommand(Command):
 
         fixed = await run_chat(
             self.chains.chat_chain,
-            {
-                "characters": story.characters,
-                "scenes": f"## Chapter {len(story.chapters) + 1}\n\n {_make_scenes(story.scenes)}",
-                "chapters": _make_chapters(story.chapters),
-            },
+            story_context(story).render(story),
             story.current_messages,
             self.fix_prompt.format(instruction=self.instruction),
             self.response,
@@ -119,6 +166,7 @@ class FixCommand(Command):
 
         story.current_messages.pop()
         story.current_messages.extend(fixed)
+        story.alternatives = []
 
 
 class ReplaceCommand(Command):
@@ -131,6 +179,7 @@ class ReplaceCommand(Command):
             raise CommandError("There is no message to rewrite!")
 
         story.current_messages[-1] = AIMessage(self.text)
+        story.alternatives = []
         await self.response.send_message(
             f"📖 Last response rewritten to:\n\n{self.text}"
         )
@@ -138,30 +187,40 @@ class ReplaceCommand(Command):
 
 class SummarizeCommand(Command):
     def __init__(
-        self, chains: Chains, response: Response, min_tokens: int, max_tokens: int
+        self,
+        chains: Chains,
+        response: Response,
+        min_tokens: int,
+        max_tokens: int,
+        tokenizer: Tokenizer = approximate_tokens,
     ):
         self.chains = chains
         self.response = response
         self.min_tokens = min_tokens
         self.max_tokens = max_tokens
+        self.tokenizer = tokenizer
 
-    def trim(self, messages: list[BaseMessage]):
-        old = []
-        remaining = messages.copy()
+    def trim(self, messages: list[BaseMessage], ledger: TokenLedger | None = None):
+        if ledger is None:
+            ledger = TokenLedger(self.tokenizer).sync(messages)
 
-        if count_tokens_approximately(remaining) > self.max_tokens:
-            while count_tokens_approximately(remaining) > self.min_tokens:
-                old.append(remaining.pop(0))
+        split = 0
+        if ledger.total > self.max_tokens:
+            split = ledger.split_point(self.min_tokens)
 
-        return (old, remaining)
+        return (messages[:split], messages[split:])
 
-    async def update_scenes(
-        self, old_scenes: list[Scene], messages, msg_count: int
-    ) -> list[Scene]:
-        await self.response.send_message(
-            f"⌛ Pruning {len(messages)} of {msg_count} messages: updating scene summaries…"
+    def prune(self, story: Story) -> list[BaseMessage]:
+        """Move the oldest messages out of the story's current messages,
+        returning the pruned messages."""
+        pruned_messages, remaining_messages = self.trim(
+            story.current_messages, story.token_ledger(self.tokenizer)
         )
+        story.current_messages = remaining_messages
+        story.old_messages.extend(pruned_messages)
+        return pruned_messages
 
+    async def update_scenes(self, old_scenes: list[Scene], messages) -> list[Scene]:
         scene_dump = "\n\n".join(
             [f"## {scene.time_and_location}\n{scene.events}" for scene in old_scenes]
         )
@@ -174,12 +233,8 @@ class SummarizeCommand(Command):
         return response.scenes
 
     async def update_characters(
-        self, old_characters: list[Character], messages, msg_count: int
+        self, old_characters: list[Character], messages
     ) -> list[Character]:
-        await self.response.send_message(
-            f"⌛ Pruning {len(messages)} of {msg_count} messages: Updating character bios…"
-        )
-
         character_dump = "\n\n".join(
             [
                 f"## {character.name} ({character.role})\n{character.bio}"
@@ -193,20 +248,43 @@ class SummarizeCommand(Command):
         )
         return response.characters
 
+    def add_update_steps(
+        self, graph: TaskGraph, story: Story, pruned_messages, msg_count: int
+    ) -> None:
+        """Add the "scenes" and "characters" steps, which summarize the
+        pruned messages into new scenes and character bios. Neither depends
+        on the other, so they run concurrently."""
+        graph.add(
+            "scenes",
+            lambda: self.update_scenes(story.scenes, pruned_messages),
+            progress=lambda: self.response.send_message(
+                f"⌛ Pruning {len(pruned_messages)} of {msg_count} messages: updating scene summaries…"
+            ),
+        )
+        graph.add(
+            "characters",
+            lambda: self.update_characters(story.characters, pruned_messages),
+            progress=lambda: self.response.send_message(
+                f"⌛ Pruning {len(pruned_messages)} of {msg_count} messages: Updating character bios…"
+            ),
+        )
+
+    def needs_pruning(self, story: Story) -> bool:
+        return story.token_ledger(self.tokenizer).total > self.max_tokens
+
     async def run(self, story: Story) -> None:
-        if count_tokens_approximately(story.current_messages) > self.max_tokens:
+        if self.needs_pruning(story):
             msg_count = len(story.current_messages)
             scene_count = len(story.scenes)
             char_count = len(story.characters)
-            pruned_messages, remaining_messages = self.trim(story.current_messages)
-            story.current_messages = remaining_messages
-            story.old_messages.extend(pruned_messages)
-            story.scenes = await self.update_scenes(
-                story.scenes, pruned_messages, msg_count
-            )
-            story.characters = await self.update_characters(
-                story.characters, pruned_messages, msg_count
-            )
+            pruned_messages = self.prune(story)
+
+            graph = TaskGraph()
+            self.add_update_steps(graph, story, pruned_messages, msg_count)
+            results = await graph.run()
+
+            story.scenes = results["scenes"]
+            story.characters = results["characters"]
             await self.response.send_message(
                 f"📖 Pruned {len(pruned_messages)} of {msg_count} messages. Scenes {scene_count}→{len(story.scenes)}. Characters {char_count}→{len(story.characters)}."
             )
@@ -225,12 +303,9 @@ class CloseChapterCommand(Command):
         self.chapter_response = chapter_response
         self.chapter_title = chapter_title
 
-    async def close_chapter(self, story: Story):
-        await self.chapter_response.send_message(
-            f"⏳ Closing chapter {len(story.chapters) + 1}…"
-        )
+    async def close_chapter(self, scenes: list[Scene]) -> Chapter:
         scene_dump = "\n\n".join(
-            [f"## {scene.time_and_location}\n{scene.events}" for scene in story.scenes]
+            [f"## {scene.time_and_location}\n{scene.events}" for scene in scenes]
         )
 
         response: Chapter = await self.chains.chapter_chain.ainvoke(
@@ -242,16 +317,55 @@ class CloseChapterCommand(Command):
         if self.chapter_title:
             response.title = self.chapter_title
 
-        story.chapters.append(response)
+        return response
+
+    async def run(self, story: Story) -> None:
+        # Summarize everything that's left into scenes, then summarize the
+        # scenes into the chapter. Character bios are updated alongside.
+        summarize = SummarizeCommand(self.chains, self.summary_response, 0, 0)
+        graph = TaskGraph()
+
+        async def closing_progress():
+            await self.chapter_response.send_message(
+                f"⏳ Closing chapter {len(story.chapters) + 1}…"
+            )
+
+        pruned_messages = None
+        if summarize.needs_pruning(story):
+            msg_count = len(story.current_messages)
+            scene_count = len(story.scenes)
+            char_count = len(story.characters)
+            pruned_messages = summarize.prune(story)
+            summarize.add_update_steps(graph, story, pruned_messages, msg_count)
+            graph.add(
+                "chapter",
+                self.close_chapter,
+                after=["scenes"],
+                progress=closing_progress,
+            )
+        else:
+            graph.add(
+                "chapter",
+                lambda: self.close_chapter(story.scenes),
+                progress=closing_progress,
+            )
+
+        results = await graph.run()
+
+        if pruned_messages is not None:
+            story.characters = results["characters"]
+            await self.summary_response.send_message(
+                f"📖 Pruned {len(pruned_messages)} of {msg_count} messages. Scenes {scene_count}→{len(results['scenes'])}. Characters {char_count}→{len(story.characters)}."
+            )
+
+        chapter = results["chapter"]
+        story.chapters.append(chapter)
         story.scenes = []
+        story.alternatives = []
         await self.chapter_response.send_message(
-            f"📖 Closed chapter {len(story.chapters)}: {response.title}"
+            f"📖 Closed chapter {len(story.chapters)}: {chapter.title}"
         )
 
-    async def run(self, story: Story) -> None:
-        await SummarizeCommand(self.chains, self.summary_response, 0, 0).run(story)
-        await self.close_chapter(story)
-
 
 class GenerateCharactersCommand(Command):
     def __init__(self, chains: Chains, response: Response, prompt: str):
@@ -260,8 +374,9 @@ class GenerateCharactersCommand(Command):
         self.prompt = prompt
 
     async def make_characters(self, descriptions: str) -> list[Character]:
+        # The same descriptions should still give a new party each time.
         response: Characters = await self.chains.character_create_chain.ainvoke(
-            {"characters": descriptions}
+            {"characters": descriptions}, BYPASS_CACHE
         )
         return response.characters
 
@@ -281,8 +396,9 @@ class SuggestOpeningCommand(Command):
 
     async def run(self, story: Story) -> None:
         suggestions: OpeningSuggestions = (
+            # Asking again should give new suggestions.
             await self.chains.opening_suggestions_chain.ainvoke(
-                {"characters": story.characters}
+                {"characters": story.characters}, BYPASS_CACHE
             )
         )
 
@@ -1,6 +1,8 @@
 import argparse
 import os
 from langchain.chat_models import init_chat_model
+from langchain_core.language_models.base import BaseLanguageModel
+from .routing import BACKGROUND_ROLES, ChainRole
 
 default_models = {
     "openai": "gpt-4.1-mini",
@@ -43,25 +45,67 @@ def add_standard_model_args(parser: argparse.ArgumentParser) -> None:
         default=1.0,
         help="Temperature for model generation (default: 1.0)",
     )
+    parser.add_argument(
+        "--route",
+        type=str,
+        action="append",
+        default=[route for route in os.getenv("STORY_ROUTES", "").split(",") if route],
+        metavar="ROLE=PROVIDER[:MODEL]",
+        help=f"Route a chain to its own model, e.g. background=openai:gpt-4.1-nano. Roles: {', '.join(ChainRole)}, or background for all summaries. Defaults to $STORY_ROUTES (comma-separated)",
+    )
 
 
-def init_model(args: argparse.Namespace):
-    if not args.model and args.provider in default_models:
-        args.model = default_models[args.provider]
+def _init_chat_model(provider: str, model: str | None, temperature: float):
+    if not model and provider in default_models:
+        model = default_models[provider]
 
-    if args.provider == "google":
-        args.provider = "google_genai"
+    if provider == "google":
+        provider = "google_genai"
 
     # Anthropic defaults to 1024 max response tokens, which is only about 800 words so you can hit
     # token limits pretty easily.
-    if args.provider == "anthropic":
+    if provider == "anthropic":
         return init_chat_model(
-            model=args.model,
-            model_provider=args.provider,
-            temperature=args.temperature,
+            model=model,
+            model_provider=provider,
+            temperature=temperature,
             max_tokens=4000,
         )
     else:
         return init_chat_model(
-            model=args.model, model_provider=args.provider, temperature=args.temperature
+            model=model, model_provider=provider, temperature=temperature
         )
+
+
+def init_model(args: argparse.Namespace):
+    return _init_chat_model(args.provider, args.model, args.temperature)
+
+
+def init_routes(args: argparse.Namespace) -> dict[ChainRole, BaseLanguageModel]:
+    """Models for the chain roles given in --route. Roles without a route
+    use the default model from init_model."""
+    routes = {}
+    models = {}
+    for route in args.route or []:
+        role, sep, target = route.partition("=")
+        if not sep or not target:
+            raise ValueError(f"Invalid route {route}, expected ROLE=PROVIDER[:MODEL]")
+
+        # Later routes override earlier ones, so flags override $STORY_ROUTES.
+        if role == "background":
+            roles = BACKGROUND_ROLES
+        else:
+            try:
+                roles = [ChainRole(role)]
+            except ValueError:
+                raise ValueError(
+                    f"Invalid role {role} in route {route}, expected one of "
+                    f"{', '.join(ChainRole)} or background"
+                ) from None
+        if target not in models:
+            provider, _, model = target.partition(":")
+            models[target] = _init_chat_model(provider, model or None, args.temperature)
+        for chain_role in roles:
+            routes[chain_role] = models[target]
+
+    return routes
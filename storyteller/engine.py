@@ -6,10 +6,18 @@ from langchain_core.prompts import (
     ChatPromptTemplate,
     MessagesPlaceholder,
 )
+from langchain_core.messages import SystemMessage
 from langchain_core.messages.utils import merge_message_runs
-from langchain_core.messages.ai import AIMessageChunk, add_ai_message_chunks
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import RunnableConfig, RunnableLambda, RunnablePassthrough
+from langchain_core.messages.ai import (
+    AIMessageChunk,
+    UsageMetadata,
+    add_ai_message_chunks,
+)
 
 from .models import (
+    ArchivedMessages,
     Story,
     StoryIndex,
     Scenes,
@@ -19,17 +27,39 @@ from .models import (
     OpeningSuggestions,
 )
 from .common import load_file
+from .responsecache import (
+    ResponseCache,
+    ResponseCacheStats,
+    bypasses_cache,
+    response_key,
+)
+from .routing import ChainLatency, ChainRole, LatencyTracker
+from .cache import CacheStats, FlushPolicy, StoryCache
+from .storyqueue import StoryQueues, StoryQueueStats
+from . import locking
 
 from pydantic import BaseModel, TypeAdapter
 from typing import TypeVar
-from collections.abc import Sequence
-from threading import Lock
+from string import Formatter
+from collections.abc import Callable, Hashable, Iterator, Sequence
+from contextlib import contextmanager
+from threading import Lock, get_ident
 from pathlib import Path
 from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
+import asyncio
+import gzip
+import json
+import logging
 import os
+import time
 
 _BM = TypeVar("_BM", bound=BaseModel)
+_T = TypeVar("_T")
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_PROMPT_DIR = "prompts/storyteller/prompts"
 
@@ -56,7 +86,130 @@ class StoryBackedMessageHistory(BaseChatMessageHistory):
         self.messages = []
 
 
-def make_chat_chain(llm: BaseLanguageModel, base_prompt: str):
+# Sections of the story context that change whenever the story is
+# summarized. Everything in the chat prompt before the first of them is a
+# stable prefix, which providers can cache.
+VOLATILE_SECTIONS = {"scenes"}
+# Anthropic allows at most four cache breakpoints in a request. One of
+# them goes on the chat history, the rest on the system prompt.
+MAX_CACHE_BREAKPOINTS = 4
+
+
+def split_prompt(prompt: str) -> list[tuple[str, bool]]:
+    """Split a prompt template into segments that each end with one of its
+    placeholders, flagging the segments in the stable prefix."""
+    segments: list[tuple[str, bool]] = []
+    stable = True
+    text = ""
+    for literal, field, spec, conversion in Formatter().parse(prompt):
+        text += literal.replace("{", "{{").replace("}", "}}")
+        if field is None:
+            continue
+
+        stable = stable and field not in VOLATILE_SECTIONS
+        conversion = f"!{conversion}" if conversion else ""
+        spec = f":{spec}" if spec else ""
+        segments.append((text + "{" + field + conversion + spec + "}", stable))
+        text = ""
+
+    if text and segments:
+        segments[-1] = (segments[-1][0] + text, segments[-1][1] and stable)
+    elif text:
+        segments.append((text, stable))
+    return segments
+
+
+def supports_cache_markers(llm: BaseLanguageModel) -> bool:
+    """Whether the model takes explicit cache breakpoints. Providers that
+    cache prompt prefixes automatically, like OpenAI, only need the prefix
+    to stay the same."""
+    return getattr(llm, "_llm_type", None) == "anthropic-chat"
+
+
+def make_cached_system_prompt(base_prompt: str):
+    """A function that renders the system prompt as one content block per
+    segment, with a cache breakpoint after each stable one."""
+    segments = [
+        (PromptTemplate.from_template(text), stable)
+        for text, stable in split_prompt(base_prompt)
+    ]
+
+    def render(inputs: dict) -> list[BaseMessage]:
+        blocks: list[dict] = []
+        stable_blocks: list[int] = []
+        blank = ""
+        for template, stable in segments:
+            text = template.format(
+                **{name: inputs[name] for name in template.input_variables}
+            )
+            if not text.strip():
+                # Providers reject blank content blocks, so blank segments
+                # are joined to a neighbouring block.
+                if blocks:
+                    blocks[-1]["text"] += text
+                else:
+                    blank += text
+                continue
+            if stable:
+                stable_blocks.append(len(blocks))
+            blocks.append({"type": "text", "text": blank + text})
+            blank = ""
+
+        if not blocks:
+            return []
+        for idx in stable_blocks[-(MAX_CACHE_BREAKPOINTS - 1) :]:
+            blocks[idx]["cache_control"] = {"type": "ephemeral"}
+        content: list[str | dict] = [*blocks]
+        return [SystemMessage(content)]
+
+    return render
+
+
+def mark_cached_history(inputs: dict) -> list[BaseMessage]:
+    """The chat history with a cache breakpoint on its last message, which
+    stays the same in later turns. The story's own messages are left
+    unmarked."""
+    history: list[BaseMessage] = list(inputs["chat_history"])
+    for idx in reversed(range(len(history))):
+        message = history[idx]
+        if isinstance(message.content, str):
+            if not message.content.strip():
+                continue
+            blocks: list[str | dict] = [{"type": "text", "text": message.content}]
+        else:
+            blocks = list(message.content)
+        last = blocks[-1] if blocks else None
+        if not isinstance(last, dict):
+            continue
+        blocks[-1] = {**last, "cache_control": {"type": "ephemeral"}}
+        history[idx] = message.model_copy(update={"content": blocks})
+        break
+    return history
+
+
+def make_chat_chain(
+    llm: BaseLanguageModel, base_prompt: str, cache_markers: bool | None = None
+):
+    if cache_markers is None:
+        cache_markers = supports_cache_markers(llm)
+
+    if cache_markers:
+        prompt = ChatPromptTemplate.from_messages(
+            [
+                MessagesPlaceholder(variable_name="system"),
+                MessagesPlaceholder(variable_name="chat_history"),
+                ("human", "{input}"),
+            ]
+        )
+        return (
+            RunnablePassthrough.assign(
+                system=make_cached_system_prompt(base_prompt),
+                chat_history=mark_cached_history,
+            )
+            | prompt
+            | llm
+        )
+
     # Create a prompt template
     prompt = ChatPromptTemplate.from_messages(
         [
@@ -75,11 +228,32 @@ def make_basic_chain(model: BaseLanguageModel, prompt: str):
 
 
 def make_structured_chain(
-    model: BaseLanguageModel, prompt: str, output_format: type[_BM]
+    model: BaseLanguageModel,
+    prompt: str,
+    output_format: type[_BM],
+    cache: ResponseCache | None = None,
 ):
-    return PromptTemplate.from_template(prompt) | model.with_structured_output(
-        output_format, method="json_schema"
-    )
+    template = PromptTemplate.from_template(prompt)
+    structured = model.with_structured_output(output_format, method="json_schema")
+    if cache is None:
+        return template | structured
+
+    async def cached(prompt_value: PromptValue, config: RunnableConfig) -> _BM:
+        key = response_key(model, prompt_value, output_format)
+        if bypasses_cache(config):
+            cache.count_bypass()
+        else:
+            hit = await asyncio.to_thread(cache.get, key, output_format)
+            if hit is not None:
+                return hit
+
+        response = output_format.model_validate(
+            await structured.ainvoke(prompt_value, config)
+        )
+        await asyncio.to_thread(cache.put, key, response)
+        return response
+
+    return template | RunnableLambda(cached)
 
 
 def create_prompts(prompt_dir: str) -> Prompts:
@@ -106,29 +280,78 @@ def create_prompts(prompt_dir: str) -> Prompts:
 
 
 class Chains:
-    def __init__(self, model: BaseLanguageModel, prompts: Prompts):
-        self.chat_chain = make_chat_chain(model, prompts.base_prompt)
-        self.summary_chain = make_structured_chain(
-            model, prompts.scene_summary_prompt, Scenes
+    """The chains the story engine uses, each routed to the model for its
+    role: the default model, unless routes says otherwise."""
+
+    def __init__(
+        self,
+        model: BaseLanguageModel,
+        prompts: Prompts,
+        routes: dict[ChainRole, BaseLanguageModel] | None = None,
+        response_cache: ResponseCache | None = None,
+    ):
+        routes = routes or {}
+        self.response_cache = response_cache
+        self.models = {role: routes.get(role, model) for role in ChainRole}
+        self.latency = LatencyTracker()
+
+        self.chat_chain = self._route(
+            ChainRole.Chat,
+            make_chat_chain(self.models[ChainRole.Chat], prompts.base_prompt),
+        )
+        self.summary_chain = self._structured(
+            ChainRole.Summary, prompts.scene_summary_prompt, Scenes
         )
-        self.fix_chain = make_basic_chain(model, prompts.fix_prompt)
-        self.chapter_chain = make_structured_chain(
-            model, prompts.chapter_summary_prompt, Chapter
+        self.fix_chain = self._route(
+            ChainRole.Fix,
+            make_basic_chain(self.models[ChainRole.Fix], prompts.fix_prompt),
         )
-        self.character_bio_chain = make_structured_chain(
-            model, prompts.character_summary_prompt, Characters
+        self.chapter_chain = self._structured(
+            ChainRole.Chapter, prompts.chapter_summary_prompt, Chapter
         )
-        self.character_create_chain = make_structured_chain(
-            model, prompts.character_creation_prompt, Characters
+        self.character_bio_chain = self._structured(
+            ChainRole.CharacterBio, prompts.character_summary_prompt, Characters
         )
-        self.opening_suggestions_chain = make_structured_chain(
-            model, prompts.opening_suggestions_prompt, OpeningSuggestions
+        self.character_create_chain = self._structured(
+            ChainRole.CharacterCreate, prompts.character_creation_prompt, Characters
+        )
+        self.opening_suggestions_chain = self._structured(
+            ChainRole.OpeningSuggestions,
+            prompts.opening_suggestions_prompt,
+            OpeningSuggestions,
         )
 
+    def _route(self, role: ChainRole, chain: Runnable) -> Runnable:
+        return chain.with_config(self.latency.track(role, self.models[role]))
+
+    def _structured(
+        self, role: ChainRole, prompt: str, output_format: type[BaseModel]
+    ) -> Runnable:
+        return self._route(
+            role,
+            make_structured_chain(
+                self.models[role], prompt, output_format, self.response_cache
+            ),
+        )
+
+    def response_cache_stats(self) -> ResponseCacheStats | None:
+        if self.response_cache is None:
+            return None
+        return self.response_cache.current_stats()
+
+    def latency_stats(self) -> dict[ChainRole, ChainLatency]:
+        return self.latency.current_stats()
+
+
+# Repositories define a list() method, which shadows the builtin in their
+# class bodies.
+Messages = list[BaseMessage]
+
 
 class StoryRepository(ABC):
     @abstractmethod
-    def list(self) -> list[StoryIndex]:
+    def list(self, offset: int = 0, limit: int | None = None) -> list[StoryIndex]:
+        """Stories in the repository, most recently modified first."""
         pass
 
     @abstractmethod
@@ -151,6 +374,34 @@ class StoryRepository(ABC):
     def save(self, story_id: str, story: Story) -> None:
         pass
 
+    def load_old_messages(self, story_id: str, story: Story) -> Messages:
+        """All of a story's old messages, including any that have been
+        moved into cold storage."""
+        return story.old_messages
+
+    def version(self, story_id: str) -> Hashable:
+        """A value that changes whenever the story is saved, by this process
+        or any other, so that a copy kept in memory can be checked before
+        it's used. None if the repository can't tell."""
+        return None
+
+    def close(self) -> None:
+        """Release anything held open, such as database connections. The
+        repository can still be used afterwards."""
+        pass
+
+    def export(self, story_id: str) -> Story:
+        """Load a story with its complete message history, e.g. for dumping
+        it. The result is for reading only: saving it would archive its
+        old messages a second time."""
+        story = self.load(story_id)
+        return story.model_copy(
+            update={
+                "old_messages": self.load_old_messages(story_id, story),
+                "archived_messages": [],
+            }
+        )
+
 
 class StoryLocked(Exception):
     pass
@@ -159,37 +410,291 @@ class StoryLocked(Exception):
 StoryIndexes = dict[str, StoryIndex]
 idxs_adapter = TypeAdapter(StoryIndexes)
 
+# Story fields that a journal record stores as "keep the first n entries, then
+# append these", rather than replacing wholesale.
+_APPENDED_FIELDS = {"old_messages", "current_messages"}
+
+
+def _story_data(story: Story) -> dict:
+    return story.model_dump(mode="json")
+
+
+def _journal_delta(saved: dict, data: dict) -> dict:
+    """The journal record that turns the saved story data into the new data."""
+    delta: dict = {}
+    for field, value in data.items():
+        before = saved.get(field)
+        if field in _APPENDED_FIELDS:
+            before = before or []
+            keep = 0
+            limit = min(len(before), len(value))
+            while keep < limit and before[keep] == value[keep]:
+                keep += 1
+            if keep != len(before) or keep != len(value):
+                delta[field] = {"keep": keep, "append": value[keep:]}
+        elif before != value:
+            delta[field] = value
+    return delta
+
+
+def _apply_journal_record(data: dict, record: dict) -> None:
+    for field, value in record.items():
+        if field == "seq":
+            continue
+        elif field in _APPENDED_FIELDS:
+            data[field] = data.get(field, [])[: value["keep"]] + value["append"]
+        else:
+            data[field] = value
+
+
+def _read_journal(path: str) -> tuple[list[dict], int]:
+    """Read the complete records from a journal file, returning them along
+    with the length in bytes of the valid part of the file. Anything after
+    the last complete record was torn by a crash mid-append and is ignored."""
+    records = []
+    valid_size = 0
+
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+            valid_size += len(line)
+
+    return records, valid_size
+
+
+def _atomic_write_bytes(path: str, content: bytes) -> None:
+    """Write a file so that a crash leaves either the old or the new content."""
+    tmp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _atomic_write(path: str, content: str) -> None:
+    _atomic_write_bytes(path, content.encode("utf-8"))
+
+
+class _JournalState:
+    """What has been persisted for a journaled story, so the next save
+    can be written as a delta against it."""
+
+    def __init__(
+        self,
+        data: dict,
+        seq: int,
+        records: int,
+        journal_size: int,
+        snapshot: tuple[int, int] | None,
+    ):
+        self.data = data
+        self.seq = seq
+        self.records = records
+        self.journal_size = journal_size
+        # Identifies the version of the story file the state started from,
+        # in case another process has since compacted the journal.
+        self.snapshot = snapshot
+
+
+class _IndexView:
+    """The parsed records of an index directory, kept between listings so
+    that only records that have changed are read again."""
+
+    # A directory changed within this long before it was last scanned may
+    # have changed again within the same clock tick, so is scanned again.
+    racy_ns = 100_000_000
+
+    def __init__(self):
+        self.lock = Lock()
+        self.dir_mtime = 0
+        self.scanned = 0
+        self.records: dict[str, tuple[tuple[int, int, int], StoryIndex]] = {}
+        self.by_last_modified: list[StoryIndex] | None = None
+
+    def current(self, index_dir: str) -> list[StoryIndex]:
+        """The records, most recently modified first."""
+        with self.lock:
+            dir_mtime = os.stat(index_dir).st_mtime_ns
+            if dir_mtime != self.dir_mtime or dir_mtime + self.racy_ns > self.scanned:
+                self._scan(index_dir, dir_mtime)
+
+            if self.by_last_modified is None:
+                self.by_last_modified = sorted(
+                    (item for _, item in self.records.values()),
+                    key=lambda item: item.last_modified,
+                    reverse=True,
+                )
+            return self.by_last_modified
+
+    def _scan(self, index_dir: str, dir_mtime: int) -> None:
+        self.scanned = time.time_ns()
+        self.dir_mtime = dir_mtime
+        records = {}
+        changed = False
+
+        for entry in os.scandir(index_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+                # Records are replaced, never rewritten, so a changed record
+                # has a new inode.
+                stamp = (entry.inode(), stat.st_mtime_ns, stat.st_size)
+                cached = self.records.get(entry.name)
+                if cached is not None and cached[0] == stamp:
+                    records[entry.name] = cached
+                    continue
+                with open(entry.path) as f:
+                    records[entry.name] = (
+                        stamp,
+                        StoryIndex.model_validate_json(f.read()),
+                    )
+                changed = True
+            except FileNotFoundError:
+                # Removed, or replaced by a newer record, since the scan began.
+                continue
+
+        if changed or len(records) != len(self.records):
+            self.by_last_modified = None
+        self.records = records
+
+
+def _file_stamp(path: str) -> tuple[int, int] | None:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns)
+
 
 class FileStoryRepository(StoryRepository):
+    """Stores each story as a JSON file in repo_dir.
+
+    Saving a story moves its old messages into an immutable, compressed
+    segment file, leaving only a reference to the segment in the story.
+
+    In journaled mode, saves append only what changed since the last save to
+    a per-story journal file. Once the journal reaches compact_after records,
+    it is folded back into the story file by a background thread. Loading
+    replays any journal regardless of mode, so a repository can be switched
+    between modes at any time.
+
+    The story index is kept as one small record per story, so a save only
+    rewrites its own story's record, and listings only read the records
+    that changed since the last listing.
+
+    Story locks, journal writes and index updates are guarded by lock files,
+    so several worker processes can share a repo_dir."""
+
     locklock = Lock()
-    locks: dict[str, bool] = {}
+    index_views: dict[str, _IndexView] = {}
+
+    journal_locklock = Lock()
+    journal_locks: dict[str, Lock] = {}
+    journal_states: OrderedDict[str, _JournalState] = OrderedDict()
+    max_journal_states = 256
+
+    compaction_executor: ThreadPoolExecutor | None = None
+    pending_compactions: set[str] = set()
 
-    def __init__(self, repo_dir: str):
+    def __init__(
+        self, repo_dir: str, journaled: bool = False, compact_after: int = 100
+    ):
         self.repo_dir = repo_dir
+        self.journaled = journaled
+        self.compact_after = compact_after
 
     def _repofile(self, story_id: str) -> str:
         return os.path.join(self.repo_dir, f"story-{story_id}.json")
 
+    def _journal_file(self, story_id: str) -> str:
+        return os.path.join(self.repo_dir, f"story-{story_id}.journal")
+
+    def _lock_file(self, story_id: str) -> str:
+        return os.path.join(self.repo_dir, f"story-{story_id}.lock")
+
+    def _segment_file(self, story_id: str, segment: int) -> str:
+        return os.path.join(self.repo_dir, f"story-{story_id}.old-{segment}.jsonl.gz")
+
+    def _archive_old_messages(self, story_id: str, story: Story) -> None:
+        if not story.old_messages:
+            return
+
+        segment = max((ref.segment for ref in story.archived_messages), default=-1) + 1
+        content = "".join(
+            json.dumps(Story.to_saved_message(message)) + "\n"
+            for message in story.old_messages
+        )
+        # A crash after this leaves a segment that no saved story refers to,
+        # which the next save of the story overwrites.
+        _atomic_write_bytes(
+            self._segment_file(story_id, segment),
+            gzip.compress(content.encode("utf-8"), compresslevel=6),
+        )
+
+        story.archived_messages = [
+            *story.archived_messages,
+            ArchivedMessages(segment=segment, messages=len(story.old_messages)),
+        ]
+        story.old_messages = []
+
+    def load_old_messages(self, story_id: str, story: Story) -> Messages:
+        saved_messages: list[dict] = []
+        for ref in story.archived_messages:
+            with gzip.open(self._segment_file(story_id, ref.segment), "rt") as f:
+                saved_messages.extend(json.loads(line) for line in f)
+
+        return Story.to_lc_messages(saved_messages) + story.old_messages
+
     def _index_file(self) -> str:
+        """The story index from before it was split into records."""
         return os.path.join(self.repo_dir, "00index.json")
 
-    def _get_index(self) -> StoryIndexes:
-        if (Path(self._index_file())).is_file():
-            with open(self._index_file()) as f:
-                return idxs_adapter.validate_json(f.read())
-        else:
-            return {}
-
-    def _save_index(self, idx: StoryIndexes) -> None:
-        with open(self._index_file(), "w") as f:
-            f.write(idxs_adapter.dump_json(idx).decode("utf-8"))
+    def _index_dir(self) -> str:
+        return os.path.join(self.repo_dir, "00index")
+
+    def _index_record(self, story_id: str) -> str:
+        return os.path.join(self._index_dir(), f"{story_id}.json")
+
+    def _migrate_index(self) -> None:
+        """Split an index saved as a single file into per-story records."""
+        index_dir = self._index_dir()
+        if os.path.isdir(index_dir):
+            return
+
+        with locking.exclusive(f"{self._index_file()}.lock"):
+            if os.path.isdir(index_dir):
+                return
+
+            # Build the records aside, so that other processes never see a
+            # partial index.
+            tmp_dir = f"{index_dir}.{os.getpid()}.{get_ident()}.tmp"
+            os.makedirs(tmp_dir)
+            if Path(self._index_file()).is_file():
+                with open(self._index_file()) as f:
+                    idx = idxs_adapter.validate_json(f.read())
+                for story_id, item in idx.items():
+                    _atomic_write(
+                        os.path.join(tmp_dir, f"{story_id}.json"),
+                        item.model_dump_json(),
+                    )
+            os.rename(tmp_dir, index_dir)
+            if Path(self._index_file()).is_file():
+                os.remove(self._index_file())
 
     def _update_index(self, story_id: str, story: Story) -> None:
-        idx = self._get_index()
-        item = idx.get(story_id)
-        if item:
-            date_created = item.created
-        else:
+        self._migrate_index()
+        record = self._index_record(story_id)
+        try:
+            with open(record) as f:
+                date_created = StoryIndex.model_validate_json(f.read()).created
+        except FileNotFoundError:
             date_created = datetime.now()
 
         updated_item = StoryIndex(
@@ -200,38 +705,330 @@ class FileStoryRepository(StoryRepository):
             created=date_created,
             last_modified=datetime.now(),
         )
+        _atomic_write(record, updated_item.model_dump_json())
 
-        idx[story_id] = updated_item
-        self._save_index(idx)
-
-    def list(self) -> list[StoryIndex]:
-        return list(self._get_index().values())
+    def story_ids(self) -> list[str]:
+        return [
+            path.name.removeprefix("story-").removesuffix(".json")
+            for path in Path(self.repo_dir).glob("story-*.json")
+        ]
 
-    def lock(self, story_id: str) -> None:
+    def list(self, offset: int = 0, limit: int | None = None) -> list[StoryIndex]:
+        self._migrate_index()
+        index_dir = self._index_dir()
         with self.locklock:
-            if story_id in self.locks:
-                raise StoryLocked(f"Story {story_id} is locked by another process.")
+            view = self.index_views.setdefault(index_dir, _IndexView())
+
+        items = view.current(index_dir)
+        return items[offset : None if limit is None else offset + limit]
 
-            self.locks[story_id] = True
+    def lock(self, story_id: str) -> None:
+        if not locking.try_lock(self._lock_file(story_id)):
+            raise StoryLocked(f"Story {story_id} is locked by another process.")
 
     def unlock(self, story_id: str) -> None:
-        with self.locklock:
-            del self.locks[story_id]
+        locking.unlock(self._lock_file(story_id))
 
     def story_exists(self, story_id: str) -> bool:
         return os.path.exists(self._repofile(story_id))
 
+    def version(self, story_id: str) -> Hashable:
+        # Saves replace the story file, or append to its journal.
+        stamps: list[tuple[int, int, int] | None] = []
+        for path in (self._repofile(story_id), self._journal_file(story_id)):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                stamps.append(None)
+            else:
+                stamps.append((st.st_ino, st.st_size, st.st_mtime_ns))
+        return tuple(stamps)
+
     def load(self, story_id: str) -> Story:
-        with open(self._repofile(story_id)) as f:
-            return Story.model_validate_json(f.read())
+        if not self.journaled and not os.path.exists(self._journal_file(story_id)):
+            with open(self._repofile(story_id)) as f:
+                return Story.model_validate_json(f.read())
+
+        with self._journal_lock(story_id):
+            state = self._read_journal_state(story_id)
+            if self.journaled:
+                self._track_journal_state(story_id, state)
+            return Story.model_validate(state.data)
 
     def save(self, story_id: str, story: Story) -> None:
-        with open(self._repofile(story_id), "w") as f:
-            f.write(story.model_dump_json(indent=2))
+        self._archive_old_messages(story_id, story)
 
-        with self.locklock:
+        if self.journaled:
+            if not self._save_journaled(story_id, story):
+                return
+        else:
+            with self._journal_lock(story_id):
+                _atomic_write(self._repofile(story_id), story.model_dump_json(indent=2))
+                self._forget_journal(story_id)
+
+        with self._journal_lock(story_id):
             self._update_index(story_id, story)
 
+    def compact(self, story_id: str) -> None:
+        """Fold a story's journal into its story file."""
+        journal_file = self._journal_file(story_id)
+
+        with self._journal_lock(story_id):
+            state = self._current_journal_state(story_id)
+            if state is None or not os.path.exists(journal_file):
+                return
+            self._write_snapshot(story_id, state.data, state.seq)
+            os.remove(journal_file)
+            self._track_journal_state(
+                story_id,
+                _JournalState(
+                    state.data, state.seq, 0, 0, _file_stamp(self._repofile(story_id))
+                ),
+            )
+
+    # Journal helpers. All of these expect the story's journal lock to be held.
+
+    @contextmanager
+    def _journal_lock(self, story_id: str) -> Iterator[None]:
+        key = self._repofile(story_id)
+        with self.journal_locklock:
+            if key not in self.journal_locks:
+                self.journal_locks[key] = Lock()
+            lock = self.journal_locks[key]
+
+        with lock, locking.exclusive(f"{self._journal_file(story_id)}.lock"):
+            yield
+
+    def _track_journal_state(self, story_id: str, state: _JournalState) -> None:
+        key = self._repofile(story_id)
+        with self.journal_locklock:
+            self.journal_states[key] = state
+            self.journal_states.move_to_end(key)
+            while len(self.journal_states) > self.max_journal_states:
+                self.journal_states.popitem(last=False)
+
+    def _forget_journal(self, story_id: str) -> None:
+        with self.journal_locklock:
+            self.journal_states.pop(self._repofile(story_id), None)
+
+        if os.path.exists(self._journal_file(story_id)):
+            os.remove(self._journal_file(story_id))
+
+    def _read_journal_state(self, story_id: str) -> _JournalState:
+        snapshot = _file_stamp(self._repofile(story_id))
+        with open(self._repofile(story_id)) as f:
+            data = json.load(f)
+        seq = data.pop("journal_seq", 0)
+
+        records: list[dict] = []
+        journal_size = 0
+        if os.path.exists(self._journal_file(story_id)):
+            records, journal_size = _read_journal(self._journal_file(story_id))
+
+        for record in records:
+            # Records at or below the snapshot's sequence number were already
+            # folded into it by a compaction that crashed before removing them.
+            if record["seq"] > seq:
+                _apply_journal_record(data, record)
+                seq = record["seq"]
+
+        return _JournalState(data, seq, len(records), journal_size, snapshot)
+
+    def _current_journal_state(self, story_id: str) -> _JournalState | None:
+        """The persisted state of a story, from memory if nothing else has
+        written its journal since, otherwise from disk."""
+        if not self.story_exists(story_id):
+            return None
+
+        with self.journal_locklock:
+            state = self.journal_states.get(self._repofile(story_id))
+
+        journal_file = self._journal_file(story_id)
+        journal_size = (
+            os.path.getsize(journal_file) if os.path.exists(journal_file) else 0
+        )
+
+        if (
+            state is None
+            or state.journal_size != journal_size
+            or state.snapshot != _file_stamp(self._repofile(story_id))
+        ):
+            state = self._read_journal_state(story_id)
+            if state.journal_size != journal_size:
+                # Drop the torn tail of an interrupted append, so the next
+                # record starts on a fresh line.
+                os.truncate(journal_file, state.journal_size)
+
+        return state
+
+    def _write_snapshot(self, story_id: str, data: dict, seq: int) -> None:
+        _atomic_write(
+            self._repofile(story_id), json.dumps({**data, "journal_seq": seq}, indent=2)
+        )
+
+    def _save_journaled(self, story_id: str, story: Story) -> bool:
+        """Append the changes to a story to its journal. Returns False if
+        there was nothing to save."""
+        data = _story_data(story)
+
+        with self._journal_lock(story_id):
+            state = self._current_journal_state(story_id)
+
+            if state is None:
+                self._write_snapshot(story_id, data, 0)
+                self._forget_journal(story_id)
+                self._track_journal_state(
+                    story_id,
+                    _JournalState(data, 0, 0, 0, _file_stamp(self._repofile(story_id))),
+                )
+                return True
+
+            delta = _journal_delta(state.data, data)
+            if not delta:
+                return False
+
+            record = json.dumps({"seq": state.seq + 1, **delta}).encode("utf-8") + b"\n"
+            with open(self._journal_file(story_id), "ab") as f:
+                f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+
+            state = _JournalState(
+                data,
+                state.seq + 1,
+                state.records + 1,
+                state.journal_size + len(record),
+                state.snapshot,
+            )
+            self._track_journal_state(story_id, state)
+
+        if state.records >= self.compact_after:
+            self._schedule_compaction(story_id)
+
+        return True
+
+    def _schedule_compaction(self, story_id: str) -> None:
+        key = self._repofile(story_id)
+        with self.journal_locklock:
+            if key in self.pending_compactions:
+                return
+            self.pending_compactions.add(key)
+
+            if FileStoryRepository.compaction_executor is None:
+                FileStoryRepository.compaction_executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="story-compaction"
+                )
+            executor = FileStoryRepository.compaction_executor
+
+        def run_compaction():
+            try:
+                self.compact(story_id)
+            except Exception:
+                logger.exception(f"Compaction of story {story_id} failed")
+            finally:
+                with self.journal_locklock:
+                    self.pending_compactions.discard(key)
+
+        executor.submit(run_compaction)
+
+
+class AsyncStoryRepository(ABC):
+    """A story repository for async code. Locking never waits, failing with
+    StoryLocked instead, so lock() and unlock() are plain methods."""
+
+    @abstractmethod
+    async def list(self, offset: int = 0, limit: int | None = None) -> list[StoryIndex]:
+        pass
+
+    @abstractmethod
+    def lock(self, story_id: str) -> None:
+        pass
+
+    @abstractmethod
+    def unlock(self, story_id: str) -> None:
+        pass
+
+    @abstractmethod
+    async def story_exists(self, story_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def load(self, story_id: str) -> Story:
+        pass
+
+    @abstractmethod
+    async def save(self, story_id: str, story: Story) -> None:
+        pass
+
+    @abstractmethod
+    async def export(self, story_id: str) -> Story:
+        pass
+
+    async def version(self, story_id: str) -> Hashable:
+        """See StoryRepository.version()."""
+        return None
+
+    async def close(self) -> None:
+        pass
+
+
+class ThreadedStoryRepository(AsyncStoryRepository):
+    """Runs a StoryRepository's disk or database work, and the parsing that
+    goes with it, on a thread pool, so that a large story being loaded or
+    saved doesn't hold up everything else on the event loop."""
+
+    executor: ThreadPoolExecutor | None = None
+    executor_lock = Lock()
+    max_workers = 8
+
+    def __init__(self, repository: StoryRepository):
+        self.repository = repository
+
+    async def _run(self, fn: Callable[..., _T], *args) -> _T:
+        with ThreadedStoryRepository.executor_lock:
+            if ThreadedStoryRepository.executor is None:
+                ThreadedStoryRepository.executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="story-io"
+                )
+            executor = ThreadedStoryRepository.executor
+
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+    async def list(self, offset: int = 0, limit: int | None = None) -> list[StoryIndex]:
+        return await self._run(self.repository.list, offset, limit)
+
+    def lock(self, story_id: str) -> None:
+        self.repository.lock(story_id)
+
+    def unlock(self, story_id: str) -> None:
+        self.repository.unlock(story_id)
+
+    async def story_exists(self, story_id: str) -> bool:
+        return await self._run(self.repository.story_exists, story_id)
+
+    async def load(self, story_id: str) -> Story:
+        return await self._run(self.repository.load, story_id)
+
+    async def save(self, story_id: str, story: Story) -> None:
+        await self._run(self.repository.save, story_id, story)
+
+    async def export(self, story_id: str) -> Story:
+        return await self._run(self.repository.export, story_id)
+
+    async def version(self, story_id: str) -> Hashable:
+        return await self._run(self.repository.version, story_id)
+
+    async def close(self) -> None:
+        await self._run(self.repository.close)
+
+
+def as_async_repository(
+    repository: StoryRepository | AsyncStoryRepository,
+) -> AsyncStoryRepository:
+    if isinstance(repository, AsyncStoryRepository):
+        return repository
+    return ThreadedStoryRepository(repository)
+
 
 class Command(ABC):
     @abstractmethod
@@ -239,25 +1036,236 @@ class Command(ABC):
         pass
 
 
+def _working_copy(story: Story) -> Story:
+    """A copy of a story that a command can modify without changing the
+    original. Commands replace list items rather than modifying them, so
+    copying the lists is enough."""
+    return story.model_copy(
+        update={field: list(value) for field, value in story if isinstance(value, list)}
+    )
+
+
 class StoryEngine:
-    def __init__(self, story_repository: StoryRepository):
-        self.story_repository = story_repository
+    """Runs commands against stories, holding the story's lock while
+    it loads, runs the command, and saves.
+
+    Commands for the same story wait their turn in a queue rather than
+    failing to get the lock, while commands for different stories run
+    concurrently. Engines that serve the same stories should share their
+    queues.
+
+    With a cache, stories stay loaded between commands, and changes are
+    written back to the repository according to the cache's flush policy.
+    Anything else that reads stories should then go through load() and
+    export() here, rather than the repository, and close() should be
+    called on shutdown to write back any remaining changes. Before a
+    cached story is used, it's checked against the repository's version
+    of it, so engines in other processes can save the same stories, as
+    long as their changes are written back after every command."""
+
+    def __init__(
+        self,
+        story_repository: StoryRepository | AsyncStoryRepository,
+        cache: StoryCache | None = None,
+        queues: StoryQueues | None = None,
+    ):
+        self.story_repository = as_async_repository(story_repository)
+        self.cache = cache
+        self.queues = queues if queues is not None else StoryQueues()
+        self.flush_task: asyncio.Task | None = None
 
     async def run_command(self, story_id: str, cmd: Command):
+        await self.run_commands(story_id, [cmd])
+
+    async def run_commands(self, story_id: str, cmds: Sequence[Command]):
+        """Run a sequence of commands against a story as one transaction,
+        loading and locking it once, and saving it once at the end.
+
+        If a command fails, the changes made by the commands before it are
+        still saved (see ADR 001), and then its error is raised. Raises
+        StoryBusy if the story's queue is full, or the commands time out
+        waiting for their turn."""
+        await self.queues.run(story_id, lambda: self._run_commands(story_id, cmds))
+
+    async def _run_commands(self, story_id: str, cmds: Sequence[Command]):
+        self.story_repository.lock(story_id)
         try:
-            self.story_repository.lock(story_id)
-            story = self.story_repository.load(story_id)
-            await cmd.run(story)
-            self.story_repository.save(story_id, story)
+            story = await self._load(story_id)
+            completed = 0
+            error: Exception | None = None
+
+            for cmd in cmds:
+                attempt = _working_copy(story) if completed > 0 else story
+                try:
+                    await cmd.run(attempt)
+                except Exception as e:
+                    error = e
+                    break
+                story = attempt
+                completed += 1
+
+            if completed > 0:
+                await self._store(story_id, story)
+            if error is not None:
+                raise error
         finally:
             self.story_repository.unlock(story_id)
 
+    async def load(self, story_id: str) -> Story:
+        """The latest state of a story, including changes that haven't been
+        written back to the repository yet."""
+        return await self._load(story_id)
+
+    async def story_exists(self, story_id: str) -> bool:
+        if self.cache is not None and story_id in self.cache.entries:
+            return True
+        return await self.story_repository.story_exists(story_id)
+
+    async def export(self, story_id: str) -> Story:
+        """See StoryRepository.export()."""
+        if self.cache is not None and story_id in self.cache.entries:
+            await self._flush_entry(story_id)
+        return await self.story_repository.export(story_id)
+
+    async def flush(self) -> None:
+        """Write back every changed story in the cache that isn't locked by
+        another process."""
+        if self.cache is not None:
+            for story_id, _ in self.cache.dirty():
+                await self._flush_entry(story_id)
+
+    async def close(self) -> None:
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.flush()
+        await self.story_repository.close()
+
+    def cache_stats(self) -> CacheStats | None:
+        return self.cache.current_stats() if self.cache is not None else None
+
+    def queue_stats(self) -> StoryQueueStats:
+        return self.queues.current_stats()
+
+    async def _load(self, story_id: str) -> Story:
+        if self.cache is None:
+            return await self.story_repository.load(story_id)
+
+        entry = self.cache.entries.get(story_id)
+        if entry is not None and not entry.dirty:
+            # Another engine may have saved the story since it was cached.
+            # Unsaved changes are kept regardless.
+            if entry.version != await self.story_repository.version(story_id):
+                self.cache.remove(story_id)
+
+        story = self.cache.get(story_id)
+        if story is None:
+            version = await self.story_repository.version(story_id)
+            story = await self.story_repository.load(story_id)
+            self.cache.put(story_id, story, dirty=False, version=version)
+            await self._evict(keep=story_id)
+
+        # Commands run against a copy, so a command that fails halfway
+        # leaves the cached story as it was.
+        return _working_copy(story)
+
+    async def _store(self, story_id: str, story: Story) -> None:
+        if self.cache is None:
+            await self.story_repository.save(story_id, story)
+        elif self.cache.flush_policy == FlushPolicy.EveryCommand:
+            await self.story_repository.save(story_id, story)
+            version = await self.story_repository.version(story_id)
+            self.cache.put(story_id, story, dirty=False, version=version)
+            await self._evict(keep=story_id)
+        else:
+            self.cache.put(story_id, story, dirty=True)
+            await self._evict(keep=story_id)
+            if self.cache.flush_policy == FlushPolicy.Interval:
+                self._start_flush_task()
+
+    async def _flush_entry(self, story_id: str, evict: bool = False) -> bool:
+        """Write back a cached story if it has changed, then evict it if
+        asked to. This takes the story's turn in its queue, so it never
+        holds the story's lock while a command wants it. Returns False if
+        another process has the story locked, in which case it's left
+        alone."""
+        return await self.queues.run(
+            story_id, lambda: self._write_back(story_id, evict)
+        )
+
+    async def _write_back(self, story_id: str, evict: bool) -> bool:
+        if self.cache is None:
+            return True
+
+        entry = self.cache.entries.get(story_id)
+        if entry is None:
+            return True
+
+        if entry.dirty:
+            try:
+                self.story_repository.lock(story_id)
+            except StoryLocked:
+                return False
+
+            try:
+                await self.story_repository.save(story_id, entry.story)
+                version = await self.story_repository.version(story_id)
+                self.cache.mark_clean(story_id, entry.story, version)
+            finally:
+                self.story_repository.unlock(story_id)
+
+        if evict:
+            self.cache.evict(story_id)
+        return True
+
+    async def _evict(self, keep: str) -> None:
+        if self.cache is None:
+            return
+
+        for story_id, entry in self.cache.eviction_candidates():
+            # Skip the story being worked on, and stories with commands
+            # running or waiting, rather than holding them up. They're
+            # evicted after a later command once they're idle.
+            if story_id == keep or self.queues.busy(story_id):
+                continue
+            if entry.dirty:
+                await self._flush_entry(story_id, evict=True)
+            else:
+                self.cache.evict(story_id)
+
+    def _start_flush_task(self) -> None:
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self) -> None:
+        if self.cache is None:
+            return
+
+        while True:
+            await asyncio.sleep(self.cache.flush_interval_ms / 1000)
+            for story_id, _ in self.cache.dirty(self.cache.flush_interval_ms):
+                try:
+                    await self._flush_entry(story_id)
+                except Exception:
+                    logger.exception(f"Writing back story {story_id} failed")
+
 
 class Response(ABC):
     @abstractmethod
     async def send_message(self, msg: str):
         pass
 
+    async def report_usage(self, usage: UsageMetadata):
+        """Called with the token usage of each chat response, including how
+        much of the prompt was read from or written to the provider's
+        prompt cache."""
+        details = usage.get("input_token_details", {})
+        logger.info(
+            f"Chat prompt: {usage['input_tokens']} input tokens, "
+            f"{details.get('cache_read', 0)} read from cache, "
+            f"{details.get('cache_creation', 0)} written to cache"
+        )
+
     @abstractmethod
     async def start_stream(self):
         pass
@@ -305,4 +1313,8 @@ async def run_chat(
             chunks, chunk_separator=""
         )  # just in case, but the output will probably be wonky
 
+    usage = getattr(merged[0], "usage_metadata", None) if merged else None
+    if usage:
+        await response.report_usage(usage)
+
     return merged
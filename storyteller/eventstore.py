@@ -0,0 +1,625 @@
+"""
+An event stream is stored as two append-only files.
+
+The data file (path) starts with an 8 byte header: the magic bytes b"STEV",
+the format version (uint16) and two reserved bytes. Then come the events,
+each as a uint32 length followed by that many bytes of payload:
+
+- kind (uint8: 1 ChatMessage, 2 NoOp, 3 TitleUpdate), id, parent and
+  timestamp (int64; parent is -1 for a root event)
+- ChatMessage: source (uint8), content, then an annotation flag (uint8)
+  followed, if set, by the annotation type (uint8) and content
+- NoOp: a reason flag (uint8) followed, if set, by the reason
+- TitleUpdate: source (uint8) and content
+
+Strings are a uint32 length followed by UTF-8 bytes. All integers are
+little-endian.
+
+The index file (path + ".idx") has the same kind of header, with the
+magic bytes b"STIX" and the index record size in place of the reserved
+bytes. Then comes one fixed-width record for each event, in the order
+they were appended: id and the index position of the parent (int64, -1
+for a root event), the event's offset in the data file (uint64), its
+length (uint32), kind (uint8) and three bytes of padding.
+
+Following a branch back from an event only reads that branch's index
+records and events, wherever they are in the files.
+
+Branches that have been abandoned for long enough can be pruned into an
+archive (path + ".archive.gz"): a gzip file holding a header with the
+magic bytes b"STAR", followed by the pruned events framed as they are in
+the data file. The store's files are then written again without them.
+"""
+
+from .eventstream import (
+    ANY_HEAD,
+    Annotation,
+    AnnotationType,
+    AnyHead,
+    ChatMessage,
+    Event,
+    EventId,
+    EventStream,
+    MessageSource,
+    NoOp,
+    StaleAppend,
+    StorySnapshot,
+    TitleUpdate,
+    check_head,
+)
+from . import locking
+
+from collections.abc import Awaitable, Callable, Iterable, Iterator, Sequence
+from threading import RLock
+
+import asyncio
+import gzip
+import mmap
+import os
+import struct
+import time
+
+
+VERSION = 1
+
+_HEADER = struct.Struct("<4sHH")
+_DATA_MAGIC = b"STEV"
+_INDEX_MAGIC = b"STIX"
+_ARCHIVE_MAGIC = b"STAR"
+_INDEX_RECORD = struct.Struct("<qqQIB3x")
+_LENGTH = struct.Struct("<I")
+_EVENT = struct.Struct("<Bqqq")
+_BYTE = struct.Struct("<B")
+
+_CHAT_MESSAGE = 1
+_NO_OP = 2
+_TITLE_UPDATE = 3
+
+_SOURCES = list(MessageSource)
+_ANNOTATION_TYPES = list(AnnotationType)
+
+
+class EventStoreError(Exception):
+    pass
+
+
+def _encode_str(value: str) -> bytes:
+    encoded = value.encode("utf-8")
+    return _LENGTH.pack(len(encoded)) + encoded
+
+
+def encode_event(event: Event) -> tuple[int, bytes]:
+    """An event's kind, and its payload."""
+    if isinstance(event, ChatMessage):
+        kind = _CHAT_MESSAGE
+        fields = _BYTE.pack(_SOURCES.index(event.source)) + _encode_str(event.content)
+        if event.annotation is None:
+            fields += _BYTE.pack(0)
+        else:
+            fields += (
+                _BYTE.pack(1)
+                + _BYTE.pack(_ANNOTATION_TYPES.index(event.annotation.type))
+                + _encode_str(event.annotation.content)
+            )
+    elif isinstance(event, NoOp):
+        kind = _NO_OP
+        if event.reason is None:
+            fields = _BYTE.pack(0)
+        else:
+            fields = _BYTE.pack(1) + _encode_str(event.reason)
+    elif isinstance(event, TitleUpdate):
+        kind = _TITLE_UPDATE
+        fields = _BYTE.pack(_SOURCES.index(event.source)) + _encode_str(event.content)
+    else:
+        raise EventStoreError(f"Can't store events of type {type(event).__name__}")
+
+    if event.id < 0 or (event.parent is not None and event.parent < 0):
+        raise EventStoreError(f"Event IDs can't be negative: {event.id}")
+    parent = -1 if event.parent is None else event.parent
+    return kind, _EVENT.pack(kind, event.id, parent, event.timestamp) + fields
+
+
+class _Reader:
+    def __init__(self, buffer: memoryview, offset: int):
+        self.buffer = buffer
+        self.offset = offset
+
+    def unpack(self, fmt: struct.Struct) -> tuple:
+        values = fmt.unpack_from(self.buffer, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def byte(self) -> int:
+        return self.unpack(_BYTE)[0]
+
+    def string(self) -> str:
+        (length,) = self.unpack(_LENGTH)
+        value = str(self.buffer[self.offset : self.offset + length], "utf-8")
+        self.offset += length
+        return value
+
+
+def decode_event(payload: memoryview) -> Event:
+    reader = _Reader(payload, 0)
+    kind, event_id, parent, timestamp = reader.unpack(_EVENT)
+    # The store only holds events it encoded, so they aren't validated again.
+    common = {
+        "id": event_id,
+        "parent": None if parent < 0 else parent,
+        "timestamp": timestamp,
+    }
+
+    if kind == _CHAT_MESSAGE:
+        source = _SOURCES[reader.byte()]
+        content = reader.string()
+        annotation = None
+        if reader.byte():
+            annotation_type = _ANNOTATION_TYPES[reader.byte()]
+            annotation = Annotation.model_construct(
+                type=annotation_type, content=reader.string()
+            )
+        return ChatMessage.model_construct(
+            **common, source=source, content=content, annotation=annotation
+        )
+    elif kind == _NO_OP:
+        reason = reader.string() if reader.byte() else None
+        return NoOp.model_construct(**common, reason=reason)
+    elif kind == _TITLE_UPDATE:
+        source = _SOURCES[reader.byte()]
+        return TitleUpdate.model_construct(
+            **common, source=source, content=reader.string()
+        )
+    else:
+        raise EventStoreError(f"Unknown event kind {kind}")
+
+
+def _count(index_map: mmap.mmap) -> int:
+    return (len(index_map) - _HEADER.size) // _INDEX_RECORD.size
+
+
+def _check_header(file_path: str, header: bytes, magic: bytes) -> None:
+    if len(header) < _HEADER.size or _HEADER.unpack_from(header)[0] != magic:
+        raise EventStoreError(f"{file_path} is not an event store file")
+    version = _HEADER.unpack_from(header)[1]
+    if version != VERSION:
+        raise EventStoreError(
+            f"{file_path} has format version {version}, expected {VERSION}"
+        )
+
+
+def _fsync_write(file_path: str, mode: str, data: bytes) -> None:
+    with open(file_path, mode) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_archive(path: str) -> Iterator[Event]:
+    """The events pruned from the store at path, in the order they were
+    pruned. An event can appear twice if a prune was interrupted after
+    archiving it."""
+    archive_path = f"{path}.archive.gz"
+    if not os.path.exists(archive_path):
+        return
+
+    with gzip.open(archive_path, "rb") as f:
+        archive = f.read()
+    _check_header(archive_path, archive, _ARCHIVE_MAGIC)
+    with memoryview(archive) as view:
+        offset = _HEADER.size
+        while offset < len(archive):
+            (length,) = _LENGTH.unpack_from(view, offset)
+            start = offset + _LENGTH.size
+            yield decode_event(view[start : start + length])
+            offset = start + length
+
+
+class EventStore:
+    """
+    An event stream stored in a compact binary format (see above), read
+    through memory maps so that loading a branch only touches the pages
+    holding that branch's events.
+
+    Appends from several processes are serialized with a lock file, held
+    only while events are written. Readers only wait for it when the
+    files have changed since they last mapped them. Appends can be made
+    conditional on the store's head, to detect conflicting writers rather
+    than locking them out (see append_with_retry()).
+
+    Branches abandoned for long enough can be archived with prune(), so
+    the store's size follows the story being told rather than how many
+    times it has been retried or rewound.
+
+    A store can be shared between threads.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        # Index positions of events appended or looked up so far, and how
+        # many of the first events in the index are all among them.
+        self.positions: dict[EventId, int] = {}
+        self.indexed = 0
+        self.data_map: mmap.mmap | None = None
+        self.index_map: mmap.mmap | None = None
+        # The inode and size of each file when it was mapped.
+        self.mapped: list[tuple[int, int]] = []
+        # Held while using the maps, so one thread doesn't close them under
+        # another when they're mapped again.
+        self.lock = RLock()
+
+        with locking.exclusive(f"{path}.lock"):
+            self._create_or_recover()
+
+    def _create_or_recover(self) -> None:
+        # A prune writes both files again, then replaces the data file and
+        # then the index. If it was interrupted before the data file was
+        # replaced, the old files are still whole; after, the new ones are.
+        if os.path.exists(f"{self.path}.compact"):
+            for file_path in [f"{self.index_path}.compact", f"{self.path}.compact"]:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+        elif os.path.exists(f"{self.index_path}.compact"):
+            os.replace(f"{self.index_path}.compact", self.index_path)
+
+        for file_path, magic, extra in [
+            (self.path, _DATA_MAGIC, 0),
+            (self.index_path, _INDEX_MAGIC, _INDEX_RECORD.size),
+        ]:
+            if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+                with open(file_path, "wb") as f:
+                    f.write(_HEADER.pack(magic, VERSION, extra))
+                continue
+
+            with open(file_path, "rb") as f:
+                _check_header(file_path, f.read(_HEADER.size), magic)
+
+        # A crash while appending can leave a partial index record, or an
+        # event that was never indexed. Neither was ever visible to readers.
+        index_size = os.path.getsize(self.index_path)
+        records = (index_size - _HEADER.size) // _INDEX_RECORD.size
+        if index_size != _HEADER.size + records * _INDEX_RECORD.size:
+            os.truncate(self.index_path, _HEADER.size + records * _INDEX_RECORD.size)
+
+        data_end = _HEADER.size
+        if records > 0:
+            with open(self.index_path, "rb") as f:
+                f.seek(_HEADER.size + (records - 1) * _INDEX_RECORD.size)
+                _, _, offset, length, _ = _INDEX_RECORD.unpack(
+                    f.read(_INDEX_RECORD.size)
+                )
+            data_end = offset + _LENGTH.size + length
+        if os.path.getsize(self.path) > data_end:
+            os.truncate(self.path, data_end)
+
+    def close(self) -> None:
+        with self.lock:
+            for mapped in [self.data_map, self.index_map]:
+                if mapped is not None:
+                    mapped.close()
+            self.data_map = self.index_map = None
+            self.mapped = []
+
+    def __len__(self) -> int:
+        return (os.path.getsize(self.index_path) - _HEADER.size) // _INDEX_RECORD.size
+
+    def append(
+        self, event: Event, expected_head: EventId | None | AnyHead = ANY_HEAD
+    ) -> None:
+        self.extend([event], expected_head)
+
+    def head(self) -> EventId | None:
+        """The ID of the last event appended, if there is one."""
+        with self.lock:
+            _, index_map = self._maps()
+            count = _count(index_map)
+            if count == 0:
+                return None
+            return self._record(index_map, count - 1)[0]
+
+    def extend(
+        self,
+        events: Iterable[Event],
+        expected_head: EventId | None | AnyHead = ANY_HEAD,
+    ) -> None:
+        """Append events, syncing them to disk once at the end. If any of
+        them can't be appended, none of them are.
+
+        If expected_head is given, the events are only appended if the
+        last event in the store is still the one with that ID (or the store
+        is still empty, for None), and StaleAppend is raised otherwise.
+        The check and the append are atomic, even across processes."""
+        encoded = [(event, *encode_event(event)) for event in events]
+
+        with self.lock, locking.exclusive(f"{self.path}.lock"):
+            self._catch_up()
+            _, index_map = self._maps(locked=True)
+            count = _count(index_map)
+            check_head(
+                expected_head,
+                self._record(index_map, count - 1)[0] if count else None,
+            )
+            with open(self.path, "ab") as data_file:
+                offset = data_file.tell()
+
+                data = bytearray()
+                index = bytearray()
+                positions: dict[EventId, int] = {}
+                for event, kind, payload in encoded:
+                    if event.id in self.positions or event.id in positions:
+                        raise ValueError(
+                            f"Event with ID {event.id} is already in the stream"
+                        )
+                    parent_position = -1
+                    if event.parent is not None:
+                        parent_position = positions.get(
+                            event.parent, self.positions.get(event.parent, -1)
+                        )
+                        if parent_position < 0:
+                            raise ValueError(
+                                f"Parent event with ID {event.parent} not found in stream"
+                            )
+
+                    index += _INDEX_RECORD.pack(
+                        event.id,
+                        parent_position,
+                        offset + len(data),
+                        len(payload),
+                        kind,
+                    )
+                    data += _LENGTH.pack(len(payload)) + payload
+                    positions[event.id] = self.indexed + len(positions)
+
+                # Events are on disk before they're indexed, so readers
+                # never find an index record without its event.
+                data_file.write(data)
+                data_file.flush()
+                os.fsync(data_file.fileno())
+            with open(self.index_path, "ab") as index_file:
+                index_file.write(index)
+                index_file.flush()
+                os.fsync(index_file.fileno())
+
+            self.positions.update(positions)
+            self.indexed += len(positions)
+
+    def _catch_up(self) -> None:
+        """Learn the positions of the events appended, by this or any other
+        process, since this store last appended, so that appends can check
+        event IDs without searching the index. Called with the append lock
+        held."""
+        _, index_map = self._maps(locked=True)
+        count = _count(index_map)
+        for position in range(self.indexed, count):
+            self.positions[self._record(index_map, position)[0]] = position
+        self.indexed = count
+
+    def _stat(self) -> list[tuple[int, int]]:
+        return [
+            (stat.st_ino, stat.st_size)
+            for stat in [os.stat(self.path), os.stat(self.index_path)]
+        ]
+
+    def _maps(self, locked: bool = False) -> tuple[mmap.mmap, mmap.mmap]:
+        """Memory maps of both files, mapped again if they have grown or
+        been replaced by prune(). Mapping them again waits for any append
+        or prune in progress, unless the caller holds the append lock, so
+        the two maps always match."""
+        if self._stat() != self.mapped:
+            if locked:
+                self._map()
+            else:
+                with locking.shared(f"{self.path}.lock"):
+                    self._map()
+
+        assert self.data_map is not None and self.index_map is not None
+        return self.data_map, self.index_map
+
+    def _map(self) -> None:
+        stats = self._stat()
+        if self.mapped and stats[1][0] != self.mapped[1][0]:
+            # The index was replaced, so positions learned from the old
+            # one are no longer right.
+            self.positions = {}
+            self.indexed = 0
+
+        self.close()
+        maps = []
+        for file_path in [self.path, self.index_path]:
+            with open(file_path, "rb") as f:
+                maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        self.data_map, self.index_map = maps
+        self.mapped = stats
+
+    def _record(self, index_map: mmap.mmap, position: int) -> tuple:
+        return _INDEX_RECORD.unpack_from(
+            index_map, _HEADER.size + position * _INDEX_RECORD.size
+        )
+
+    def _position(self, index_map: mmap.mmap, event_id: EventId) -> int | None:
+        """The index position of an event in index_map, which must be the
+        current map, so that the positions learned so far are from it.
+        Stores appended to with increasing IDs, like those from idgen, are
+        binary searched; otherwise the index is scanned from the end, where
+        recent events are."""
+        if event_id in self.positions:
+            return self.positions[event_id]
+
+        count = _count(index_map)
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self._record(index_map, middle)[0] < event_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < count and self._record(index_map, low)[0] == event_id:
+            self.positions[event_id] = low
+            return low
+
+        for position in range(count - 1, -1, -1):
+            if self._record(index_map, position)[0] == event_id:
+                self.positions[event_id] = position
+                return position
+        return None
+
+    def _event(
+        self, data_map: mmap.mmap, index_map: mmap.mmap, position: int
+    ) -> tuple[Event, int]:
+        """The event at an index position, and its parent's position."""
+        _, parent_position, offset, length, _ = self._record(index_map, position)
+        start = offset + _LENGTH.size
+        with memoryview(data_map) as view:
+            with view[start : start + length] as payload:
+                event = decode_event(payload)
+        return event, parent_position
+
+    def branch(self, start_id: EventId | None = None) -> list[Event]:
+        """The events on the branch ending at start_id, or at the last event
+        appended, oldest first."""
+        with self.lock:
+            # Mapped before the position is looked up, so that if a prune
+            # has replaced the files since, the position is in the new ones.
+            data_map, index_map = self._maps()
+            if start_id is None:
+                position = _count(index_map) - 1
+            else:
+                found = self._position(index_map, start_id)
+                if found is None:
+                    raise ValueError(
+                        f"Parent event with ID {start_id} not found in stream"
+                    )
+                position = found
+
+            events = []
+            while position >= 0:
+                event, parent_position = self._event(data_map, index_map, position)
+                events.append(event)
+                position = parent_position
+        events.reverse()
+        return events
+
+    def load(self, start_id: EventId | None = None) -> EventStream:
+        """An EventStream of just the branch ending at start_id, or at the
+        last event appended."""
+        return EventStream(self.branch(start_id))
+
+    def snapshot(self, start_id: EventId | None = None) -> StorySnapshot:
+        return self.load(start_id).snapshot()
+
+    def events(self) -> EventStream:
+        """Every event in the store, in the order they were appended."""
+        with self.lock:
+            data_map, index_map = self._maps()
+            return EventStream(
+                self._event(data_map, index_map, position)[0]
+                for position in range(_count(index_map))
+            )
+
+    def prune(self, retention_s: float, now: float | None = None) -> int:
+        """Move branches abandoned more than retention_s seconds ago (by now,
+        or the current time) into the store's archive, and write the store
+        again without them. Returns how many events were pruned.
+
+        A branch is abandoned once it ends anywhere but the last event
+        appended, and its age is the time of its last event, so whatever
+        snapshot() sees, and every branch worked on recently, is kept. Events
+        keep their IDs, so expected heads and start IDs stay valid.
+        """
+        cutoff = (time.time() if now is None else now) - retention_s
+
+        with self.lock, locking.exclusive(f"{self.path}.lock"):
+            data_map, index_map = self._maps(locked=True)
+            count = _count(index_map)
+            records = [self._record(index_map, position) for position in range(count)]
+            has_children = [False] * count
+            for _, parent_position, _, _, _ in records:
+                if parent_position >= 0:
+                    has_children[parent_position] = True
+
+            keep = [False] * count
+            for position in range(count - 1, -1, -1):
+                if has_children[position]:
+                    continue
+                offset = records[position][2] + _LENGTH.size
+                timestamp = _EVENT.unpack_from(data_map, offset)[3]
+                if position < count - 1 and timestamp < cutoff:
+                    continue
+                while position >= 0 and not keep[position]:
+                    keep[position] = True
+                    position = records[position][1]
+
+            if all(keep):
+                return 0
+
+            archive = bytearray()
+            data = bytearray(data_map[: _HEADER.size])
+            index = bytearray(index_map[: _HEADER.size])
+            new_positions: list[int] = []
+            kept = 0
+            for position, record in enumerate(records):
+                event_id, parent_position, offset, length, kind = record
+                framed = data_map[offset : offset + _LENGTH.size + length]
+                if not keep[position]:
+                    new_positions.append(-1)
+                    archive += framed
+                    continue
+
+                new_positions.append(kept)
+                kept += 1
+                index += _INDEX_RECORD.pack(
+                    event_id,
+                    new_positions[parent_position] if parent_position >= 0 else -1,
+                    len(data),
+                    length,
+                    kind,
+                )
+                data += framed
+
+            archive_path = f"{self.path}.archive.gz"
+            if not os.path.exists(archive_path):
+                archive[:0] = _HEADER.pack(_ARCHIVE_MAGIC, VERSION, 0)
+            # Each prune adds a gzip member, which readers see as one stream.
+            _fsync_write(archive_path, "ab", gzip.compress(bytes(archive)))
+
+            _fsync_write(f"{self.path}.compact", "wb", bytes(data))
+            _fsync_write(f"{self.index_path}.compact", "wb", bytes(index))
+            os.replace(f"{self.path}.compact", self.path)
+            os.replace(f"{self.index_path}.compact", self.index_path)
+
+            self._map()
+            return count - kept
+
+
+async def append_with_retry(
+    store: EventStore,
+    build: Callable[[EventStream], Awaitable[Sequence[Event]]],
+    attempts: int = 5,
+    retry_ms: int = 50,
+) -> Sequence[Event]:
+    """
+    Load the current branch of a store, build new events from it, and
+    append them as long as nobody else has appended in the meantime. If
+    someone has, start again from the new branch, up to attempts times,
+    then raise StaleAppend.
+
+    The store is only locked while the events are written, so build() can
+    take as long as it needs (calling a model, say) without holding up
+    other writers. It may be called more than once, so it shouldn't have
+    side effects beyond returning its events.
+    """
+    for attempt in range(attempts):
+        stream = await asyncio.to_thread(store.load)
+        last = stream.last()
+        events = await build(stream)
+        try:
+            await asyncio.to_thread(
+                store.extend, events, None if last is None else last.id
+            )
+            return events
+        except StaleAppend:
+            if attempt == attempts - 1:
+                raise
+            await asyncio.sleep(retry_ms * (attempt + 1) / 1000)
+
+    raise ValueError("attempts must be at least 1")
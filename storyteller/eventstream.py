@@ -1,6 +1,7 @@
 from pydantic import BaseModel
-from enum import StrEnum
+from enum import Enum, StrEnum
 from datetime import datetime
+from collections.abc import Iterable, Iterator
 
 EventId = int
 
@@ -11,7 +12,218 @@ class Event(BaseModel):
     timestamp: int
 
 
-EventStream = list[Event]
+class AnyHead(Enum):
+    """Appends with expected_head=ANY_HEAD don't check the stream's head."""
+
+    ANY_HEAD = "any"
+
+
+ANY_HEAD = AnyHead.ANY_HEAD
+
+
+class StaleAppend(Exception):
+    """
+    An append expected the stream to end at a different event than it
+    does, so was based on an out-of-date view of the stream.
+    """
+
+    def __init__(self, expected_head: EventId | None, head: EventId | None):
+        super().__init__(
+            f"Expected the stream to end at event {expected_head}, "
+            f"but it ends at event {head}"
+        )
+        self.expected_head = expected_head
+        self.head = head
+
+
+def check_head(expected_head: EventId | None | AnyHead, head: EventId | None) -> None:
+    if expected_head is not ANY_HEAD and expected_head != head:
+        raise StaleAppend(expected_head, head)
+
+
+class _MessageNode:
+    __slots__ = ("message", "previous")
+
+    def __init__(self, message: "ChatMessage", previous: "_MessageNode | None"):
+        self.message = message
+        self.previous = previous
+
+
+class _Fold:
+    """
+    The snapshot of a branch up to some event, folded one event at a
+    time. Each fold shares its chat messages with the fold before it,
+    so folding an event takes constant time and space.
+    """
+
+    __slots__ = ("first_event", "last_event", "messages")
+
+    def __init__(
+        self, first_event: int, last_event: int, messages: _MessageNode | None
+    ):
+        self.first_event = first_event
+        self.last_event = last_event
+        self.messages = messages
+
+    @classmethod
+    def start(cls, event: Event) -> "_Fold":
+        return cls(event.timestamp, event.timestamp, None).then(event)
+
+    def then(self, event: Event) -> "_Fold":
+        messages = self.messages
+        if isinstance(event, ChatMessage):
+            messages = _MessageNode(event, messages)
+        return _Fold(self.first_event, event.timestamp, messages)
+
+    def snapshot(self) -> "StorySnapshot":
+        chat_messages = []
+        node = self.messages
+        while node is not None:
+            chat_messages.append(node.message)
+            node = node.previous
+        chat_messages.reverse()
+
+        return StorySnapshot(
+            first_event=datetime.fromtimestamp(self.first_event),
+            last_event=datetime.fromtimestamp(self.last_event),
+            chat_messages=chat_messages,
+        )
+
+
+class EventStream:
+    """
+    An append-only stream of events forming a tree, where each event
+    follows its parent. Events are indexed by id along with their
+    children, so a branch can be walked in time proportional to its
+    depth, however many events are on other branches.
+
+    Snapshot checkpoints are kept every checkpoint_interval events along
+    each branch, and for the last event appended. A snapshot folds only
+    the events since the nearest checkpoint before it, and appending to
+    the last event updates its checkpoint in constant time.
+    """
+
+    def __init__(self, events: Iterable[Event] = (), checkpoint_interval: int = 64):
+        self.events: list[Event] = []
+        self.by_id: dict[EventId, Event] = {}
+        self.child_ids: dict[EventId, list[EventId]] = {}
+        self.leaf_ids: dict[EventId, None] = {}
+        self.depths: dict[EventId, int] = {}
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoints: dict[EventId, _Fold] = {}
+        self.last_fold: _Fold | None = None
+        for event in events:
+            self.append(event)
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __iter__(self) -> Iterator[Event]:
+        return iter(self.events)
+
+    def __contains__(self, event_id: object) -> bool:
+        return event_id in self.by_id
+
+    def append(
+        self, event: Event, expected_head: EventId | None | AnyHead = ANY_HEAD
+    ) -> None:
+        """Append an event. If expected_head is given, raise StaleAppend
+        unless the last event appended is the one with that ID, or the
+        stream is empty and expected_head is None."""
+        last = self.last()
+        check_head(expected_head, None if last is None else last.id)
+        if event.id in self.by_id:
+            raise ValueError(f"Event with ID {event.id} is already in the stream")
+        if event.parent is not None and event.parent not in self.by_id:
+            raise ValueError(f"Parent event with ID {event.parent} not found in stream")
+
+        if event.parent is None:
+            depth = 0
+            fold = _Fold.start(event)
+        else:
+            depth = self.depths[event.parent] + 1
+            fold = self._fold(event.parent).then(event)
+
+        self.events.append(event)
+        self.by_id[event.id] = event
+        self.child_ids[event.id] = []
+        self.leaf_ids[event.id] = None
+        self.depths[event.id] = depth
+        self.last_fold = fold
+        if depth % self.checkpoint_interval == 0:
+            self.checkpoints[event.id] = fold
+        if event.parent is not None:
+            self.child_ids[event.parent].append(event.id)
+            self.leaf_ids.pop(event.parent, None)
+
+    def get(self, event_id: EventId) -> Event:
+        event = self.by_id.get(event_id)
+        if event is None:
+            raise ValueError(f"Event with ID {event_id} not found in stream")
+        return event
+
+    def last(self) -> Event | None:
+        """The most recently appended event."""
+        return self.events[-1] if self.events else None
+
+    def children(self, event_id: EventId) -> list[Event]:
+        """The events that follow an event, oldest first."""
+        return [self.by_id[child] for child in self.child_ids[self.get(event_id).id]]
+
+    def leaves(self) -> list[Event]:
+        """The last event of every branch, oldest first."""
+        return [self.by_id[event_id] for event_id in self.leaf_ids]
+
+    def head(self, event_id: EventId) -> Event:
+        """The last event of the branch through an event, following the
+        most recent child wherever the branch forks."""
+        event = self.get(event_id)
+        while children := self.child_ids[event.id]:
+            event = self.by_id[children[-1]]
+        return event
+
+    def ancestors(self, event_id: EventId) -> list[Event]:
+        """An event and everything before it on its branch, newest first."""
+        ancestors = []
+        next_id: EventId | None = event_id
+        while next_id is not None:
+            event = self.by_id.get(next_id)
+            if event is None:
+                raise ValueError(f"Parent event with ID {next_id} not found in stream")
+            ancestors.append(event)
+            next_id = event.parent
+        return ancestors
+
+    def snapshot(self, start_id: EventId | None = None) -> "StorySnapshot":
+        """See snapshot()."""
+        last = self.last()
+        if last is None:
+            return new_snapshot()
+
+        return self._fold(last.id if start_id is None else start_id).snapshot()
+
+    def _fold(self, event_id: EventId) -> _Fold:
+        """Fold the events after the nearest checkpoint on the branch, which
+        is at most checkpoint_interval events back."""
+        last = self.last()
+        if last is not None and event_id == last.id and self.last_fold is not None:
+            return self.last_fold
+
+        pending = []
+        next_id = event_id
+        while next_id not in self.checkpoints:
+            event = self.by_id.get(next_id)
+            if event is None:
+                raise ValueError(f"Parent event with ID {next_id} not found in stream")
+            pending.append(event)
+            # Every root is a checkpoint, so this always has a parent.
+            assert event.parent is not None
+            next_id = event.parent
+
+        fold = self.checkpoints[next_id]
+        for event in reversed(pending):
+            fold = fold.then(event)
+        return fold
 
 
 class AnnotationType(StrEnum):
@@ -78,11 +290,21 @@ def new_snapshot():
     )
 
 
-def snapshot(events: EventStream, start_id: EventId | None = None) -> StorySnapshot:
+def snapshot(
+    events: EventStream | list[Event], start_id: EventId | None = None
+) -> StorySnapshot:
     """
     Generate a story snapshot from the given event stream, working
-    backwards from the event at start_id.
+    backwards from the event at start_id, or the last event if there
+    is none.
+
+    A list of events is searched from the end for each parent, so
+    taking a snapshot of a long list is slow. Use an EventStream
+    instead wherever snapshots are taken repeatedly.
     """
+    if isinstance(events, EventStream):
+        return events.snapshot(start_id)
+
     if len(events) == 0:
         return new_snapshot()
     elif start_id == None:
@@ -1,3 +1,6 @@
+from . import locking
+
+import os
 import time
 import threading
 
@@ -13,9 +16,11 @@ class IDGenerator:
 
     Features:
     - Thread-safe generation using locks
+    - Batches of IDs reserved under a single lock with generate_many()
     - Clock drift protection
     - Epoch starting from January 2024
-    - Up to 4096 IDs per millisecond per server
+    - Up to 4096 IDs per millisecond per server, after which generation
+      sleeps until the next millisecond
     """
 
     def __init__(self, server_id: int = 0):
@@ -41,35 +46,119 @@ class IDGenerator:
     def _get_timestamp(self) -> int:
         return int(time.time() * 1000)
 
+    def _next_timestamp(self) -> int:
+        """Sleep until the clock passes the last timestamp used."""
+        while True:
+            timestamp = self._get_timestamp()
+            if timestamp > self.last_timestamp:
+                return timestamp
+            time.sleep(max(0, (self.last_timestamp + 1) / 1000 - time.time()))
+
+    def _reserve(self, count: int) -> tuple[int, int, int]:
+        """Reserve up to count consecutive counter values in one
+        millisecond. Returns the timestamp, the first counter value and
+        how many were reserved."""
+        timestamp = self._get_timestamp()
+
+        if timestamp < self.last_timestamp:
+            raise RuntimeError("Clock moved backwards")
+
+        first = 0
+        if timestamp == self.last_timestamp:
+            if self.counter == self.max_counter:
+                timestamp = self._next_timestamp()
+            else:
+                first = self.counter + 1
+
+        count = min(count, self.max_counter + 1 - first)
+        self.last_timestamp = timestamp
+        self.counter = first + count - 1
+        return timestamp, first, count
+
+    def _base(self, timestamp: int) -> int:
+        timestamp_part = (timestamp - self.epoch) << self.timestamp_shift
+        server_part = self.server_id << self.server_id_shift
+        return timestamp_part | server_part
+
     def generate(self) -> int:
         with self.lock:
-            timestamp = self._get_timestamp()
+            timestamp, counter, _ = self._reserve(1)
+            return self._base(timestamp) | counter
 
-            if timestamp < self.last_timestamp:
-                raise RuntimeError("Clock moved backwards")
+    def generate_many(self, count: int) -> list[int]:
+        """count IDs, in increasing order, taking the lock once."""
+        ids: list[int] = []
+        with self.lock:
+            while len(ids) < count:
+                timestamp, first, reserved = self._reserve(count - len(ids))
+                base = self._base(timestamp)
+                ids.extend(range(base | first, (base | first) + reserved))
+        return ids
+
+
+def _default_lease_dir() -> str:
+    # Next to the story repository the front ends share, rather than in a
+    # temporary directory that can differ between workers.
+    return os.getenv("STORY_ID_LEASE_DIR") or os.path.expanduser("~/story_repo/ids")
 
-            if timestamp == self.last_timestamp:
-                self.counter = (self.counter + 1) & self.max_counter
-                if self.counter == 0:
-                    while timestamp <= self.last_timestamp:
-                        timestamp = self._get_timestamp()
-            else:
-                self.counter = 0
 
-            self.last_timestamp = timestamp
+def lease_server_id(lease_dir: str | None = None) -> int:
+    """
+    Lease the lowest server ID from 1 up that no other process on this
+    host (sharing lease_dir) has leased, so that workers started side by
+    side generate distinct IDs.
+
+    Each lease is a lock file held until release_server_id() is called or
+    the process exits, however it exits. Leases go in STORY_ID_LEASE_DIR,
+    or ~/story_repo/ids, unless lease_dir is given.
+    """
+    lease_dir = lease_dir or _default_lease_dir()
+    os.makedirs(lease_dir, exist_ok=True)
+    for server_id in range(1, 1024):
+        if locking.try_lock(os.path.join(lease_dir, f"server-{server_id}.lock")):
+            return server_id
+    raise RuntimeError(f"All server IDs in {lease_dir} are leased")
+
+
+def release_server_id(server_id: int, lease_dir: str | None = None) -> None:
+    lease_dir = lease_dir or _default_lease_dir()
+    locking.unlock(os.path.join(lease_dir, f"server-{server_id}.lock"))
+
 
-            timestamp_part = (timestamp - self.epoch) << self.timestamp_shift
-            server_part = self.server_id << self.server_id_shift
-            counter_part = self.counter
+_default_generator: IDGenerator | None = None
+_default_lock = threading.Lock()
 
-            return timestamp_part | server_part | counter_part
 
+def _forget_default_generator() -> None:
+    global _default_generator, _default_lock
+    _default_generator = None
+    _default_lock = threading.Lock()
 
-_default_generator = IDGenerator(0)
+
+if hasattr(os, "register_at_fork"):
+    # A forked worker leases its own server ID, rather than sharing its
+    # parent's. The parent's lease is forgotten along with its other locks
+    # (see locking).
+    os.register_at_fork(after_in_child=_forget_default_generator)
+
+
+def default_generator() -> IDGenerator:
+    """This process's generator, with a server ID leased the first time
+    it's needed."""
+    global _default_generator
+    if _default_generator is None:
+        with _default_lock:
+            if _default_generator is None:
+                _default_generator = IDGenerator(lease_server_id())
+    return _default_generator
 
 
 def generate_id() -> int:
-    return _default_generator.generate()
+    return default_generator().generate()
+
+
+def generate_ids(count: int) -> list[int]:
+    return default_generator().generate_many(count)
 
 
 def new_generator(server_id: int = 0) -> IDGenerator:
@@ -0,0 +1,110 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from threading import Lock
+from types import ModuleType
+
+import logging
+import os
+
+fcntl: ModuleType | None
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Lock files held by this process, and their open file descriptors. Checked
+# first, so contention within the process never touches the file system.
+_held_lock = Lock()
+_held: dict[str, int | None] = {}
+
+if fcntl is None:
+    logger.warning("File locks are not available: stories are only locked per process")
+
+
+def _forget_inherited() -> None:
+    global _held_lock
+    _held_lock = Lock()
+    for fd in _held.values():
+        if fd is not None:
+            # Closed without unlocking: the lock belongs to the parent, and
+            # unlocking the child's copy of the fd would unlock it there too.
+            os.close(fd)
+    _held.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    # A forked child doesn't hold its parent's locks, and mustn't keep them
+    # held after the parent lets go.
+    os.register_at_fork(after_in_child=_forget_inherited)
+
+
+def try_lock(path: str) -> bool:
+    """Take an exclusive lock on the lock file at path, unless this or any
+    other process holds it. The OS releases the lock if the holding process
+    dies, so a crash can't leave a story locked."""
+    path = os.path.abspath(path)
+    with _held_lock:
+        if path in _held:
+            return False
+
+        fd = None
+        if fcntl is not None:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+
+        _held[path] = fd
+        return True
+
+
+def unlock(path: str) -> None:
+    path = os.path.abspath(path)
+    with _held_lock:
+        fd = _held.pop(path)
+        if fd is not None and fcntl is not None:
+            # Lock files are left in place: removing one could let two
+            # processes lock different files for the same story.
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+
+def is_locked(path: str) -> bool:
+    """Whether this process holds the lock at path."""
+    with _held_lock:
+        return os.path.abspath(path) in _held
+
+
+@contextmanager
+def exclusive(path: str) -> Iterator[None]:
+    """Hold the lock file at path for a short critical section, waiting
+    for any other holder to finish. Each holder opens the file itself, so
+    this excludes other threads in this process too."""
+    with _flock(path, "LOCK_EX"):
+        yield
+
+
+@contextmanager
+def shared(path: str) -> Iterator[None]:
+    """Like exclusive(), but only waits for exclusive holders: any number
+    of shared holders can hold the lock at once."""
+    with _flock(path, "LOCK_SH"):
+        yield
+
+
+@contextmanager
+def _flock(path: str, operation: str) -> Iterator[None]:
+    if fcntl is None:
+        yield
+        return
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, getattr(fcntl, operation))
+        yield
+    finally:
+        os.close(fd)
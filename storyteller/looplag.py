@@ -0,0 +1,64 @@
+from pydantic import BaseModel
+from collections import deque
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagStats(BaseModel):
+    samples: int = 0
+    mean_ms: float = 0
+    p99_ms: float = 0
+    max_ms: float = 0
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs a timer set every interval_ms,
+    which is how long anything else waiting on the loop (like a token
+    stream) was held up. Lag over warn_ms is logged."""
+
+    def __init__(self, interval_ms: int = 100, warn_ms: int = 250, window: int = 600):
+        self.interval_ms = interval_ms
+        self.warn_ms = warn_ms
+        self.lags: deque[float] = deque(maxlen=window)
+        self.max_ms = 0.0
+        self.task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._measure())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _measure(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval_ms / 1000
+            await asyncio.sleep(self.interval_ms / 1000)
+            lag_ms = max(0.0, (loop.time() - expected) * 1000)
+            self.lags.append(lag_ms)
+            self.max_ms = max(self.max_ms, lag_ms)
+            if lag_ms > self.warn_ms:
+                logger.warning(f"Event loop was blocked for {lag_ms:.0f}ms")
+
+    def current_stats(self) -> LoopLagStats:
+        """Stats over the recent window, and the maximum since startup."""
+        if not self.lags:
+            return LoopLagStats()
+
+        lags = sorted(self.lags)
+        return LoopLagStats(
+            samples=len(lags),
+            mean_ms=sum(lags) / len(lags),
+            p99_ms=lags[min(len(lags) - 1, int(len(lags) * 0.99))],
+            max_ms=self.max_ms,
+        )
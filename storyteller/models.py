@@ -1,6 +1,8 @@
 from datetime import datetime
-from pydantic import BaseModel, field_validator
+from typing import Any
+from pydantic import BaseModel, PrivateAttr, field_validator
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, AIMessageChunk
+from .tokens import TokenLedger, Tokenizer, approximate_tokens
 
 
 class Chapter(BaseModel):
@@ -24,6 +26,14 @@ class OpeningSuggestion(BaseModel):
     opening_paragraph: str
 
 
+class ArchivedMessages(BaseModel):
+    """A reference to a segment of old messages that the story's
+    repository has moved out of the story into cold storage."""
+
+    segment: int
+    messages: int
+
+
 class Story(BaseModel):
     @classmethod
     def new(cls):
@@ -54,6 +64,11 @@ class Story(BaseModel):
     def load_current_messages(cls, messages):
         return Story.to_lc_messages(messages)
 
+    @field_validator("alternatives", mode="before")
+    @classmethod
+    def load_alternatives(cls, messages):
+        return Story.to_lc_messages(messages)
+
     @classmethod
     def to_saved_message(cls, msg: BaseMessage):
         return {"type": msg.__class__.__name__, "content": msg.content}
@@ -68,6 +83,20 @@ class Story(BaseModel):
     scenes: list[Scene]
     old_messages: list[BaseMessage]
     current_messages: list[BaseMessage]
+    archived_messages: list[ArchivedMessages] = []
+    # Other candidates for the last response, which a retry can swap in
+    alternatives: list[BaseMessage] = []
+
+    _token_ledger: TokenLedger | None = PrivateAttr(default=None)
+    # The render cache for the story's prompt context, see render.py
+    _context: Any = PrivateAttr(default=None)
+
+    def token_ledger(self, tokenizer: Tokenizer = approximate_tokens) -> TokenLedger:
+        """Token counts for current_messages, updated for any messages
+        added or removed since they were last counted."""
+        if self._token_ledger is None or self._token_ledger.tokenizer is not tokenizer:
+            self._token_ledger = TokenLedger(tokenizer)
+        return self._token_ledger.sync(self.current_messages)
 
 
 class StoryIndex(BaseModel):
@@ -0,0 +1,73 @@
+from .engine import StoryEngine
+
+from pydantic import BaseModel
+from collections import OrderedDict
+from collections.abc import Callable
+
+import asyncio
+
+
+class EnginePoolStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    engines: int = 0
+
+
+class EnginePool:
+    """An LRU pool of story engines, one per key (such as a user), so that
+    an engine and its repository are set up once and keep whatever they
+    have cached between requests.
+
+    Evicted engines are closed, writing back any changes in their cache. A
+    request still using an evicted engine can finish with it, so engines in
+    a pool should have caches that save every command."""
+
+    def __init__(self, create: Callable[[str], StoryEngine], max_engines: int = 256):
+        self.create = create
+        self.max_engines = max_engines
+        self.engines: OrderedDict[str, StoryEngine] = OrderedDict()
+        # Engines being created, which other requests for the key wait for.
+        self.creating: dict[str, asyncio.Task[StoryEngine]] = {}
+        self.stats = EnginePoolStats()
+
+    async def get(self, key: str) -> StoryEngine:
+        engine = self.engines.get(key)
+        if engine is not None:
+            self.stats.hits += 1
+            self.engines.move_to_end(key)
+            return engine
+
+        creating = self.creating.get(key)
+        if creating is not None:
+            self.stats.hits += 1
+        else:
+            self.stats.misses += 1
+            creating = self.creating[key] = asyncio.create_task(self._add(key))
+        # The engine is added to the pool even if this request is cancelled.
+        return await asyncio.shield(creating)
+
+    async def _add(self, key: str) -> StoryEngine:
+        try:
+            # Creating an engine can set up its repository on disk, so it
+            # runs in a thread rather than blocking the event loop.
+            engine = await asyncio.to_thread(self.create, key)
+        finally:
+            del self.creating[key]
+
+        self.engines[key] = engine
+        while len(self.engines) > self.max_engines:
+            _, evicted = self.engines.popitem(last=False)
+            self.stats.evictions += 1
+            await evicted.close()
+        return engine
+
+    async def close(self) -> None:
+        # Let engines being created join the pool, so they're closed too.
+        await asyncio.gather(*self.creating.values(), return_exceptions=True)
+        while self.engines:
+            _, engine = self.engines.popitem()
+            await engine.close()
+
+    def current_stats(self) -> EnginePoolStats:
+        return self.stats.model_copy(update={"engines": len(self.engines)})
@@ -0,0 +1,90 @@
+from .models import Chapter, Character, Scene, Story
+from .tokens import Tokenizer, approximate_tokens
+
+from langchain_core.messages import SystemMessage
+from collections.abc import Callable, Hashable
+
+
+def render_characters(characters: list[Character]) -> str:
+    return "\n\n".join(
+        f"## {character.name} ({character.role})\n{character.bio}"
+        for character in characters
+    )
+
+
+def render_chapters(chapters: list[Chapter]) -> str:
+    return "".join(
+        f"## Chapter {idx + 1}: {chapter.title}\n {chapter.summary}\n\n"
+        for idx, chapter in enumerate(chapters)
+    )
+
+
+def render_scenes(chapter_number: int, scenes: list[Scene]) -> str:
+    rendered = "".join(
+        f"### {scene.time_and_location}\n{scene.events}\n\n" for scene in scenes
+    )
+    return f"## Chapter {chapter_number}\n\n {rendered}"
+
+
+class RenderedSection:
+    def __init__(self, version: Hashable, text: str, tokens: int):
+        self.version = version
+        self.text = text
+        self.tokens = tokens
+
+
+class StoryContext:
+    """The story sections of the chat prompt, rendered from the story.
+
+    Each section is versioned by the data it's rendered from, and only
+    re-rendered (and re-counted) when that data changes. Closed chapters
+    never change, so in a long story most turns render nothing at all."""
+
+    def __init__(self, tokenizer: Tokenizer = approximate_tokens):
+        self.tokenizer = tokenizer
+        self.sections: dict[str, RenderedSection] = {}
+        self.renders = 0
+
+    def render(self, story: Story) -> dict[str, str]:
+        """The rendered characters, chapters and scenes sections."""
+        self._section(
+            "characters",
+            tuple((c.name, c.role, c.bio) for c in story.characters),
+            lambda: render_characters(story.characters),
+        )
+        self._section(
+            "chapters",
+            tuple((c.title, c.summary) for c in story.chapters),
+            lambda: render_chapters(story.chapters),
+        )
+        self._section(
+            "scenes",
+            (
+                len(story.chapters),
+                tuple((s.time_and_location, s.events) for s in story.scenes),
+            ),
+            lambda: render_scenes(len(story.chapters) + 1, story.scenes),
+        )
+        return {name: section.text for name, section in self.sections.items()}
+
+    def tokens(self) -> dict[str, int]:
+        """Token counts of each section, as of the last render."""
+        return {name: section.tokens for name, section in self.sections.items()}
+
+    def _section(self, name: str, version: Hashable, render: Callable[[], str]):
+        section = self.sections.get(name)
+        if section is None or section.version != version:
+            text = render()
+            self.sections[name] = RenderedSection(
+                version, text, self.tokenizer(SystemMessage(text))
+            )
+            self.renders += 1
+
+
+def story_context(story: Story) -> StoryContext:
+    """The story's render cache, which lives as long as the loaded story."""
+    context = story._context
+    if context is None:
+        context = StoryContext()
+        story._context = context
+    return context
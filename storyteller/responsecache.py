@@ -0,0 +1,160 @@
+from langchain_core.language_models.base import BaseLanguageModel
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import RunnableConfig
+from pydantic import BaseModel
+from collections import OrderedDict
+from threading import Lock
+from typing import TypeVar
+
+from .routing import model_name
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+_BM = TypeVar("_BM", bound=BaseModel)
+
+logger = logging.getLogger(__name__)
+
+# Run a cached chain with this config to skip the cache for one call, for
+# anything that needs a fresh response. The response still replaces the
+# cached one.
+BYPASS_CACHE: RunnableConfig = {"configurable": {"bypass_cache": True}}
+
+
+def bypasses_cache(config: RunnableConfig | None) -> bool:
+    return bool(((config or {}).get("configurable") or {}).get("bypass_cache"))
+
+
+class ResponseCacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    bypassed: int = 0
+    writes: int = 0
+    evictions: int = 0
+    entries: int = 0
+    size: int = 0
+
+
+def response_key(
+    model: BaseLanguageModel, prompt: PromptValue, output_format: type[BaseModel]
+) -> str:
+    """The cache key for a structured response: a hash of everything the
+    response depends on."""
+    key = {
+        "model": f"{model.__class__.__name__}:{model_name(model)}",
+        "temperature": getattr(model, "temperature", None),
+        "prompt": prompt.to_string(),
+        "schema": output_format.model_json_schema(),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class ResponseCache:
+    """An on-disk cache of structured chain responses, one JSON file per
+    response, named by its key. Entries expire after ttl_s, and the least
+    recently used entries are evicted to keep the cache under max_size
+    bytes.
+
+    Several processes can share a cache directory. Each keeps its own
+    index of the entries, and looks on disk for entries it doesn't know
+    about, which another process may have written since. Calls do blocking
+    file I/O, so async code should run them on a thread."""
+
+    def __init__(self, cache_dir: str, ttl_s: int = 86400, max_size: int = 64 << 20):
+        self.cache_dir = cache_dir
+        self.ttl_s = ttl_s
+        self.max_size = max_size
+        self.stats = ResponseCacheStats()
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.size = 0
+        self.lock = Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        files = [
+            entry
+            for entry in os.scandir(cache_dir)
+            if entry.is_file() and entry.name.endswith(".json")
+        ]
+        for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+            self.entries[entry.name.removesuffix(".json")] = entry.stat().st_size
+            self.size += entry.stat().st_size
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def count_bypass(self) -> None:
+        with self.lock:
+            self.stats.bypassed += 1
+
+    def get(self, key: str, output_format: type[_BM]) -> _BM | None:
+        with self.lock:
+            return self._get(key, output_format)
+
+    def _get(self, key: str, output_format: type[_BM]) -> _BM | None:
+        if key not in self.entries:
+            try:
+                size = os.stat(self._file(key)).st_size
+            except FileNotFoundError:
+                self.stats.misses += 1
+                return None
+            # Written by another process.
+            self.entries[key] = size
+            self.size += size
+
+        try:
+            with open(self._file(key)) as f:
+                saved = json.load(f)
+            if time.time() - saved["created"] > self.ttl_s:
+                self.stats.expired += 1
+                self._remove(key)
+                self.stats.misses += 1
+                return None
+            value = output_format.model_validate(saved["value"])
+        except (OSError, ValueError, KeyError):
+            logger.warning(f"Dropping unreadable cached response {key}")
+            self._remove(key)
+            self.stats.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    def put(self, key: str, value: BaseModel) -> None:
+        content = json.dumps(
+            {"created": time.time(), "value": value.model_dump(mode="json")}
+        ).encode()
+
+        path = self._file(key)
+        # Named for this process, as another may be writing the same entry.
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with self.lock:
+            with open(tmp, "wb") as f:
+                f.write(content)
+            os.replace(tmp, path)
+
+            self.size -= self.entries.pop(key, 0)
+            self.entries[key] = len(content)
+            self.size += len(content)
+            self.stats.writes += 1
+
+            while self.size > self.max_size and len(self.entries) > 1:
+                self._remove(next(iter(self.entries)))
+                self.stats.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        self.size -= self.entries.pop(key, 0)
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+
+    def current_stats(self) -> ResponseCacheStats:
+        with self.lock:
+            return self.stats.model_copy(
+                update={"entries": len(self.entries), "size": self.size}
+            )
@@ -0,0 +1,85 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.base import BaseLanguageModel
+from langchain_core.runnables import RunnableConfig
+from pydantic import BaseModel
+from enum import StrEnum
+from uuid import UUID
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ChainRole(StrEnum):
+    """The job each chain does, which decides the model it's routed to."""
+
+    Chat = "chat"
+    Fix = "fix"
+    Summary = "summary"
+    CharacterBio = "character_bio"
+    Chapter = "chapter"
+    CharacterCreate = "character_create"
+    OpeningSuggestions = "opening_suggestions"
+
+
+# Shorthand for routing all the summarization that runs in the background.
+BACKGROUND_ROLES = [ChainRole.Summary, ChainRole.CharacterBio, ChainRole.Chapter]
+
+
+class ChainLatency(BaseModel):
+    model: str
+    calls: int = 0
+    errors: int = 0
+    total_ms: float = 0
+    max_ms: float = 0
+
+
+def model_name(model: BaseLanguageModel) -> str:
+    name = getattr(model, "model_name", None) or getattr(model, "model", None)
+    return str(name) if name else model.__class__.__name__
+
+
+class LatencyTracker(BaseCallbackHandler):
+    """Times each call of the chains it's attached to, by role, so that
+    the models each role is routed to can be compared."""
+
+    run_inline = True
+
+    def __init__(self):
+        self.stats: dict[ChainRole, ChainLatency] = {}
+        self.started: dict[UUID, tuple[ChainRole, float]] = {}
+
+    def track(self, role: ChainRole, model: BaseLanguageModel) -> RunnableConfig:
+        """The config to run a chain with, to track it under role."""
+        self.stats[role] = ChainLatency(model=model_name(model))
+        return {"run_name": role.value, "callbacks": [self], "metadata": {"role": role}}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        role = (kwargs.get("metadata") or {}).get("role")
+        # Only time the chain itself, not each of its steps.
+        if role in self.stats and kwargs.get("name") == role:
+            self.started[run_id] = (role, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id, failed=False)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, failed=True)
+
+    def _finish(self, run_id: UUID, failed: bool) -> None:
+        started = self.started.pop(run_id, None)
+        if started is None:
+            return
+
+        role, start = started
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        stats = self.stats[role]
+        stats.calls += 1
+        stats.errors += int(failed)
+        stats.total_ms += elapsed_ms
+        stats.max_ms = max(stats.max_ms, elapsed_ms)
+        logger.debug(f"{role} chain on {stats.model} took {elapsed_ms:.0f}ms")
+
+    def current_stats(self) -> dict[ChainRole, ChainLatency]:
+        return {role: stats.model_copy() for role, stats in self.stats.items()}
@@ -0,0 +1,171 @@
+from .engine import Chains, Response, StoryEngine, StoryLocked
+from .commands import SummarizeCommand
+from .storyqueue import StoryBusy
+from .tokens import Tokenizer, approximate_tokens
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LogResponse(Response):
+    """Response for background work that nobody is waiting to see."""
+
+    async def send_message(self, msg: str):
+        logger.info(msg)
+
+    async def start_stream(self):
+        pass
+
+    async def end_stream(self):
+        pass
+
+    async def append(self, msg: str):
+        pass
+
+
+class _SummaryJob:
+    def __init__(self, engine: StoryEngine, response: Response, due: float):
+        self.engine = engine
+        self.response = response
+        self.due = due
+        self.run_now = asyncio.Event()
+        self.waiters: list[asyncio.Future] = []
+
+
+class SummaryScheduler:
+    """Summarizes stories in the background, so that commands can return
+    as soon as their own changes are saved.
+
+    Each scheduled summary waits until the story has been quiet for
+    debounce_ms, so a burst of commands is summarized once, and only runs
+    if the story has grown past max_tokens by then. Summaries wait
+    their turn in the engine's story queue like any other command, and a
+    summary that can't get the story after retry_attempts tries gives up.
+    Front ends should call wait_for_running() before running a command, so
+    that it also waits for a summary this scheduler is running through
+    another engine, one that doesn't share the command's story queue."""
+
+    def __init__(
+        self,
+        chains: Chains,
+        min_tokens: int,
+        max_tokens: int,
+        debounce_ms: int = 1500,
+        retry_ms: int = 250,
+        retry_attempts: int = 40,
+        tokenizer: Tokenizer = approximate_tokens,
+    ):
+        self.chains = chains
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.debounce_ms = debounce_ms
+        self.retry_ms = retry_ms
+        self.retry_attempts = retry_attempts
+        self.tokenizer = tokenizer
+        self.pending: dict[str, _SummaryJob] = {}
+        self.running: dict[str, asyncio.Future] = {}
+        self.workers: dict[str, asyncio.Task] = {}
+
+    def schedule(
+        self, engine: StoryEngine, story_id: str, response: Response
+    ) -> asyncio.Future:
+        """Schedule a story to be summarized, replacing any summary of it
+        that hasn't started yet. Progress goes to the latest response.
+
+        Returns a future that resolves once the summary has run, to None
+        or to the error it failed with."""
+        loop = asyncio.get_running_loop()
+        due = loop.time() + self.debounce_ms / 1000
+
+        job = self.pending.get(story_id)
+        if job is None:
+            job = _SummaryJob(engine, response, due)
+            self.pending[story_id] = job
+        else:
+            job.engine = engine
+            job.response = response
+            job.due = due
+
+        waiter = loop.create_future()
+        job.waiters.append(waiter)
+
+        if story_id not in self.workers:
+            self.workers[story_id] = asyncio.create_task(self._work(story_id))
+
+        return waiter
+
+    async def wait_for_running(self, story_id: str) -> None:
+        """Wait for a summary of the story that this scheduler has already
+        started. Summaries run by other schedulers, such as those in other
+        processes, aren't seen here."""
+        running = self.running.get(story_id)
+        if running is not None:
+            await asyncio.shield(running)
+
+    async def drain(self) -> None:
+        """Run all pending summaries now, and wait for them to finish."""
+        for job in self.pending.values():
+            job.due = 0
+            job.run_now.set()
+        await asyncio.gather(*self.workers.values())
+
+    async def _work(self, story_id: str) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while story_id in self.pending:
+                job = self.pending[story_id]
+                delay = job.due - loop.time()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(job.run_now.wait(), delay)
+                    except TimeoutError:
+                        pass
+                    continue
+
+                del self.pending[story_id]
+                self.running[story_id] = loop.create_future()
+                try:
+                    error = await self._summarize(story_id, job)
+                finally:
+                    self.running.pop(story_id).set_result(None)
+
+                for waiter in job.waiters:
+                    if not waiter.done():
+                        waiter.set_result(error)
+        finally:
+            del self.workers[story_id]
+
+    async def _summarize(self, story_id: str, job: _SummaryJob) -> Exception | None:
+        cmd = SummarizeCommand(
+            self.chains,
+            job.response,
+            self.min_tokens,
+            self.max_tokens,
+            self.tokenizer,
+        )
+        try:
+            # Most commands leave a story under the limit, so check without
+            # taking the story's turn, locking it or saving it.
+            if not cmd.needs_pruning(await job.engine.load(story_id)):
+                return None
+        except Exception as e:
+            logger.exception(f"Summarizing story {story_id} failed")
+            return e
+
+        for attempt in range(self.retry_attempts):
+            try:
+                await job.engine.run_command(story_id, cmd)
+                return None
+            except (StoryLocked, StoryBusy) as e:
+                if attempt == self.retry_attempts - 1:
+                    logger.warning(f"Gave up summarizing story {story_id}: {e}")
+                    return e
+                # A command got in first: summarize after it.
+                await asyncio.sleep(self.retry_ms / 1000)
+            except Exception as e:
+                logger.exception(f"Summarizing story {story_id} failed")
+                return e
+
+        raise ValueError("retry_attempts must be at least 1")
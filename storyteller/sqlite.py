@@ -0,0 +1,395 @@
+from .engine import FileStoryRepository, Messages, StoryLocked, StoryRepository
+from . import locking
+from .models import ArchivedMessages, Chapter, Character, Scene, Story, StoryIndex
+
+from collections.abc import Hashable, Iterator
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Condition, local
+
+import json
+import os
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stories (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    chapters INTEGER NOT NULL,
+    characters INTEGER NOT NULL,
+    created TEXT NOT NULL,
+    last_modified TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS stories_by_last_modified ON stories (last_modified);
+
+CREATE TABLE IF NOT EXISTS messages (
+    story_id TEXT NOT NULL REFERENCES stories (id) ON DELETE CASCADE,
+    bucket TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (story_id, bucket, position)
+);
+
+CREATE TABLE IF NOT EXISTS message_segments (
+    story_id TEXT NOT NULL REFERENCES stories (id) ON DELETE CASCADE,
+    segment INTEGER NOT NULL,
+    messages INTEGER NOT NULL,
+    PRIMARY KEY (story_id, segment)
+);
+
+CREATE TABLE IF NOT EXISTS scenes (
+    story_id TEXT NOT NULL REFERENCES stories (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    time_and_location TEXT NOT NULL,
+    events TEXT NOT NULL,
+    PRIMARY KEY (story_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS characters (
+    story_id TEXT NOT NULL REFERENCES stories (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    role TEXT NOT NULL,
+    bio TEXT NOT NULL,
+    PRIMARY KEY (story_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS chapters (
+    story_id TEXT NOT NULL REFERENCES stories (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    PRIMARY KEY (story_id, position)
+);
+"""
+
+OLD_MESSAGES = "old"
+CURRENT_MESSAGES = "current"
+ALTERNATIVES = "alternatives"
+
+
+class SqliteStoryRepository(StoryRepository):
+    """Stores stories in normalized tables in a single SQLite database, with
+    the story index kept as a table that can be queried directly.
+
+    Old messages are archived in segments when a story is saved, and are
+    only read back by load_old_messages() and export().
+
+    The database runs in WAL mode, so loads and listings don't block saves.
+    Each thread gets its own connection, until close() is called."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.lock_dir = f"{db_path}.locks"
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self.local = local()
+        # Every thread's connection, and how many are being used right now.
+        self.connections: list[sqlite3.Connection] = []
+        self.in_use = 0
+        self.connections_changed = Condition()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        with self.connections_changed:
+            conn = getattr(self.local, "conn", None)
+            if conn is None:
+                # Only ever used by this thread, but closed by close() from
+                # whichever thread calls it.
+                conn = sqlite3.connect(
+                    self.db_path,
+                    timeout=30,
+                    isolation_level=None,
+                    check_same_thread=False,
+                )
+                conn.row_factory = sqlite3.Row
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("PRAGMA foreign_keys=ON")
+                self.local.conn = conn
+                self.connections.append(conn)
+            self.in_use += 1
+
+        try:
+            yield conn
+        finally:
+            with self.connections_changed:
+                self.in_use -= 1
+                self.connections_changed.notify_all()
+
+    def close(self) -> None:
+        """Close every thread's connection, once none of them is being
+        used. Anything using the repository afterwards opens new ones."""
+        with self.connections_changed:
+            self.connections_changed.wait_for(lambda: self.in_use == 0)
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+            self.local = local()
+
+    def _load_messages(
+        self, conn: sqlite3.Connection, story_id: str, bucket: str
+    ) -> list[dict]:
+        return [
+            {"type": row["type"], "content": json.loads(row["content"])}
+            for row in conn.execute(
+                "SELECT type, content FROM messages WHERE story_id = ? AND bucket = ? ORDER BY position",
+                (story_id, bucket),
+            )
+        ]
+
+    def _insert_messages(
+        self,
+        conn: sqlite3.Connection,
+        story_id: str,
+        bucket: str,
+        messages: list,
+        start: int,
+    ) -> None:
+        conn.executemany(
+            "INSERT INTO messages (story_id, bucket, position, type, content) VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    story_id,
+                    bucket,
+                    start + idx,
+                    saved["type"],
+                    json.dumps(saved["content"]),
+                )
+                for idx, saved in enumerate(
+                    Story.to_saved_message(message) for message in messages
+                )
+            ],
+        )
+
+    def list(self, offset: int = 0, limit: int | None = None) -> list[StoryIndex]:
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT id, title, chapters, characters, created, last_modified FROM stories"
+                " ORDER BY last_modified DESC LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset),
+            )
+            return [StoryIndex(**row) for row in rows]
+
+    def _lock_file(self, story_id: str) -> str:
+        return os.path.join(self.lock_dir, f"{story_id}.lock")
+
+    def lock(self, story_id: str) -> None:
+        if not locking.try_lock(self._lock_file(story_id)):
+            raise StoryLocked(f"Story {story_id} is locked by another process.")
+
+    def unlock(self, story_id: str) -> None:
+        locking.unlock(self._lock_file(story_id))
+
+    def story_exists(self, story_id: str) -> bool:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM stories WHERE id = ?", (story_id,)
+            ).fetchone()
+        return row is not None
+
+    def version(self, story_id: str) -> Hashable:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT last_modified FROM stories WHERE id = ?", (story_id,)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def load(self, story_id: str) -> Story:
+        with self._connection() as conn:
+            # A read transaction, so that all the tables are read from the same
+            # version of the story.
+            conn.execute("BEGIN")
+            try:
+                story = conn.execute(
+                    "SELECT title FROM stories WHERE id = ?", (story_id,)
+                ).fetchone()
+                if story is None:
+                    raise FileNotFoundError(f"Story {story_id} not found.")
+
+                # Messages are read as saved dicts, which validating the
+                # story turns back into messages.
+                return Story.model_validate(
+                    dict(
+                        title=story["title"],
+                        characters=[
+                            Character(**row)
+                            for row in conn.execute(
+                                "SELECT name, role, bio FROM characters WHERE story_id = ? ORDER BY position",
+                                (story_id,),
+                            )
+                        ],
+                        chapters=[
+                            Chapter(**row)
+                            for row in conn.execute(
+                                "SELECT title, summary FROM chapters WHERE story_id = ? ORDER BY position",
+                                (story_id,),
+                            )
+                        ],
+                        scenes=[
+                            Scene(**row)
+                            for row in conn.execute(
+                                "SELECT time_and_location, events FROM scenes WHERE story_id = ? ORDER BY position",
+                                (story_id,),
+                            )
+                        ],
+                        old_messages=[],
+                        current_messages=self._load_messages(
+                            conn, story_id, CURRENT_MESSAGES
+                        ),
+                        alternatives=self._load_messages(conn, story_id, ALTERNATIVES),
+                        archived_messages=[
+                            ArchivedMessages(**row)
+                            for row in conn.execute(
+                                "SELECT segment, messages FROM message_segments WHERE story_id = ? ORDER BY segment",
+                                (story_id,),
+                            )
+                        ],
+                    )
+                )
+            finally:
+                conn.execute("COMMIT")
+
+    def load_old_messages(self, story_id: str, story: Story) -> Messages:
+        with self._connection() as conn:
+            old_messages = self._load_messages(conn, story_id, OLD_MESSAGES)
+        return Story.to_lc_messages(old_messages) + story.old_messages
+
+    def save(self, story_id: str, story: Story) -> None:
+        self._save(story_id, story)
+
+    def import_story(
+        self, story_id: str, story: Story, created: datetime, last_modified: datetime
+    ) -> None:
+        """Save a story exported from another repository, replacing any
+        existing story with the same id, and keeping its original dates."""
+        self._save(story_id, story, created, last_modified, replace=True)
+
+    def _save(
+        self,
+        story_id: str,
+        story: Story,
+        created: datetime | None = None,
+        last_modified: datetime | None = None,
+        replace: bool = False,
+    ) -> None:
+        with self._connection() as conn:
+            now = datetime.now()
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if replace:
+                    conn.execute("DELETE FROM stories WHERE id = ?", (story_id,))
+
+                conn.execute(
+                    """
+                    INSERT INTO stories (id, title, chapters, characters, created, last_modified)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET
+                        title = excluded.title,
+                        chapters = excluded.chapters,
+                        characters = excluded.characters,
+                        last_modified = excluded.last_modified
+                    """,
+                    (
+                        story_id,
+                        story.title,
+                        len(story.chapters),
+                        len(story.characters),
+                        (created or now).isoformat(),
+                        (last_modified or now).isoformat(),
+                    ),
+                )
+
+                for table in ("scenes", "characters", "chapters"):
+                    conn.execute(f"DELETE FROM {table} WHERE story_id = ?", (story_id,))
+
+                conn.executemany(
+                    "INSERT INTO scenes (story_id, position, time_and_location, events) VALUES (?, ?, ?, ?)",
+                    [
+                        (story_id, idx, scene.time_and_location, scene.events)
+                        for idx, scene in enumerate(story.scenes)
+                    ],
+                )
+                conn.executemany(
+                    "INSERT INTO characters (story_id, position, name, role, bio) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (story_id, idx, character.name, character.role, character.bio)
+                        for idx, character in enumerate(story.characters)
+                    ],
+                )
+                conn.executemany(
+                    "INSERT INTO chapters (story_id, position, title, summary) VALUES (?, ?, ?, ?)",
+                    [
+                        (story_id, idx, chapter.title, chapter.summary)
+                        for idx, chapter in enumerate(story.chapters)
+                    ],
+                )
+
+                archived = None
+                if story.old_messages:
+                    segment, saved_old_messages = conn.execute(
+                        "SELECT COALESCE(MAX(segment), -1) + 1, COALESCE(SUM(messages), 0) FROM message_segments WHERE story_id = ?",
+                        (story_id,),
+                    ).fetchone()
+                    self._insert_messages(
+                        conn,
+                        story_id,
+                        OLD_MESSAGES,
+                        story.old_messages,
+                        saved_old_messages,
+                    )
+                    archived = ArchivedMessages(
+                        segment=segment, messages=len(story.old_messages)
+                    )
+                    conn.execute(
+                        "INSERT INTO message_segments (story_id, segment, messages) VALUES (?, ?, ?)",
+                        (story_id, archived.segment, archived.messages),
+                    )
+
+                conn.execute(
+                    "DELETE FROM messages WHERE story_id = ? AND bucket IN (?, ?)",
+                    (story_id, CURRENT_MESSAGES, ALTERNATIVES),
+                )
+                self._insert_messages(
+                    conn, story_id, CURRENT_MESSAGES, story.current_messages, 0
+                )
+                self._insert_messages(
+                    conn, story_id, ALTERNATIVES, story.alternatives, 0
+                )
+
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+            if archived is not None:
+                story.archived_messages = [*story.archived_messages, archived]
+                story.old_messages = []
+
+
+def import_file_repository(
+    source: FileStoryRepository, target: SqliteStoryRepository
+) -> list[str]:
+    """Copy every story in a file repository into a SQLite repository,
+    keeping the creation and modification dates from the file index where
+    there are any. Returns the ids of the imported stories."""
+    index = {item.id: item for item in source.list()}
+    imported = []
+
+    for story_id in source.story_ids():
+        story = source.export(story_id)
+        item = index.get(story_id)
+        now = datetime.now()
+        target.import_story(
+            story_id,
+            story,
+            created=item.created if item else now,
+            last_modified=item.last_modified if item else now,
+        )
+        imported.append(story_id)
+
+    return imported
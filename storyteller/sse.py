@@ -0,0 +1,65 @@
+from .engine import Command, Response, StoryEngine
+from .scheduler import SummaryScheduler
+
+import asyncio
+import json
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class SSEResponse(Response):
+    """Response that queues each message and streamed token as a
+    server-sent event. Events are named after the Response method, with a
+    prefix to tell apart responses that share a stream."""
+
+    def __init__(self, events: asyncio.Queue[str | None], prefix: str = ""):
+        self.events = events
+        self.prefix = prefix
+
+    def emit(self, event: str, data: dict) -> None:
+        self.events.put_nowait(sse_event(self.prefix + event, data))
+
+    async def send_message(self, msg: str):
+        self.emit("message", {"text": msg})
+
+    async def start_stream(self):
+        self.emit("stream_start", {})
+
+    async def end_stream(self):
+        self.emit("stream_end", {})
+
+    async def append(self, msg: str):
+        self.emit("token", {"text": msg})
+
+
+async def run_streamed_command(
+    engine: StoryEngine,
+    story_id: str,
+    cmd: Command,
+    summary_scheduler: SummaryScheduler,
+    events: asyncio.Queue[str | None],
+) -> None:
+    """Run a command whose response is an SSEResponse on events, then the
+    story's summary. Queues a result event once the command is saved (or
+    an error event if it fails), then the summary's events, ending with
+    summary_done. None is queued last, to end the stream."""
+    try:
+        await summary_scheduler.wait_for_running(story_id)
+        await engine.run_command(story_id, cmd)
+        events.put_nowait(sse_event("result", {"status": "success"}))
+
+        error = await summary_scheduler.schedule(
+            engine, story_id, SSEResponse(events, "summary_")
+        )
+        if error is None:
+            events.put_nowait(sse_event("summary_done", {"status": "success"}))
+        else:
+            events.put_nowait(
+                sse_event("summary_done", {"status": "error", "detail": str(error)})
+            )
+    except Exception as e:
+        events.put_nowait(sse_event("error", {"detail": str(e)}))
+    finally:
+        events.put_nowait(None)
@@ -0,0 +1,128 @@
+from pydantic import BaseModel
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+import asyncio
+
+_T = TypeVar("_T")
+
+
+class StoryBusy(Exception):
+    """A story has too many commands waiting, or a command waited too long
+    for the ones ahead of it."""
+
+
+class StoryQueueStats(BaseModel):
+    stories: int = 0
+    waiting: int = 0
+    max_depth: int = 0
+    commands: int = 0
+    rejected: int = 0
+    timed_out: int = 0
+    mean_wait_ms: float = 0
+    max_wait_ms: float = 0
+
+
+class _QueuedJob:
+    def __init__(self, job: Callable[[], Awaitable], queued_at: float):
+        self.job = job
+        self.queued_at = queued_at
+        self.started = asyncio.get_running_loop().create_future()
+        self.done = asyncio.get_running_loop().create_future()
+        self.abandoned = False
+
+
+class StoryQueues:
+    """Runs jobs one at a time per story, in the order they were submitted,
+    while jobs for different stories run concurrently.
+
+    Each story with work to do gets a queue and a worker task that exits
+    once the queue is empty. A job is refused with StoryBusy if max_depth
+    jobs are already waiting for its story, or if it waits more than
+    timeout_s to start."""
+
+    def __init__(self, max_depth: int = 8, timeout_s: float = 120):
+        self.max_depth = max_depth
+        self.timeout_s = timeout_s
+        self.queues: dict[str, asyncio.Queue[_QueuedJob]] = {}
+        self.workers: dict[str, asyncio.Task] = {}
+        self.stats = StoryQueueStats()
+        self.total_wait_ms = 0.0
+
+    async def run(self, story_id: str, job: Callable[[], Awaitable[_T]]) -> _T:
+        queue = self.queues.get(story_id)
+        if queue is None:
+            queue = self.queues[story_id] = asyncio.Queue(self.max_depth)
+
+        loop = asyncio.get_running_loop()
+        queued = _QueuedJob(job, loop.time())
+        try:
+            queue.put_nowait(queued)
+        except asyncio.QueueFull:
+            self.stats.rejected += 1
+            raise StoryBusy(
+                f"Story {story_id} already has {self.max_depth} commands waiting."
+            )
+        self.stats.max_depth = max(self.stats.max_depth, queue.qsize())
+
+        if story_id not in self.workers:
+            self.workers[story_id] = asyncio.create_task(self._work(story_id, queue))
+
+        try:
+            await asyncio.wait_for(asyncio.shield(queued.started), self.timeout_s)
+        except TimeoutError:
+            if not queued.started.done():
+                queued.abandoned = True
+                self.stats.timed_out += 1
+                raise StoryBusy(
+                    f"Timed out after {self.timeout_s}s waiting for story {story_id}."
+                )
+        except asyncio.CancelledError:
+            queued.abandoned = True
+            raise
+
+        return await queued.done
+
+    def busy(self, story_id: str) -> bool:
+        """Whether a job for the story is running or waiting."""
+        return story_id in self.queues
+
+    async def _work(self, story_id: str, queue: asyncio.Queue[_QueuedJob]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while not queue.empty():
+                queued = queue.get_nowait()
+                if queued.abandoned:
+                    continue
+
+                wait_ms = (loop.time() - queued.queued_at) * 1000
+                self.stats.commands += 1
+                self.total_wait_ms += wait_ms
+                self.stats.max_wait_ms = max(self.stats.max_wait_ms, wait_ms)
+                queued.started.set_result(None)
+
+                try:
+                    queued.done.set_result(await queued.job())
+                except asyncio.CancelledError:
+                    queued.done.cancel()
+                    raise
+                except Exception as e:
+                    queued.done.set_exception(e)
+        finally:
+            # Nothing can be queued between the loop's last check and here,
+            # so the next job for this story starts a new worker.
+            del self.workers[story_id]
+            del self.queues[story_id]
+
+    def current_stats(self) -> StoryQueueStats:
+        return self.stats.model_copy(
+            update={
+                "stories": len(self.queues),
+                "waiting": sum(queue.qsize() for queue in self.queues.values()),
+                "mean_wait_ms": (
+                    self.total_wait_ms / self.stats.commands
+                    if self.stats.commands
+                    else 0
+                ),
+            }
+        )
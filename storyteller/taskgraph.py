@@ -0,0 +1,71 @@
+from typing import Any
+from collections.abc import Awaitable, Callable, Sequence
+
+import asyncio
+
+
+class _Step:
+    def __init__(
+        self,
+        work: Callable[..., Awaitable[Any]],
+        after: Sequence[str],
+        progress: Callable[[], Awaitable[Any]] | None,
+    ):
+        self.work = work
+        self.after = after
+        self.progress = progress
+
+
+class TaskGraph:
+    """A handful of async steps, each of which can depend on the results
+    of steps added before it. Steps run as soon as their dependencies are
+    done, so independent steps run concurrently.
+
+    Each step can have a progress callback, run just before the step
+    starts. Progress callbacks never overlap, and steps that are ready at
+    the same time report in the order they were added."""
+
+    def __init__(self):
+        self.steps: dict[str, _Step] = {}
+
+    def add(
+        self,
+        name: str,
+        work: Callable[..., Awaitable[Any]],
+        after: Sequence[str] = (),
+        progress: Callable[[], Awaitable[Any]] | None = None,
+    ) -> None:
+        """Add a step. Its work is called with the results of the steps
+        named in after, in that order."""
+        for dependency in after:
+            if dependency not in self.steps:
+                raise ValueError(f"Step {name} depends on unknown step {dependency}")
+        self.steps[name] = _Step(work, after, progress)
+
+    async def run(self) -> dict[str, Any]:
+        """Run every step, returning their results by name. If a step fails,
+        the steps still running are cancelled and its error is raised."""
+        tasks: dict[str, asyncio.Task] = {}
+        # asyncio locks are fair, so progress is reported in the order the
+        # steps ask to report it.
+        report_lock = asyncio.Lock()
+
+        async def run_step(step: _Step) -> Any:
+            args = [await tasks[dependency] for dependency in step.after]
+            if step.progress is not None:
+                async with report_lock:
+                    await step.progress()
+            return await step.work(*args)
+
+        for name, step in self.steps.items():
+            tasks[name] = asyncio.create_task(run_step(step))
+
+        try:
+            results = await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        return dict(zip(tasks.keys(), results))
@@ -0,0 +1,71 @@
+from langchain_core.language_models.base import BaseLanguageModel
+from langchain_core.messages import BaseMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from collections.abc import Callable, Sequence
+
+Tokenizer = Callable[[BaseMessage], int]
+
+
+def approximate_tokens(message: BaseMessage) -> int:
+    return count_tokens_approximately([message])
+
+
+def model_tokenizer(model: BaseLanguageModel) -> Tokenizer:
+    """A tokenizer that uses the model's own token counting. For some
+    providers (e.g. OpenAI, with tiktoken installed) this is an exact,
+    local count; others fall back to a generic tokenizer."""
+
+    def count_tokens(message: BaseMessage) -> int:
+        return model.get_num_tokens_from_messages([message])
+
+    return count_tokens
+
+
+class TokenLedger:
+    """Per-message token counts for a list of messages, and their total.
+
+    sync() brings the ledger up to date with the current state of the list,
+    matching messages by identity so that only new messages are counted.
+    Appending, rewinding, replacing the last message and pruning from the
+    front all cost only the messages added or removed."""
+
+    def __init__(self, tokenizer: Tokenizer = approximate_tokens):
+        self.tokenizer = tokenizer
+        self.messages: list[BaseMessage] = []
+        self.counts: list[int] = []
+        self.positions: dict[int, int] = {}
+        self.total = 0
+
+    def sync(self, messages: Sequence[BaseMessage]) -> "TokenLedger":
+        # The messages still in the ledger are a run starting at the
+        # position of the first message, if it's there at all.
+        start = self.positions.get(id(messages[0])) if messages else None
+        if start is None or self.messages[start] is not messages[0]:
+            start = len(self.messages)
+
+        matched = 0
+        limit = min(len(messages), len(self.messages) - start)
+        while matched < limit and self.messages[start + matched] is messages[matched]:
+            matched += 1
+
+        if start == 0 and matched == len(self.messages) == len(messages):
+            return self
+
+        removed = sum(self.counts[:start]) + sum(self.counts[start + matched :])
+        added = [self.tokenizer(message) for message in messages[matched:]]
+
+        self.counts = self.counts[start : start + matched] + added
+        self.messages = list(messages)
+        self.positions = {id(message): idx for idx, message in enumerate(self.messages)}
+        self.total += sum(added) - removed
+        return self
+
+    def split_point(self, max_remaining: int) -> int:
+        """How many of the oldest messages to remove to bring the total
+        down to max_remaining tokens or fewer."""
+        remaining = self.total
+        split = 0
+        while remaining > max_remaining and split < len(self.counts):
+            remaining -= self.counts[split]
+            split += 1
+        return split
@@ -0,0 +1,108 @@
+"""Times snapshots of an event list against an EventStream as the number of
+events grows, with the current branch kept at a fixed depth and the rest of
+the events on abandoned branches, as they are after many retries and
+rewinds. Also times opening an EventStore of the events and taking a
+snapshot from it, and how much smaller the store is once the abandoned
+branches are pruned.
+
+Run with: python -m tests.bench_eventstream [--max-events 1000000]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from storyteller.eventstore import EventStore
+from storyteller.eventstream import (
+    ChatMessage,
+    Event,
+    EventStream,
+    MessageSource,
+    NoOp,
+    snapshot,
+)
+
+BRANCH_DEPTH = 1000
+ABANDONED_BRANCH_LENGTH = 100
+
+
+def create_events(count: int) -> list[Event]:
+    """count events: abandoned branches forking off the first event, then
+    the current branch."""
+    events: list[Event] = [NoOp.model_construct(id=0, parent=None, timestamp=0)]
+    depth = min(BRANCH_DEPTH, count - 1)
+
+    for event_id in range(1, count - depth):
+        fork = (event_id - 1) % ABANDONED_BRANCH_LENGTH == 0
+        events.append(
+            NoOp.model_construct(
+                id=event_id, parent=0 if fork else event_id - 1, timestamp=event_id
+            )
+        )
+
+    parent = 0
+    for event_id in range(count - depth, count):
+        events.append(
+            ChatMessage.model_construct(
+                id=event_id,
+                parent=parent,
+                timestamp=event_id,
+                source=MessageSource.Human,
+                content="...",
+            )
+        )
+        parent = event_id
+    return events
+
+
+def timed(fn, repeat: int) -> float:
+    """Mean time of a call to fn, in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-events", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    print(
+        f"{'events':>10} {'append µs':>10} {'list snapshot ms':>17} "
+        f"{'stream snapshot ms':>19} {'earlier event ms':>17} {'head ms':>8} "
+        f"{'store snapshot ms':>18} {'pruned size %':>14}"
+    )
+    count = 1000
+    while count <= args.max_events:
+        events = create_events(count)
+        start = time.perf_counter()
+        stream = EventStream(events)
+        append_us = (time.perf_counter() - start) * 1_000_000 / count
+
+        list_ms = timed(lambda: snapshot(events), 3)
+        stream_ms = timed(lambda: snapshot(stream), 20)
+        # Not the last event, so folded from a checkpoint.
+        earlier_ms = timed(lambda: snapshot(stream, count - 2), 20)
+        head_ms = timed(lambda: stream.head(count - BRANCH_DEPTH), 20)
+        assert snapshot(events) == snapshot(stream)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "story.events")
+            EventStore(path).extend(events)
+            store_ms = timed(lambda: EventStore(path).snapshot(), 5)
+            size = os.path.getsize(path)
+            EventStore(path).prune(retention_s=0)
+            pruned_percent = os.path.getsize(path) * 100 / size
+
+        print(
+            f"{count:>10} {append_us:>10.2f} {list_ms:>17.2f} "
+            f"{stream_ms:>19.2f} {earlier_ms:>17.2f} {head_ms:>8.3f} "
+            f"{store_ms:>18.2f} {pruned_percent:>14.1f}"
+        )
+        count *= 10
+
+
+if __name__ == "__main__":
+    main()
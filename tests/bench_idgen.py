@@ -0,0 +1,50 @@
+"""Times ID generation one ID at a time and in batches, from one thread
+and from several at once, and reports IDs per second.
+
+Run with: python -m tests.bench_idgen [--ids 1000000] [--threads 4]
+"""
+
+import argparse
+import threading
+import time
+
+from storyteller.idgen import IDGenerator
+
+BATCH_SIZES = [1, 16, 256, 4096]
+
+
+def ids_per_second(generator: IDGenerator, ids: int, batch: int, threads: int) -> float:
+    """Generate ids IDs, split between threads, batch at a time."""
+
+    def work() -> None:
+        if batch == 1:
+            for _ in range(ids // threads):
+                generator.generate()
+        else:
+            for _ in range(ids // threads // batch):
+                generator.generate_many(batch)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return ids / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ids", type=int, default=1_000_000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{'batch':>6} {'1 thread IDs/s':>15} {f'{args.threads} threads IDs/s':>16}")
+    for batch in BATCH_SIZES:
+        single = ids_per_second(IDGenerator(1), args.ids, batch, 1)
+        threaded = ids_per_second(IDGenerator(1), args.ids, batch, args.threads)
+        print(f"{batch:>6} {single:>15,.0f} {threaded:>16,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Fakes shared by several test modules."""
+
+from typing import cast
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+from storyteller.engine import Chains, Command, Response
+from storyteller.models import Chapter, Story
+
+# For summaries that never get as far as the chains, or that should fail
+# if they do.
+NO_CHAINS = cast(Chains, None)
+
+
+class RecordingResponse(Response):
+    def __init__(self, messages: list[str]):
+        self.messages = messages
+        self.streamed = ""
+
+    async def send_message(self, msg: str):
+        self.messages.append(msg)
+
+    async def start_stream(self):
+        self.streamed = ""
+
+    async def end_stream(self):
+        pass
+
+    async def append(self, msg: str):
+        self.streamed += msg
+
+
+class NamedChatModel(BaseChatModel):
+    model_name: str
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "named"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        message = AIMessage(self.model_name)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def with_structured_output(self, schema, **kwargs):
+        def output(prompt):
+            self.calls += 1
+            return Chapter(title=self.model_name, summary=prompt.to_string())
+
+        return RunnableLambda(output)
+
+
+class AppendCommand(Command):
+    def __init__(self, text: str):
+        self.text = text
+
+    async def run(self, story: Story) -> None:
+        story.current_messages.append(HumanMessage(self.text))
+        story.current_messages.append(AIMessage(f"Reply to {self.text}"))
@@ -0,0 +1,140 @@
+import pytest
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.messages.ai import UsageMetadata
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from storyteller.engine import make_chat_chain, run_chat, split_prompt
+from tests.fakes import RecordingResponse
+
+PROMPT = "Tell a story.\n\n{characters}\n\n{chapters}\n\n{scenes}\n"
+
+
+class CachingChatModel(BaseChatModel):
+    """A fake chat model that checks the prompt's cache markers, and reports
+    the marked prefix as read from its cache."""
+
+    received: list[list[BaseMessage]] = []
+    llm_type: str = "anthropic-chat"
+
+    @property
+    def _llm_type(self) -> str:
+        return self.llm_type
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.received.append(messages)
+        blocks = [
+            block
+            for message in messages
+            for block in (
+                message.content
+                if isinstance(message.content, list)
+                else [{"type": "text", "text": message.content}]
+            )
+        ]
+        assert all(block["text"] for block in blocks)
+        marked = [idx for idx, b in enumerate(blocks) if "cache_control" in b]
+        assert len(marked) <= 4
+        cached = sum(len(b["text"]) for b in blocks[: marked[-1] + 1]) if marked else 0
+        usage: UsageMetadata = {
+            "input_tokens": 100,
+            "output_tokens": 5,
+            "total_tokens": 105,
+            "input_token_details": {"cache_read": cached},
+        }
+        message = AIMessage("Once upon a time", usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class UsageResponse(RecordingResponse):
+    def __init__(self):
+        super().__init__([])
+        self.usage: list[UsageMetadata] = []
+
+    async def report_usage(self, usage: UsageMetadata):
+        self.usage.append(usage)
+
+
+CONTEXT = {"characters": "## Ann (Hero)", "chapters": "", "scenes": "## Chapter 1"}
+
+
+def test_split_prompt() -> None:
+    assert split_prompt(PROMPT) == [
+        ("Tell a story.\n\n{characters}", True),
+        ("\n\n{chapters}", True),
+        ("\n\n{scenes}\n", False),
+    ]
+    assert split_prompt("No {{placeholders}}") == [("No {{placeholders}}", True)]
+
+
+@pytest.mark.asyncio
+async def test_cache_markers_follow_the_stable_prefix() -> None:
+    model = CachingChatModel(received=[])
+    response = UsageResponse()
+
+    await run_chat(
+        make_chat_chain(model, PROMPT),
+        CONTEXT,
+        [HumanMessage("Hi")],
+        "Go on",
+        response,
+    )
+
+    system = model.received[0][0].content
+    assert [block["text"] for block in system] == [
+        "Tell a story.\n\n## Ann (Hero)\n\n",
+        "\n\n## Chapter 1\n",
+    ]
+    assert "cache_control" in system[0]
+    assert "cache_control" not in system[1]
+    # The stable prefix and the chat history are read from the cache.
+    assert response.usage[0]["input_token_details"]["cache_read"] == 30 + 15 + 2
+
+
+@pytest.mark.asyncio
+async def test_cache_markers_end_at_the_chat_history() -> None:
+    model = CachingChatModel(received=[])
+    response = UsageResponse()
+    history: list[BaseMessage] = [HumanMessage("Hi"), AIMessage("Hello")]
+
+    await run_chat(make_chat_chain(model, PROMPT), CONTEXT, history, "Go on", response)
+
+    assert model.received[0][2].content == [
+        {"type": "text", "text": "Hello", "cache_control": {"type": "ephemeral"}}
+    ]
+    assert model.received[0][3].content == "Go on"
+    # The story's messages are unchanged.
+    assert history[1].content == "Hello"
+    assert response.usage[0]["input_token_details"]["cache_read"] == 30 + 15 + 2 + 5
+
+
+@pytest.mark.asyncio
+async def test_blank_sections_are_not_sent_as_blocks() -> None:
+    model = CachingChatModel(received=[])
+    response = UsageResponse()
+    context = {"characters": "", "chapters": "", "scenes": "## Chapter 1"}
+
+    await run_chat(
+        make_chat_chain(model, "{characters}\n\n{chapters}\n\n{scenes}"),
+        context,
+        [],
+        "Go on",
+        response,
+    )
+
+    # The blank sections join the next block, which isn't cached.
+    assert model.received[0][0].content == [
+        {"type": "text", "text": "\n\n\n\n## Chapter 1"}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_no_cache_markers_for_other_providers() -> None:
+    model = CachingChatModel(received=[], llm_type="fake")
+    response = UsageResponse()
+
+    await run_chat(make_chat_chain(model, PROMPT), CONTEXT, [], "Go on", response)
+
+    system = model.received[0][0].content
+    assert system == "Tell a story.\n\n## Ann (Hero)\n\n\n\n## Chapter 1\n"
+    assert response.usage[0]["input_token_details"]["cache_read"] == 0
@@ -0,0 +1,188 @@
+import asyncio
+from typing import cast
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+
+from storyteller.commands import (
+    ChatCommand,
+    CloseChapterCommand,
+    RetryCommand,
+    RewindCommand,
+    SummarizeCommand,
+)
+from storyteller.engine import Chains
+from storyteller.models import Chapter, Character, Characters, Scene, Scenes, Story
+from tests.fakes import RecordingResponse
+
+
+class FakeChatChain:
+    def __init__(self):
+        self.calls = 0
+
+    async def astream(self, input: dict):
+        self.calls += 1
+        yield AIMessageChunk(content=f"Response {self.calls}")
+
+
+class FailingChatChain:
+    """Fails the first candidate, the one streamed, while the others are
+    still being generated."""
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = 0
+
+    async def astream(self, input: dict):
+        self.calls += 1
+        if self.calls == 1:
+            await asyncio.sleep(0.01)
+            raise RuntimeError("Model failed")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        yield AIMessageChunk(content="Too late")
+
+
+class FakeChain:
+    def __init__(
+        self, result, started: list[str], name: str, barrier: asyncio.Barrier | None
+    ):
+        self.result = result
+        self.started = started
+        self.name = name
+        self.barrier = barrier
+
+    async def ainvoke(self, input: dict):
+        self.started.append(self.name)
+        if self.barrier is not None:
+            # Only returns once both summary chains have been called.
+            await asyncio.wait_for(self.barrier.wait(), timeout=1)
+        return self.result
+
+
+class FakeChains:
+    def __init__(self):
+        self.started: list[str] = []
+        barrier = asyncio.Barrier(2)
+        self.summary_chain = FakeChain(
+            Scenes(scenes=[Scene(time_and_location="Noon", events="Lunch")]),
+            self.started,
+            "scenes",
+            barrier,
+        )
+        self.character_bio_chain = FakeChain(
+            Characters(characters=[Character(name="Ann", role="Hero", bio="Brave")]),
+            self.started,
+            "characters",
+            barrier,
+        )
+        self.chat_chain = FakeChatChain()
+        self.chapter_chain = FakeChain(
+            Chapter(title="The End", summary="Lunch happened"),
+            self.started,
+            "chapter",
+            None,
+        )
+
+
+def create_story() -> Story:
+    story = Story.new()
+    for idx in range(10):
+        story.current_messages.append(HumanMessage(f"User message {idx} " * 20))
+        story.current_messages.append(AIMessage(f"Bot message {idx} " * 20))
+    return story
+
+
+@pytest.mark.asyncio
+async def test_summarize_updates_scenes_and_characters_concurrently() -> None:
+    fake = FakeChains()
+    chains = cast(Chains, fake)
+    messages: list[str] = []
+    story = create_story()
+
+    await SummarizeCommand(chains, RecordingResponse(messages), 200, 500).run(story)
+
+    assert sorted(fake.started) == ["characters", "scenes"]
+    assert story.scenes[0].events == "Lunch"
+    assert story.characters[0].name == "Ann"
+    assert len(story.old_messages) + len(story.current_messages) == 20
+    assert "scene summaries" in messages[0]
+    assert "character bios" in messages[1]
+    assert messages[2].startswith("📖 Pruned")
+
+
+@pytest.mark.asyncio
+async def test_close_chapter_summarizes_scenes_before_the_chapter() -> None:
+    fake = FakeChains()
+    chains = cast(Chains, fake)
+    messages: list[str] = []
+    response = RecordingResponse(messages)
+    story = create_story()
+
+    await CloseChapterCommand(chains, response, response, "").run(story)
+
+    assert fake.started[-1] == "chapter"
+    assert story.current_messages == []
+    assert story.scenes == []
+    assert story.chapters[0].title == "The End"
+    assert messages[2].startswith("⏳ Closing chapter 1")
+    assert messages[-1] == "📖 Closed chapter 1: The End"
+
+
+@pytest.mark.asyncio
+async def test_retry_swaps_in_speculative_alternatives() -> None:
+    fake = FakeChains()
+    chains = cast(Chains, fake)
+    response = RecordingResponse([])
+    story = Story.new()
+
+    await ChatCommand(chains, response, "Hello", candidates=3).run(story)
+    assert response.streamed == "Response 1"
+    assert [m.content for m in story.alternatives] == ["Response 2", "Response 3"]
+
+    await RetryCommand(chains, response, candidates=3).run(story)
+    await RetryCommand(chains, response, candidates=3).run(story)
+    assert fake.chat_chain.calls == 3
+    assert response.streamed == "Response 3"
+    assert [m.content for m in story.current_messages] == ["Hello", "Response 3"]
+
+    # Out of alternatives: generate new candidates.
+    await RetryCommand(chains, response, candidates=3).run(story)
+    assert fake.chat_chain.calls == 6
+    assert story.current_messages[-1].content == "Response 4"
+    assert len(story.alternatives) == 2
+
+
+@pytest.mark.asyncio
+async def test_alternatives_are_discarded_when_the_story_moves_on() -> None:
+    fake = FakeChains()
+    chains = cast(Chains, fake)
+    response = RecordingResponse([])
+    story = Story.new()
+
+    await ChatCommand(chains, response, "Hello", candidates=2).run(story)
+    await ChatCommand(chains, response, "More").run(story)
+    assert story.alternatives == []
+
+    await ChatCommand(chains, response, "Again", candidates=2).run(story)
+    await RewindCommand(chains, response).run(story)
+    assert story.alternatives == []
+
+
+@pytest.mark.asyncio
+async def test_extra_candidates_are_stopped_when_the_streamed_one_fails() -> None:
+    fake = FakeChains()
+    fake.chat_chain = FailingChatChain()
+    chains = cast(Chains, fake)
+    story = Story.new()
+
+    with pytest.raises(RuntimeError, match="Model failed"):
+        await ChatCommand(chains, RecordingResponse([]), "Hello", candidates=3).run(
+            story
+        )
+
+    assert fake.chat_chain.cancelled == 2
+    assert story.current_messages == []
@@ -0,0 +1,298 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from storyteller.cache import FlushPolicy, StoryCache
+from storyteller.engine import (
+    Command,
+    FileStoryRepository,
+    StoryEngine,
+    StoryRepository,
+)
+from storyteller.looplag import LoopLagMonitor
+from storyteller.models import Story
+from storyteller.sqlite import SqliteStoryRepository
+from storyteller.storyqueue import StoryBusy, StoryQueues
+from tests.fakes import AppendCommand
+
+
+class FailingCommand(Command):
+    async def run(self, story: Story) -> None:
+        story.current_messages.append(HumanMessage("Half done"))
+        raise RuntimeError("Command failed")
+
+
+class CountingRepository(FileStoryRepository):
+    def __init__(self, repo_dir: str):
+        super().__init__(repo_dir)
+        self.loads = 0
+        self.saves = 0
+
+    def load(self, story_id: str) -> Story:
+        self.loads += 1
+        return super().load(story_id)
+
+    def save(self, story_id: str, story: Story) -> None:
+        self.saves += 1
+        super().save(story_id, story)
+
+
+def create_repository(tmp_path, *story_ids: str) -> CountingRepository:
+    repo = CountingRepository(str(tmp_path))
+    for story_id in story_ids:
+        repo.save(story_id, Story.new())
+    repo.saves = 0
+    return repo
+
+
+@pytest.mark.asyncio
+async def test_engine_without_cache_loads_and_saves_every_command(tmp_path) -> None:
+    repo = create_repository(tmp_path, "s1")
+    engine = StoryEngine(repo)
+
+    await engine.run_command("s1", AppendCommand("one"))
+    await engine.run_command("s1", AppendCommand("two"))
+
+    assert (repo.loads, repo.saves) == (2, 2)
+    assert len(repo.load("s1").current_messages) == 4
+
+
+@pytest.mark.asyncio
+async def test_cache_skips_reloading_stories(tmp_path) -> None:
+    repo = create_repository(tmp_path, "s1")
+    engine = StoryEngine(repo, StoryCache(1024 * 1024))
+
+    await engine.run_command("s1", AppendCommand("one"))
+    await engine.run_command("s1", AppendCommand("two"))
+
+    assert (repo.loads, repo.saves) == (1, 2)
+    stats = engine.cache_stats()
+    assert stats is not None
+    assert (stats.hits, stats.misses) == (1, 1)
+    assert len(repo.load("s1").current_messages) == 4
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["file", "journaled", "sqlite"])
+async def test_cached_stories_see_saves_from_other_engines(tmp_path, backend) -> None:
+    def create_repository() -> StoryRepository:
+        if backend == "sqlite":
+            return SqliteStoryRepository(str(tmp_path / "stories.db"))
+        return FileStoryRepository(str(tmp_path), journaled=backend == "journaled")
+
+    repo = create_repository()
+    repo.save("s1", Story.new())
+    # Separate queues, as if the engines were in different processes.
+    first_cache = StoryCache(1024 * 1024)
+    first = StoryEngine(repo, first_cache)
+    second = StoryEngine(create_repository(), StoryCache(1024 * 1024))
+
+    await first.run_command("s1", AppendCommand("a"))
+    await second.run_command("s1", AppendCommand("b"))
+    await first.run_command("s1", AppendCommand("c"))
+
+    story = await second.load("s1")
+    assert [message.content for message in story.current_messages[::2]] == [
+        "a",
+        "b",
+        "c",
+    ]
+    # The first engine reloaded the story after the second saved it.
+    assert first_cache.stats.misses == 2
+
+
+@pytest.mark.asyncio
+async def test_lazy_cache_writes_back_on_close(tmp_path) -> None:
+    repo = create_repository(tmp_path, "s1")
+    engine = StoryEngine(repo, StoryCache(1024 * 1024, FlushPolicy.OnEviction))
+
+    await engine.run_command("s1", AppendCommand("one"))
+    assert repo.saves == 0
+    assert len((await engine.load("s1")).current_messages) == 2
+
+    await engine.close()
+    assert repo.saves == 1
+    assert len(repo.load("s1").current_messages) == 2
+
+
+@pytest.mark.asyncio
+async def test_lazy_cache_writes_back_evicted_stories(tmp_path) -> None:
+    repo = create_repository(tmp_path, "s1", "s2")
+    engine = StoryEngine(repo, StoryCache(20, FlushPolicy.OnEviction))
+
+    await engine.run_command("s1", AppendCommand("one"))
+    await engine.run_command("s2", AppendCommand("two"))
+
+    stats = engine.cache_stats()
+    assert stats is not None and stats.evictions == 1
+    assert len(repo.load("s1").current_messages) == 2
+    assert engine.cache is not None
+    assert list(engine.cache.entries) == ["s2"]
+
+
+@pytest.mark.asyncio
+async def test_failed_command_leaves_cached_story_unchanged(tmp_path) -> None:
+    repo = create_repository(tmp_path, "s1")
+    engine = StoryEngine(repo, StoryCache(1024 * 1024, FlushPolicy.OnEviction))
+    await engine.run_command("s1", AppendCommand("one"))
+
+    with pytest.raises(RuntimeError):
+        await engine.run_command("s1", FailingCommand())
+
+    await engine.close()
+    assert len(repo.load("s1").current_messages) == 2
+
+
+@pytest.mark.asyncio
+async def test_run_commands_saves_once(tmp_path) -> None:
+    repo = create_repository(tmp_path, "s1")
+    engine = StoryEngine(repo)
+
+    await engine.run_commands("s1", [AppendCommand("one"), AppendCommand("two")])
+
+    assert (repo.loads, repo.saves) == (1, 1)
+    assert len(repo.load("s1").current_messages) == 4
+
+
+@pytest.mark.asyncio
+async def test_run_commands_commits_work_before_a_failure(tmp_path) -> None:
+    repo = create_repository(tmp_path, "s1")
+    engine = StoryEngine(repo)
+
+    with pytest.raises(RuntimeError):
+        await engine.run_commands(
+            "s1", [AppendCommand("one"), FailingCommand(), AppendCommand("two")]
+        )
+
+    assert [message.content for message in repo.load("s1").current_messages] == [
+        "one",
+        "Reply to one",
+    ]
+    repo.lock("s1")
+    repo.unlock("s1")
+
+
+class SlowRepository(FileStoryRepository):
+    def load(self, story_id: str) -> Story:
+        time.sleep(0.2)
+        return super().load(story_id)
+
+
+@pytest.mark.asyncio
+async def test_slow_repository_does_not_block_the_loop(tmp_path) -> None:
+    repo = SlowRepository(str(tmp_path))
+    repo.save("s1", Story.new())
+    engine = StoryEngine(repo)
+    monitor = LoopLagMonitor(interval_ms=10)
+    monitor.start()
+
+    await engine.run_command("s1", AppendCommand("one"))
+    await asyncio.sleep(0.02)
+    await monitor.stop()
+
+    stats = monitor.current_stats()
+    assert stats.samples >= 10
+    assert stats.max_ms < 100
+    assert len((await engine.load("s1")).current_messages) == 2
+
+
+class SlowSavingRepository(FileStoryRepository):
+    def __init__(self, repo_dir: str):
+        super().__init__(repo_dir)
+        self.saving = threading.Event()
+
+    def save(self, story_id: str, story: Story) -> None:
+        self.saving.set()
+        time.sleep(0.2)
+        super().save(story_id, story)
+
+
+@pytest.mark.asyncio
+async def test_commands_wait_for_evicted_stories_being_written_back(tmp_path) -> None:
+    repo = SlowSavingRepository(str(tmp_path))
+    for story_id in ["s1", "s2"]:
+        FileStoryRepository.save(repo, story_id, Story.new())
+    engine = StoryEngine(repo, StoryCache(20, FlushPolicy.OnEviction))
+    await engine.run_command("s1", AppendCommand("one"))
+
+    # Evicts s1, which is written back slowly.
+    other = asyncio.create_task(engine.run_command("s2", AppendCommand("two")))
+    await asyncio.to_thread(repo.saving.wait, 1)
+    await engine.run_command("s1", AppendCommand("three"))
+    await other
+
+    await engine.close()
+    assert len(repo.load("s1").current_messages) == 4
+
+
+@pytest.mark.asyncio
+async def test_commands_wait_for_interval_flushes(tmp_path) -> None:
+    repo = SlowSavingRepository(str(tmp_path))
+    FileStoryRepository.save(repo, "s1", Story.new())
+    cache = StoryCache(1024 * 1024, FlushPolicy.Interval, flush_interval_ms=50)
+    engine = StoryEngine(repo, cache)
+    await engine.run_command("s1", AppendCommand("one"))
+
+    await asyncio.to_thread(repo.saving.wait, 1)
+    await engine.run_command("s1", AppendCommand("two"))
+
+    await engine.close()
+    assert len(repo.load("s1").current_messages) == 4
+
+
+class GatedCommand(AppendCommand):
+    def __init__(self, text: str, gate: asyncio.Event):
+        super().__init__(text)
+        self.gate = gate
+
+    async def run(self, story: Story) -> None:
+        await self.gate.wait()
+        await super().run(story)
+
+
+@pytest.mark.asyncio
+async def test_commands_for_a_story_wait_their_turn(tmp_path) -> None:
+    repo = create_repository(tmp_path, "s1", "s2")
+    engine = StoryEngine(repo)
+    gate = asyncio.Event()
+
+    first = asyncio.create_task(engine.run_command("s1", GatedCommand("one", gate)))
+    second = asyncio.create_task(engine.run_command("s1", AppendCommand("two")))
+    await asyncio.sleep(0.01)
+    # Other stories aren't held up.
+    await engine.run_command("s2", AppendCommand("other"))
+    assert not first.done() and not second.done()
+
+    gate.set()
+    await asyncio.gather(first, second)
+
+    messages = [message.content for message in repo.load("s1").current_messages]
+    assert messages == ["one", "Reply to one", "two", "Reply to two"]
+    stats = engine.queue_stats()
+    assert (stats.commands, stats.max_depth, stats.stories) == (3, 2, 0)
+
+
+@pytest.mark.asyncio
+async def test_full_or_slow_queues_refuse_commands(tmp_path) -> None:
+    repo = create_repository(tmp_path, "s1")
+    engine = StoryEngine(repo, queues=StoryQueues(max_depth=1, timeout_s=0.05))
+    gate = asyncio.Event()
+
+    running = asyncio.create_task(engine.run_command("s1", GatedCommand("one", gate)))
+    await asyncio.sleep(0.01)
+    waiting = asyncio.create_task(engine.run_command("s1", AppendCommand("two")))
+    await asyncio.sleep(0.01)
+
+    with pytest.raises(StoryBusy):
+        await engine.run_command("s1", AppendCommand("three"))
+    with pytest.raises(StoryBusy):
+        await waiting
+
+    gate.set()
+    await running
+    assert len(repo.load("s1").current_messages) == 2
+    stats = engine.queue_stats()
+    assert (stats.rejected, stats.timed_out, stats.commands) == (1, 1, 1)
@@ -0,0 +1,272 @@
+import asyncio
+import os
+
+import pytest
+
+import storyteller.eventstore
+from storyteller.eventstore import (
+    EventStore,
+    EventStoreError,
+    append_with_retry,
+    read_archive,
+)
+from storyteller.eventstream import (
+    Annotation,
+    AnnotationType,
+    ChatMessage,
+    Event,
+    MessageSource,
+    NoOp,
+    StaleAppend,
+    TitleUpdate,
+    snapshot,
+)
+
+
+def create_events() -> list[Event]:
+    """A story where message 3 was rewound and replaced with message 5."""
+    return [
+        NoOp(id=1, parent=None, timestamp=1000, reason="Story creation"),
+        ChatMessage(
+            id=2,
+            parent=1,
+            timestamp=2000,
+            source=MessageSource.Human,
+            content="Hello, tell me a story 📖",
+        ),
+        ChatMessage(
+            id=3,
+            parent=2,
+            timestamp=3000,
+            source=MessageSource.Bot,
+            content="Once upon a time...",
+        ),
+        TitleUpdate(
+            id=4, parent=2, timestamp=4000, source=MessageSource.Bot, content="Tales"
+        ),
+        ChatMessage(
+            id=5,
+            parent=4,
+            timestamp=5000,
+            source=MessageSource.Bot,
+            content="In a land far away...",
+            annotation=Annotation(type=AnnotationType.Fixed, content="Less cliched"),
+        ),
+        NoOp(id=6, parent=5, timestamp=6000),
+    ]
+
+
+def create_store(path) -> EventStore:
+    store = EventStore(str(path))
+    for event in create_events():
+        store.append(event)
+    return store
+
+
+def test_events_round_trip(tmp_path) -> None:
+    events = create_events()
+    create_store(tmp_path / "story.events")
+
+    store = EventStore(str(tmp_path / "story.events"))
+    assert len(store) == 6
+    assert list(store.events()) == events
+    assert store.branch() == [events[0], events[1], events[3], events[4], events[5]]
+    assert store.branch(3) == events[0:3]
+    assert store.snapshot() == snapshot(events)
+    assert store.snapshot(3) == snapshot(events, 3)
+
+
+def test_only_the_branch_is_decoded(tmp_path, monkeypatch) -> None:
+    store = EventStore(str(tmp_path / "story.events"))
+    store.append(NoOp(id=0, parent=None, timestamp=0))
+    for event_id in range(1, 1000):
+        # Every event but the last hangs off the first.
+        parent = 0 if event_id < 999 else 500
+        store.append(NoOp(id=event_id, parent=parent, timestamp=event_id))
+
+    decoded = []
+    decode_event = storyteller.eventstore.decode_event
+
+    def counting_decode_event(payload):
+        decoded.append(1)
+        return decode_event(payload)
+
+    monkeypatch.setattr(storyteller.eventstore, "decode_event", counting_decode_event)
+
+    assert [event.id for event in store.branch()] == [0, 500, 999]
+    assert len(decoded) == 3
+
+
+def test_appends_are_checked(tmp_path) -> None:
+    store = create_store(tmp_path / "story.events")
+
+    with pytest.raises(ValueError, match="Parent event with ID 99 not found"):
+        store.append(NoOp(id=7, parent=99, timestamp=7000))
+    with pytest.raises(ValueError, match="Event with ID 3 is already in the stream"):
+        store.append(NoOp(id=3, parent=2, timestamp=7000))
+    with pytest.raises(ValueError, match="Parent event with ID 99 not found"):
+        store.branch(99)
+
+    # IDs don't have to increase.
+    store.append(NoOp(id=0, parent=6, timestamp=7000))
+    branch = EventStore(store.path).branch(0)
+    assert [event.id for event in branch] == [1, 2, 4, 5, 6, 0]
+
+
+def test_partial_appends_are_dropped(tmp_path) -> None:
+    path = tmp_path / "story.events"
+    create_store(path)
+    sizes = (os.path.getsize(path), os.path.getsize(f"{path}.idx"))
+    with open(path, "ab") as f:
+        f.write(b"\x10\x00\x00\x00half an event")
+    with open(f"{path}.idx", "ab") as f:
+        f.write(b"half a record")
+
+    store = EventStore(str(path))
+
+    assert (os.path.getsize(path), os.path.getsize(f"{path}.idx")) == sizes
+    store.append(NoOp(id=7, parent=6, timestamp=7000))
+    assert [event.id for event in EventStore(str(path)).branch()] == [1, 2, 4, 5, 6, 7]
+
+
+def test_other_files_and_versions_are_refused(tmp_path) -> None:
+    path = tmp_path / "story.events"
+    path.write_bytes(b'{"not": "events"}')
+    with pytest.raises(EventStoreError, match="not an event store file"):
+        EventStore(str(path))
+
+    path.unlink()
+    create_store(path)
+    with open(path, "r+b") as f:
+        f.seek(4)
+        f.write(b"\x02\x00")
+    with pytest.raises(EventStoreError, match="format version 2"):
+        EventStore(str(path))
+
+
+def test_appends_can_expect_a_head(tmp_path) -> None:
+    path = tmp_path / "story.events"
+    first = create_store(path)
+    second = EventStore(str(path))
+    assert first.head() == second.head() == 6
+
+    first.append(NoOp(id=7, parent=6, timestamp=7000), expected_head=6)
+    with pytest.raises(StaleAppend, match="Expected the stream to end at event 6"):
+        second.append(NoOp(id=8, parent=6, timestamp=8000), expected_head=6)
+
+    second.append(NoOp(id=8, parent=7, timestamp=8000), expected_head=7)
+    assert [event.id for event in first.branch()] == [1, 2, 4, 5, 6, 7, 8]
+    assert EventStore(str(tmp_path / "empty.events")).head() is None
+
+
+@pytest.mark.asyncio
+async def test_append_with_retry_rebuilds_stale_appends(tmp_path) -> None:
+    path = tmp_path / "story.events"
+    store = create_store(path)
+    other = EventStore(str(path))
+    heads = []
+
+    async def build(stream):
+        last = stream.last()
+        heads.append(last.id)
+        if len(heads) == 1:
+            # Someone else appends while the first attempt is being built.
+            await asyncio.to_thread(other.append, NoOp(id=7, parent=6, timestamp=7000))
+        return [NoOp(id=10 + len(heads), parent=last.id, timestamp=8000)]
+
+    events = await append_with_retry(store, build, retry_ms=1)
+
+    assert heads == [6, 7]
+    assert [event.id for event in events] == [12]
+    assert [event.id for event in store.branch()] == [1, 2, 4, 5, 6, 7, 12]
+
+
+@pytest.mark.asyncio
+async def test_append_with_retry_gives_up(tmp_path) -> None:
+    path = tmp_path / "story.events"
+    store = create_store(path)
+    other = EventStore(str(path))
+
+    async def build(stream):
+        last = stream.last()
+        other.append(NoOp(id=last.id + 100, parent=last.id, timestamp=7000))
+        return [NoOp(id=last.id + 1000, parent=last.id, timestamp=8000)]
+
+    with pytest.raises(StaleAppend):
+        await append_with_retry(store, build, attempts=3, retry_ms=1)
+    assert len(store) == 9
+
+
+def test_prune_archives_abandoned_branches(tmp_path) -> None:
+    path = tmp_path / "story.events"
+    events = create_events()
+    store = create_store(path)
+    store.append(NoOp(id=7, parent=5, timestamp=7000))
+    store.append(NoOp(id=8, parent=1, timestamp=8000))
+    # Opened before the prune, and has learned the old positions.
+    reader = EventStore(str(path))
+    assert reader.snapshot(6) == snapshot(events, 6)
+    size = os.path.getsize(path)
+
+    # Branches ending at 3 and 6 are older than the cutoff, 7 isn't.
+    assert store.prune(retention_s=1000, now=7500) == 2
+    assert store.prune(retention_s=1000, now=7500) == 0
+
+    assert os.path.getsize(path) < size
+    assert [event.id for event in store.events()] == [1, 2, 4, 5, 7, 8]
+    assert [event.id for event in reader.branch(7)] == [1, 2, 4, 5, 7]
+    assert [event.id for event in reader.branch()] == [1, 8]
+    with pytest.raises(ValueError, match="Parent event with ID 6 not found"):
+        reader.branch(6)
+    assert list(read_archive(store.path)) == [events[2], events[5]]
+
+    reader.append(NoOp(id=9, parent=7, timestamp=9000), expected_head=8)
+    assert store.prune(retention_s=0, now=10_000) == 1
+    assert [event.id for event in store.events()] == [1, 2, 4, 5, 7, 9]
+    assert [event.id for event in read_archive(store.path)] == [3, 6, 8]
+
+
+def test_positions_learned_before_a_prune_elsewhere_are_forgotten(tmp_path) -> None:
+    path = tmp_path / "story.events"
+    store = create_store(path)
+    store.append(NoOp(id=7, parent=5, timestamp=7000))
+    store.append(NoOp(id=8, parent=1, timestamp=8000))
+    reader = EventStore(str(path))
+    for event_id in [4, 7]:
+        reader.branch(event_id)
+
+    # Pruned by another store, after the reader learned where 4 and 7 were.
+    assert store.prune(retention_s=1000, now=7500) == 2
+
+    assert [event.id for event in reader.branch(4)] == [1, 2, 4]
+    assert [event.id for event in reader.branch(7)] == [1, 2, 4, 5, 7]
+    assert [event.id for event in reader.branch()] == [1, 8]
+
+
+def test_interrupted_prunes_are_recovered(tmp_path, monkeypatch) -> None:
+    path = tmp_path / "story.events"
+    create_store(path).close()
+
+    # Interrupted before the data file was replaced: the old files stand.
+    for suffix in [".compact", ".idx.compact"]:
+        (tmp_path / f"story.events{suffix}").write_bytes(b"half written")
+    assert [event.id for event in EventStore(str(path)).branch()] == [1, 2, 4, 5, 6]
+    assert not (tmp_path / "story.events.compact").exists()
+    assert not (tmp_path / "story.events.idx.compact").exists()
+
+    # Interrupted between replacing the data file and the index.
+    replace = os.replace
+
+    def replace_data_only(source, destination):
+        if source.endswith(".idx.compact"):
+            raise OSError("Crashed")
+        replace(source, destination)
+
+    monkeypatch.setattr(os, "replace", replace_data_only)
+    with pytest.raises(OSError, match="Crashed"):
+        EventStore(str(path)).prune(retention_s=0, now=10_000)
+    monkeypatch.setattr(os, "replace", replace)
+
+    store = EventStore(str(path))
+    assert [event.id for event in store.events()] == [1, 2, 4, 5, 6]
+    assert store.snapshot() == snapshot(create_events())
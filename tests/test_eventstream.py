@@ -2,7 +2,7 @@ import pytest
 from storyteller.eventstream import *
 
 
-def create_default_chat_messages() -> list[ChatMessage]:
+def create_default_chat_messages() -> list[Event]:
     """Create a default chain of 3 connected chat messages for testing."""
     return [
         ChatMessage(
@@ -30,7 +30,7 @@ def create_default_chat_messages() -> list[ChatMessage]:
 
 
 def test_snapshot_empty_eventstream() -> None:
-    empty_stream: EventStream = []
+    empty_stream: list[Event] = []
     result = snapshot(empty_stream)
     expected = new_snapshot()
 
@@ -45,7 +45,7 @@ def test_snapshot_with_chat_messages() -> None:
     messages[1].timestamp = 2
     messages[2].timestamp = 3
 
-    event_stream: EventStream = messages
+    event_stream: list[Event] = messages
     result = snapshot(event_stream)
 
     assert len(result.chat_messages) == 3
@@ -61,7 +61,7 @@ def test_snapshot_with_start_value() -> None:
     messages[1].timestamp = 2
     messages[2].timestamp = 3
 
-    event_stream: EventStream = messages
+    event_stream: list[Event] = messages
     result = snapshot(event_stream, start_id=2)
 
     assert len(result.chat_messages) == 2
@@ -77,7 +77,7 @@ def test_snapshot_follows_parent_chain() -> None:
     for msg in messages:
         msg.timestamp = 2
 
-    event_stream: EventStream = messages
+    event_stream: list[Event] = messages
     result = snapshot(event_stream)
 
     assert len(result.chat_messages) == 2
@@ -89,7 +89,7 @@ def test_snapshot_sets_first_and_last_event_timestamps() -> None:
     messages = create_default_chat_messages()
     # timestamps are already 1000, 2000, 3000 from the helper function
 
-    event_stream: EventStream = messages
+    event_stream: list[Event] = messages
     result = snapshot(event_stream)
 
     assert result.first_event.timestamp() == 1000.0  # messages[0] timestamp
@@ -97,7 +97,7 @@ def test_snapshot_sets_first_and_last_event_timestamps() -> None:
 
 
 def test_snapshot_empty_stream_sets_some_default_time() -> None:
-    empty_stream: EventStream = []
+    empty_stream: list[Event] = []
     result = snapshot(empty_stream)
 
     # Should have same time for both first and last event in empty stream
@@ -108,7 +108,7 @@ def test_snapshot_with_start_id_sets_correct_timestamps() -> None:
     messages = create_default_chat_messages()
     # timestamps are already 1000, 2000, 3000 from the helper function
 
-    event_stream: EventStream = messages
+    event_stream: list[Event] = messages
     result = snapshot(event_stream, start_id=2)
 
     # Should only include messages[0] and messages[1]
@@ -120,7 +120,7 @@ def test_snapshot_with_noop_events_sets_correct_timestamps() -> None:
     noop1 = NoOp(id=1, parent=None, timestamp=1500, reason="Story creation")
     noop2 = NoOp(id=2, parent=1, timestamp=2500, reason="Story updated")
 
-    event_stream: EventStream = [noop1, noop2]
+    event_stream: list[Event] = [noop1, noop2]
     result = snapshot(event_stream)
 
     # Should set timestamps from the NoOp events even though no chat messages
@@ -133,7 +133,7 @@ def test_snapshot_fails_with_missing_parent() -> None:
     messages = create_default_chat_messages()
     messages[1].parent = 99
 
-    event_stream: EventStream = messages
+    event_stream: list[Event] = messages
 
     # Should raise an exception when trying to follow parent chain to non-existent parent
     with pytest.raises(ValueError, match="Parent event with ID 99 not found in stream"):
@@ -142,8 +142,131 @@ def test_snapshot_fails_with_missing_parent() -> None:
 def test_snapshot_fails_with_missing_start_event() -> None:
     messages = create_default_chat_messages()
 
-    event_stream: EventStream = messages
+    event_stream: list[Event] = messages
 
     # Should raise an exception when trying to follow parent chain to non-existent parent
     with pytest.raises(ValueError, match="Parent event with ID 99 not found in stream"):
         snapshot(event_stream, start_id=99)
+
+
+def create_branching_stream() -> EventStream:
+    """1 -> 2 -> 3, with 3 retried as 4, and 2 rewound to 5 -> 6."""
+    messages = create_default_chat_messages()
+    stream = EventStream(messages)
+    stream.append(
+        ChatMessage(
+            id=4, parent=2, timestamp=4000, source=MessageSource.Human, content="Go on"
+        )
+    )
+    stream.append(
+        ChatMessage(
+            id=5, parent=1, timestamp=5000, source=MessageSource.Bot, content="Once..."
+        )
+    )
+    stream.append(NoOp(id=6, parent=5, timestamp=6000))
+    return stream
+
+
+def test_eventstream_snapshot_matches_list_snapshot() -> None:
+    messages = create_default_chat_messages()
+    stream = EventStream(messages)
+
+    for start_id in [None, 1, 2, 3]:
+        assert snapshot(stream, start_id) == snapshot(messages, start_id)
+    assert snapshot(EventStream()).chat_messages == []
+
+
+def test_eventstream_snapshot_follows_one_branch() -> None:
+    stream = create_branching_stream()
+
+    result = snapshot(stream)
+    assert [message.id for message in result.chat_messages] == [1, 5]
+    assert result.first_event.timestamp() == 1000.0
+    assert result.last_event.timestamp() == 6000.0
+
+    result = snapshot(stream, start_id=4)
+    assert [message.id for message in result.chat_messages] == [1, 2, 4]
+
+
+def test_eventstream_branch_queries() -> None:
+    stream = create_branching_stream()
+
+    assert [event.id for event in stream.children(2)] == [3, 4]
+    assert [event.id for event in stream.leaves()] == [3, 4, 6]
+    assert stream.head(1).id == 6
+    assert stream.head(2).id == 4
+    assert [event.id for event in stream.ancestors(4)] == [4, 2, 1]
+    assert len(stream) == 6 and 5 in stream
+
+
+def test_eventstream_rejects_bad_appends() -> None:
+    stream = EventStream(create_default_chat_messages())
+
+    with pytest.raises(ValueError, match="Parent event with ID 99 not found"):
+        stream.append(NoOp(id=4, parent=99, timestamp=4000))
+    with pytest.raises(ValueError, match="Event with ID 3 is already in the stream"):
+        stream.append(NoOp(id=3, parent=2, timestamp=4000))
+    with pytest.raises(ValueError, match="Parent event with ID 99 not found"):
+        snapshot(stream, start_id=99)
+    assert len(stream) == 3
+
+
+def test_eventstream_appends_can_expect_a_head() -> None:
+    stream = EventStream()
+    stream.append(NoOp(id=1, parent=None, timestamp=1000), expected_head=None)
+    stream.append(NoOp(id=2, parent=1, timestamp=2000), expected_head=1)
+
+    with pytest.raises(StaleAppend, match="Expected the stream to end at event 1"):
+        stream.append(NoOp(id=3, parent=1, timestamp=3000), expected_head=1)
+    with pytest.raises(StaleAppend):
+        stream.append(NoOp(id=3, parent=2, timestamp=3000), expected_head=None)
+    assert len(stream) == 2
+    last = stream.last()
+    assert last is not None and last.id == 2
+
+
+def test_eventstream_checkpoints_match_full_replay() -> None:
+    events: list[Event] = []
+    for event_id in range(1, 41):
+        # Fork a new branch off an earlier event every 7 events.
+        parent = event_id - 1 if event_id % 7 else event_id // 2
+        if event_id % 3:
+            events.append(
+                ChatMessage(
+                    id=event_id,
+                    parent=parent or None,
+                    timestamp=event_id,
+                    source=MessageSource.Human,
+                    content=f"Message {event_id}",
+                )
+            )
+        else:
+            events.append(NoOp(id=event_id, parent=parent, timestamp=event_id))
+
+    stream = EventStream(events, checkpoint_interval=4)
+
+    assert all(stream.depths[event_id] % 4 == 0 for event_id in stream.checkpoints)
+    for event in events:
+        assert snapshot(stream, event.id) == snapshot(events, event.id)
+
+
+class CountingLookups(dict):
+    lookups = 0
+
+    def get(self, key, default=None):
+        self.lookups += 1
+        return super().get(key, default)
+
+
+def test_eventstream_snapshot_folds_from_nearest_checkpoint() -> None:
+    stream = EventStream(checkpoint_interval=10)
+    for event_id in range(1, 1001):
+        stream.append(
+            NoOp(id=event_id, parent=event_id - 1 or None, timestamp=event_id)
+        )
+    stream.by_id = CountingLookups(stream.by_id)
+
+    assert snapshot(stream).last_event.timestamp() == 1000.0
+    assert stream.by_id.lookups == 0
+    assert snapshot(stream, 999).first_event.timestamp() == 1.0
+    assert stream.by_id.lookups <= 10
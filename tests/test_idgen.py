@@ -0,0 +1,112 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from storyteller import idgen, locking
+from storyteller.idgen import IDGenerator, lease_server_id, release_server_id
+
+HOLD_LEASE = """
+import sys
+from storyteller.idgen import lease_server_id
+print(lease_server_id(sys.argv[1]), flush=True)
+sys.stdin.read()
+"""
+
+
+class FakeClock:
+    """Milliseconds that only move when something sleeps."""
+
+    def __init__(self, now: int):
+        self.now = now
+        self.sleeps = 0
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps += 1
+        self.now += 1
+
+    def time(self) -> float:
+        return self.now / 1000
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock(1_800_000_000_000)
+    monkeypatch.setattr(idgen.time, "time", clock.time)
+    monkeypatch.setattr(idgen.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_generate_many_matches_generate(clock) -> None:
+    one_by_one = IDGenerator(5)
+    batched = IDGenerator(5)
+
+    expected = [one_by_one.generate() for _ in range(10_000)]
+    clock.sleeps = 0
+    clock.now = 1_800_000_000_000
+    ids = batched.generate_many(9_000) + batched.generate_many(1_000)
+
+    assert ids == expected
+    assert len(set(ids)) == 10_000
+    # Two full milliseconds of counters, waited out by sleeping.
+    assert clock.sleeps == 2
+    assert (ids[-1] >> batched.server_id_shift) & 1023 == 5
+
+
+def test_clock_moving_backwards_is_refused(clock) -> None:
+    generator = IDGenerator(1)
+    generator.generate()
+    clock.now -= 5
+    with pytest.raises(RuntimeError, match="Clock moved backwards"):
+        generator.generate_many(3)
+
+
+def test_server_ids_are_leased_once(tmp_path) -> None:
+    lease_dir = str(tmp_path)
+    first = lease_server_id(lease_dir)
+    second = lease_server_id(lease_dir)
+    assert (first, second) == (1, 2)
+
+    release_server_id(first, lease_dir)
+    assert lease_server_id(lease_dir) == 1
+
+
+@pytest.mark.skipif(locking.fcntl is None, reason="needs file locks")
+def test_server_id_leases_are_seen_by_other_processes(tmp_path) -> None:
+    holder = subprocess.Popen(
+        [sys.executable, "-c", HOLD_LEASE, str(tmp_path)],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert holder.stdout is not None
+        assert holder.stdout.readline() == "1\n"
+        assert lease_server_id(str(tmp_path)) == 2
+    finally:
+        holder.kill()
+        holder.wait()
+
+    # The holder's lease ended with it.
+    assert lease_server_id(str(tmp_path)) == 1
+
+
+@pytest.mark.skipif(
+    locking.fcntl is None or not hasattr(os, "fork"), reason="needs file locks"
+)
+def test_forked_children_lease_their_own_server_id(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv("STORY_ID_LEASE_DIR", str(tmp_path))
+    monkeypatch.setattr(idgen, "_default_generator", None)
+    assert idgen.default_generator().server_id == 1
+
+    pid = os.fork()
+    if pid == 0:
+        os._exit(idgen.default_generator().server_id)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 2
+
+    # The child's lease ended with it, and the parent's is still held.
+    assert lease_server_id(str(tmp_path)) == 2
+    release_server_id(1, str(tmp_path))
+    release_server_id(2, str(tmp_path))
@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from storyteller import locking
+from storyteller.engine import FileStoryRepository, StoryLocked
+from storyteller.models import Story
+
+HOLD_LOCK = """
+import fcntl, os, sys
+fd = os.open(sys.argv[1], os.O_RDWR | os.O_CREAT)
+fcntl.flock(fd, fcntl.LOCK_EX)
+print("locked", flush=True)
+sys.stdin.read()
+"""
+
+
+@pytest.mark.skipif(locking.fcntl is None, reason="needs file locks")
+def test_story_locks_are_seen_by_other_processes(tmp_path) -> None:
+    repo = FileStoryRepository(str(tmp_path))
+    repo.save("s1", Story.new())
+    holder = subprocess.Popen(
+        [sys.executable, "-c", HOLD_LOCK, str(tmp_path / "story-s1.lock")],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert holder.stdout is not None
+        assert holder.stdout.readline() == "locked\n"
+        with pytest.raises(StoryLocked):
+            repo.lock("s1")
+    finally:
+        # Killing the holder stands in for a crashed worker.
+        holder.kill()
+        holder.wait()
+
+    repo.lock("s1")
+    assert locking.is_locked(str(tmp_path / "story-s1.lock"))
+    repo.unlock("s1")
+    assert not locking.is_locked(str(tmp_path / "story-s1.lock"))
+
+
+def test_story_locks_are_held_within_the_process(tmp_path) -> None:
+    repo = FileStoryRepository(str(tmp_path))
+    other = FileStoryRepository(str(tmp_path))
+    repo.lock("s1")
+    with pytest.raises(StoryLocked):
+        other.lock("s1")
+    other.lock("s2")
+
+    repo.unlock("s1")
+    other.lock("s1")
+    other.unlock("s1")
+    other.unlock("s2")
+
+
+@pytest.mark.skipif(
+    locking.fcntl is None or not hasattr(os, "fork"), reason="needs file locks"
+)
+def test_forked_children_forget_their_parents_locks(tmp_path) -> None:
+    import fcntl
+
+    path = str(tmp_path / "story-s1.lock")
+    assert locking.try_lock(path)
+
+    pid = os.fork()
+    if pid == 0:
+        # The child neither holds the lock nor can take it from the parent.
+        os._exit(int(locking.is_locked(path) or locking.try_lock(path)))
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+    # Still held by the parent after the child has gone.
+    assert locking.is_locked(path)
+    fd = os.open(path, os.O_RDWR)
+    try:
+        with pytest.raises(BlockingIOError):
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    finally:
+        os.close(fd)
+    locking.unlock(path)
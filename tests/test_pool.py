@@ -0,0 +1,83 @@
+import asyncio
+import threading
+
+import pytest
+
+from storyteller.cache import FlushPolicy, StoryCache
+from storyteller.engine import FileStoryRepository, StoryEngine
+from storyteller.models import Story
+from storyteller.pool import EnginePool
+from storyteller.sqlite import SqliteStoryRepository
+from tests.fakes import AppendCommand
+
+
+@pytest.mark.asyncio
+async def test_engines_are_reused_until_evicted(tmp_path) -> None:
+    created = []
+
+    def create(user_id: str) -> StoryEngine:
+        created.append(user_id)
+        return StoryEngine(FileStoryRepository(str(tmp_path / user_id)))
+
+    pool = EnginePool(create, max_engines=2)
+    alice = await pool.get("alice")
+    assert await pool.get("alice") is alice
+    await pool.get("bob")
+    await pool.get("alice")
+    await pool.get("carol")
+
+    # Bob was least recently used.
+    await pool.get("bob")
+    assert created == ["alice", "bob", "carol", "bob"]
+    stats = pool.current_stats()
+    assert (stats.hits, stats.misses, stats.evictions, stats.engines) == (2, 4, 2, 2)
+
+
+@pytest.mark.asyncio
+async def test_engines_are_created_once_off_the_event_loop(tmp_path) -> None:
+    threads = []
+
+    def create(user_id: str) -> StoryEngine:
+        threads.append(threading.get_ident())
+        return StoryEngine(FileStoryRepository(str(tmp_path / user_id)))
+
+    pool = EnginePool(create)
+    alice, again = await asyncio.gather(pool.get("alice"), pool.get("alice"))
+
+    assert again is alice
+    assert len(threads) == 1 and threads[0] != threading.get_ident()
+    stats = pool.current_stats()
+    assert (stats.hits, stats.misses, stats.engines) == (1, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_evicted_engines_write_back_their_cache(tmp_path) -> None:
+    repo = FileStoryRepository(str(tmp_path))
+    repo.save("s1", Story.new())
+
+    def create(user_id: str) -> StoryEngine:
+        return StoryEngine(repo, StoryCache(1024 * 1024, FlushPolicy.OnEviction))
+
+    pool = EnginePool(create, max_engines=1)
+    engine = await pool.get("alice")
+    await engine.run_command("s1", AppendCommand("one"))
+    assert repo.load("s1").current_messages == []
+
+    await pool.get("bob")
+    assert len(repo.load("s1").current_messages) == 2
+
+
+@pytest.mark.asyncio
+async def test_evicted_engines_close_their_repository(tmp_path) -> None:
+    repos = {}
+
+    def create(user_id: str) -> StoryEngine:
+        repos[user_id] = SqliteStoryRepository(str(tmp_path / f"{user_id}.db"))
+        return StoryEngine(repos[user_id])
+
+    pool = EnginePool(create, max_engines=1)
+    await pool.get("alice")
+    assert repos["alice"].connections != []
+
+    await pool.get("bob")
+    assert repos["alice"].connections == []
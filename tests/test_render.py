@@ -0,0 +1,59 @@
+from storyteller.models import Chapter, Character, Scene, Story
+from storyteller.render import StoryContext, story_context
+
+
+def create_story() -> Story:
+    story = Story.new()
+    story.characters = [Character(name="Ann", role="Hero", bio="Likes lunch")]
+    story.chapters = [
+        Chapter(title=f"Chapter {idx}", summary=f"Things happened {idx}")
+        for idx in range(20)
+    ]
+    story.scenes = [Scene(time_and_location="Noon, the park", events="Lunch")]
+    return story
+
+
+def test_render_sections() -> None:
+    story = create_story()
+    rendered = StoryContext().render(story)
+
+    assert rendered["characters"] == "## Ann (Hero)\nLikes lunch"
+    assert rendered["chapters"].startswith(
+        "## Chapter 1: Chapter 0\n Things happened 0\n\n"
+    )
+    assert rendered["scenes"] == "## Chapter 21\n\n ### Noon, the park\nLunch\n\n"
+
+
+def test_only_changed_sections_are_rendered() -> None:
+    story = create_story()
+    context = StoryContext()
+    context.render(story)
+    tokens = context.tokens()
+    assert context.renders == 3
+
+    context.render(story)
+    assert context.renders == 3
+
+    story.scenes.append(Scene(time_and_location="Evening", events="Dinner"))
+    rendered = context.render(story)
+    assert context.renders == 4
+    assert "Dinner" in rendered["scenes"]
+    assert context.tokens()["scenes"] > tokens["scenes"]
+    assert context.tokens()["chapters"] == tokens["chapters"]
+
+    story.characters[0].bio = "Likes dinner"
+    assert "Likes dinner" in context.render(story)["characters"]
+    assert context.renders == 5
+
+
+def test_closing_a_chapter_renders_scenes_again() -> None:
+    story = create_story()
+    context = story_context(story)
+    context.render(story)
+
+    story.chapters.append(Chapter(title="More", summary="Even more"))
+    story.scenes = []
+    rendered = context.render(story)
+
+    assert rendered["scenes"] == "## Chapter 22\n\n "
+    assert story_context(story) is context
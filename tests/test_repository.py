@@ -0,0 +1,244 @@
+import json
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from storyteller.engine import FileStoryRepository
+from storyteller.models import Scene, Story
+from storyteller.sqlite import SqliteStoryRepository, import_file_repository
+
+
+def create_story(message_count: int = 4) -> Story:
+    story = Story.new()
+    for idx in range(message_count // 2):
+        story.current_messages.append(HumanMessage(f"User message {idx}"))
+        story.current_messages.append(AIMessage(f"Bot message {idx}"))
+    return story
+
+
+def test_journaled_save_appends_delta(tmp_path) -> None:
+    repo = FileStoryRepository(str(tmp_path), journaled=True)
+    story = create_story()
+    repo.save("s1", story)
+    snapshot_size = os.path.getsize(tmp_path / "story-s1.json")
+
+    story.current_messages.append(HumanMessage("Another message"))
+    story.scenes = [Scene(time_and_location="Dawn, the inn", events="Breakfast")]
+    repo.save("s1", story)
+
+    assert os.path.getsize(tmp_path / "story-s1.json") == snapshot_size
+    assert (tmp_path / "story-s1.journal").read_text().count("\n") == 1
+
+    loaded = FileStoryRepository(str(tmp_path)).load("s1")
+    assert loaded == story
+
+
+def test_journaled_save_handles_rewind_and_replace(tmp_path) -> None:
+    repo = FileStoryRepository(str(tmp_path), journaled=True)
+    story = create_story(6)
+    repo.save("s1", story)
+
+    story.current_messages = story.current_messages[0:-2]
+    repo.save("s1", story)
+    story.current_messages[-1] = AIMessage("Replaced")
+    repo.save("s1", story)
+
+    assert repo.load("s1") == story
+
+
+def test_unchanged_story_writes_no_journal_record(tmp_path) -> None:
+    repo = FileStoryRepository(str(tmp_path), journaled=True)
+    story = create_story()
+    repo.save("s1", story)
+    repo.save("s1", story)
+
+    assert not (tmp_path / "story-s1.journal").exists()
+
+
+def test_torn_journal_record_is_ignored_and_overwritten(tmp_path) -> None:
+    repo = FileStoryRepository(str(tmp_path), journaled=True)
+    story = create_story()
+    repo.save("s1", story)
+    story.current_messages.append(HumanMessage("Saved"))
+    repo.save("s1", story)
+
+    with open(tmp_path / "story-s1.journal", "a") as f:
+        f.write('{"seq": 2, "title": "Tor')
+
+    assert FileStoryRepository(str(tmp_path)).load("s1") == story
+
+    story.title = "Intact"
+    repo.save("s1", story)
+    assert FileStoryRepository(str(tmp_path)).load("s1") == story
+
+
+def test_compaction_folds_journal_into_snapshot(tmp_path) -> None:
+    repo = FileStoryRepository(str(tmp_path), journaled=True)
+    story = create_story()
+    repo.save("s1", story)
+    for idx in range(3):
+        story.current_messages.append(HumanMessage(f"Extra {idx}"))
+        repo.save("s1", story)
+
+    repo.compact("s1")
+
+    assert not (tmp_path / "story-s1.journal").exists()
+    assert FileStoryRepository(str(tmp_path)).load("s1") == story
+
+    story.current_messages.append(HumanMessage("After compaction"))
+    repo.save("s1", story)
+    assert FileStoryRepository(str(tmp_path)).load("s1") == story
+
+
+def test_unjournaled_save_replaces_journal(tmp_path) -> None:
+    story = create_story()
+    FileStoryRepository(str(tmp_path), journaled=True).save("s1", story)
+    story.title = "Renamed"
+    FileStoryRepository(str(tmp_path), journaled=True).save("s1", story)
+
+    story.title = "Renamed again"
+    FileStoryRepository(str(tmp_path)).save("s1", story)
+
+    assert not (tmp_path / "story-s1.journal").exists()
+    assert FileStoryRepository(str(tmp_path), journaled=True).load("s1") == story
+
+
+def test_sqlite_round_trip(tmp_path) -> None:
+    repo = SqliteStoryRepository(str(tmp_path / "stories.db"))
+    story = create_story()
+    story.scenes = [Scene(time_and_location="Dusk, the road", events="Travel")]
+    story.old_messages = [HumanMessage("Long ago")]
+    repo.save("s1", story)
+
+    story.old_messages.append(AIMessage("Pruned"))
+    story.current_messages = story.current_messages[2:]
+    story.alternatives = [AIMessage("Another way")]
+    repo.save("s1", story)
+
+    assert repo.story_exists("s1")
+    assert not repo.story_exists("s2")
+    assert repo.load("s1") == story
+    assert [item.id for item in repo.list()] == ["s1"]
+
+
+def test_sqlite_close_closes_every_threads_connection(tmp_path) -> None:
+    repo = SqliteStoryRepository(str(tmp_path / "stories.db"))
+    repo.save("s1", create_story())
+    worker = threading.Thread(target=repo.load, args=["s1"])
+    worker.start()
+    worker.join()
+    connections = list(repo.connections)
+    assert len(connections) == 2
+
+    repo.close()
+
+    for conn in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+    # Used again, the repository opens a new connection.
+    assert repo.load("s1") == create_story()
+    assert len(repo.connections) == 1
+
+
+def test_index_lists_recent_stories_first(tmp_path) -> None:
+    for repo in [
+        FileStoryRepository(str(tmp_path)),
+        SqliteStoryRepository(str(tmp_path / "stories.db")),
+    ]:
+        for story_id in ["s1", "s2", "s3"]:
+            repo.save(story_id, create_story())
+        repo.save("s1", create_story(6))
+
+        assert [item.id for item in repo.list()] == ["s1", "s3", "s2"]
+        assert [item.id for item in repo.list(offset=1, limit=1)] == ["s3"]
+        assert [item.id for item in repo.list(offset=2)] == ["s2"]
+
+
+def test_index_sees_records_written_elsewhere(tmp_path) -> None:
+    repo = FileStoryRepository(str(tmp_path))
+    repo.save("s1", create_story())
+    repo.save("s2", create_story())
+    assert len(repo.list()) == 2
+
+    # Another process retitles a story.
+    record = tmp_path / "00index" / "s2.json"
+    item = json.loads(record.read_text())
+    (tmp_path / "new.tmp").write_text(json.dumps({**item, "title": "Retitled"}))
+    os.replace(tmp_path / "new.tmp", record)
+    os.remove(tmp_path / "00index" / "s1.json")
+
+    assert [(item.id, item.title) for item in repo.list()] == [("s2", "Retitled")]
+
+
+def test_single_file_index_is_split_into_records(tmp_path) -> None:
+    FileStoryRepository(str(tmp_path)).save("s1", create_story())
+    item = json.loads((tmp_path / "00index" / "s1.json").read_text())
+    (tmp_path / "00index.json").write_text(
+        json.dumps({"s1": item, "s2": {**item, "id": "s2"}})
+    )
+    for path in (tmp_path / "00index").iterdir():
+        path.unlink()
+    (tmp_path / "00index").rmdir()
+
+    repo = FileStoryRepository(str(tmp_path))
+    assert sorted(item.id for item in repo.list()) == ["s1", "s2"]
+    repo.save("s1", create_story())
+
+    assert not (tmp_path / "00index.json").exists()
+    assert sorted(os.listdir(tmp_path / "00index")) == ["s1.json", "s2.json"]
+
+
+def test_import_file_repository(tmp_path) -> None:
+    file_repo = FileStoryRepository(str(tmp_path))
+    stories = {"s1": create_story(), "s2": create_story(2)}
+    for story_id, story in stories.items():
+        file_repo.save(story_id, story)
+
+    sqlite_repo = SqliteStoryRepository(str(tmp_path / "stories.db"))
+    imported = import_file_repository(file_repo, sqlite_repo)
+
+    assert sorted(imported) == ["s1", "s2"]
+    for story_id, story in stories.items():
+        assert sqlite_repo.load(story_id) == story
+    assert {item.id: item.created for item in sqlite_repo.list()} == {
+        item.id: item.created for item in file_repo.list()
+    }
+
+
+def test_old_messages_are_archived_on_save(tmp_path) -> None:
+    repo = FileStoryRepository(str(tmp_path))
+    story = create_story()
+    story.old_messages = [HumanMessage("First"), AIMessage("Second")]
+    repo.save("s1", story)
+    story.old_messages = [HumanMessage("Third")]
+    repo.save("s1", story)
+
+    loaded = repo.load("s1")
+    assert loaded.old_messages == []
+    assert [ref.messages for ref in loaded.archived_messages] == [2, 1]
+    assert [message.content for message in repo.export("s1").old_messages] == [
+        "First",
+        "Second",
+        "Third",
+    ]
+
+
+def test_sqlite_archives_old_messages(tmp_path) -> None:
+    repo = SqliteStoryRepository(str(tmp_path / "stories.db"))
+    story = create_story()
+    story.old_messages = [HumanMessage("First")]
+    repo.save("s1", story)
+    story.old_messages = [AIMessage("Second")]
+    repo.save("s1", story)
+
+    loaded = repo.load("s1")
+    assert loaded.old_messages == []
+    assert len(loaded.archived_messages) == 2
+    assert [message.content for message in repo.export("s1").old_messages] == [
+        "First",
+        "Second",
+    ]
@@ -0,0 +1,84 @@
+import json
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from storyteller.engine import make_structured_chain
+from storyteller.models import Chapter
+from storyteller.responsecache import BYPASS_CACHE, ResponseCache
+from tests.fakes import NamedChatModel
+
+
+@pytest.mark.asyncio
+async def test_structured_responses_are_cached(tmp_path: Path) -> None:
+    model = NamedChatModel(model_name="fast")
+    cache = ResponseCache(str(tmp_path))
+    chain = make_structured_chain(model, "Summarize {scenes}", Chapter, cache)
+
+    first = await chain.ainvoke({"scenes": "Lunch"})
+    second = await chain.ainvoke({"scenes": "Lunch"})
+    await chain.ainvoke({"scenes": "Dinner"})
+    await chain.ainvoke({"scenes": "Lunch"}, BYPASS_CACHE)
+
+    assert first == second
+    assert isinstance(second, Chapter)
+    assert model.calls == 3
+    stats = cache.current_stats()
+    assert (stats.hits, stats.misses, stats.bypassed) == (1, 2, 1)
+    assert stats.entries == 2
+
+    # The cache outlives the process.
+    reopened = ResponseCache(str(tmp_path))
+    chain = make_structured_chain(model, "Summarize {scenes}", Chapter, reopened)
+    assert await chain.ainvoke({"scenes": "Dinner"}) is not None
+    assert model.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_other_models_are_cached_separately(tmp_path: Path) -> None:
+    cache = ResponseCache(str(tmp_path))
+    for name in ["fast", "flagship"]:
+        model = NamedChatModel(model_name=name)
+        chain = make_structured_chain(model, "Summarize {scenes}", Chapter, cache)
+        assert (await chain.ainvoke({"scenes": "Lunch"})).title == name
+
+
+def test_expired_responses_are_dropped(tmp_path: Path) -> None:
+    cache = ResponseCache(str(tmp_path), ttl_s=60)
+    cache.put("old", Chapter(title="Old", summary="Long ago"))
+    old_file = tmp_path / "old.json"
+    saved = json.loads(old_file.read_text())
+    old_file.write_text(json.dumps({**saved, "created": time.time() - 61}))
+
+    assert cache.get("old", Chapter) is None
+    assert cache.current_stats().expired == 1
+    assert not old_file.exists()
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path: Path) -> None:
+    cache = ResponseCache(str(tmp_path), max_size=250)
+    for key in ["a", "b", "c"]:
+        cache.put(key, Chapter(title=key, summary="x" * 50))
+        time.sleep(0.01)
+    assert cache.get("a", Chapter) is None
+    assert cache.get("b", Chapter) is not None
+
+    cache.put("d", Chapter(title="d", summary="x" * 50))
+
+    assert cache.get("c", Chapter) is None
+    assert sorted(os.listdir(tmp_path)) == ["b.json", "d.json"]
+    assert cache.current_stats().evictions == 2
+
+
+def test_responses_written_by_other_processes_are_found(tmp_path: Path) -> None:
+    cache = ResponseCache(str(tmp_path))
+    other = ResponseCache(str(tmp_path))
+    other.put("shared", Chapter(title="Shared", summary="Written elsewhere"))
+
+    assert cache.get("shared", Chapter) == Chapter(
+        title="Shared", summary="Written elsewhere"
+    )
+    stats = cache.current_stats()
+    assert (stats.hits, stats.entries) == (1, 1)
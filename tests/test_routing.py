@@ -0,0 +1,67 @@
+import argparse
+
+import pytest
+
+from storyteller.common import add_standard_model_args, init_routes
+from storyteller.engine import Chains
+from storyteller.models import Prompts
+from storyteller.routing import ChainRole
+from tests.fakes import NamedChatModel
+
+PROMPTS = Prompts(
+    base_prompt="Tell a story. {characters} {chapters} {scenes}",
+    scene_summary_prompt="Summarize {previous_scenes} {message_dump}",
+    chapter_summary_prompt="Summarize {scenes}",
+    character_summary_prompt="Update {characters} {story}",
+    fix_prompt="Fix {instruction}",
+    opening_suggestions_prompt="Suggest {characters}",
+)
+
+
+@pytest.mark.asyncio
+async def test_chains_are_routed_by_role() -> None:
+    flagship = NamedChatModel(model_name="flagship")
+    fast = NamedChatModel(model_name="fast")
+    chains = Chains(flagship, PROMPTS, {ChainRole.Chapter: fast})
+
+    chapter = await chains.chapter_chain.ainvoke({"scenes": "Lunch"})
+    await chains.chapter_chain.ainvoke({"scenes": "Dinner"})
+    fixed = await chains.fix_chain.ainvoke({"instruction": "typos"})
+
+    assert chapter.title == "fast"
+    assert fixed.content == "flagship"
+    assert (fast.calls, flagship.calls) == (2, 1)
+
+    stats = chains.latency_stats()
+    assert stats[ChainRole.Chapter].model == "fast"
+    assert stats[ChainRole.Chapter].calls == 2
+    assert stats[ChainRole.Fix].calls == 1
+    assert stats[ChainRole.Chat].calls == 0
+
+
+def test_route_arguments(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(
+        "storyteller.common.init_chat_model",
+        lambda model, model_provider, **kwargs: NamedChatModel(model_name=model),
+    )
+    monkeypatch.setenv("STORY_ROUTES", "background=ollama:llama3:8b")
+    parser = argparse.ArgumentParser()
+    add_standard_model_args(parser)
+    args = parser.parse_args(["-p", "openai", "--route", "chapter=ollama:mistral"])
+
+    routes = init_routes(args)
+
+    summary, chapter = routes[ChainRole.Summary], routes[ChainRole.Chapter]
+    assert isinstance(summary, NamedChatModel) and summary.model_name == "llama3:8b"
+    assert routes[ChainRole.CharacterBio] is summary
+    assert isinstance(chapter, NamedChatModel) and chapter.model_name == "mistral"
+    assert ChainRole.Chat not in routes
+
+
+def test_route_roles_are_checked() -> None:
+    parser = argparse.ArgumentParser()
+    add_standard_model_args(parser)
+    args = parser.parse_args(["-p", "openai", "--route", "chaper=ollama:mistral"])
+
+    with pytest.raises(ValueError, match="Invalid role chaper .* chat, "):
+        init_routes(args)
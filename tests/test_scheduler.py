@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from langchain_core.messages import HumanMessage
+
+from storyteller.engine import Command, FileStoryRepository, StoryEngine, StoryLocked
+from storyteller.models import Story
+from storyteller.scheduler import LogResponse, SummaryScheduler
+from tests.fakes import NO_CHAINS
+
+
+class NoCommand(Command):
+    async def run(self, story: Story) -> None:
+        pass
+
+
+class CountingEngine(StoryEngine):
+    """Records the summaries it's asked to run, and runs a command that
+    does nothing in their place."""
+
+    def __init__(self, story_repository):
+        super().__init__(story_repository)
+        self.commands: list[Command] = []
+
+    async def run_command(self, story_id: str, cmd: Command):
+        self.commands.append(cmd)
+        await super().run_command(story_id, NoCommand())
+
+
+def create_engine(tmp_path, message: str = "Once upon a time " * 20) -> CountingEngine:
+    repo = FileStoryRepository(str(tmp_path))
+    story = Story.new()
+    story.current_messages = [HumanMessage(message)]
+    repo.save("s1", story)
+    return CountingEngine(repo)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_coalesces_bursts(tmp_path) -> None:
+    engine = create_engine(tmp_path)
+    scheduler = SummaryScheduler(NO_CHAINS, 10, 20, debounce_ms=20)
+
+    waiters = [scheduler.schedule(engine, "s1", LogResponse()) for _ in range(3)]
+    results = await asyncio.gather(*waiters)
+
+    assert results == [None, None, None]
+    assert len(engine.commands) == 1
+    assert not scheduler.workers
+
+
+@pytest.mark.asyncio
+async def test_scheduler_retries_locked_stories(tmp_path) -> None:
+    engine = create_engine(tmp_path)
+    scheduler = SummaryScheduler(NO_CHAINS, 10, 20, debounce_ms=0, retry_ms=10)
+
+    engine.story_repository.lock("s1")
+    waiter = scheduler.schedule(engine, "s1", LogResponse())
+    await asyncio.sleep(0.05)
+    assert not waiter.done()
+
+    engine.story_repository.unlock("s1")
+    assert await waiter is None
+
+
+@pytest.mark.asyncio
+async def test_scheduler_gives_up_on_stories_that_stay_locked(tmp_path) -> None:
+    engine = create_engine(tmp_path)
+    scheduler = SummaryScheduler(
+        NO_CHAINS, 10, 20, debounce_ms=0, retry_ms=1, retry_attempts=3
+    )
+
+    engine.story_repository.lock("s1")
+    try:
+        error = await asyncio.wait_for(
+            scheduler.schedule(engine, "s1", LogResponse()), timeout=1
+        )
+    finally:
+        engine.story_repository.unlock("s1")
+
+    assert isinstance(error, StoryLocked)
+    assert not scheduler.workers
+
+
+@pytest.mark.asyncio
+async def test_drain_runs_pending_summaries(tmp_path) -> None:
+    engine = create_engine(tmp_path)
+    scheduler = SummaryScheduler(NO_CHAINS, 10, 20, debounce_ms=60_000)
+
+    scheduler.schedule(engine, "s1", LogResponse())
+    await asyncio.wait_for(scheduler.drain(), timeout=1)
+
+    assert len(engine.commands) == 1
+
+
+@pytest.mark.asyncio
+async def test_stories_under_the_limit_are_left_alone(tmp_path) -> None:
+    engine = create_engine(tmp_path, message="Short")
+    scheduler = SummaryScheduler(NO_CHAINS, 10, 20, debounce_ms=0)
+
+    assert await scheduler.schedule(engine, "s1", LogResponse()) is None
+    assert engine.commands == []
@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from storyteller.engine import Command, FileStoryRepository, StoryEngine
+from storyteller.models import Story
+from storyteller.scheduler import SummaryScheduler
+from storyteller.sse import SSEResponse, run_streamed_command, sse_event
+from tests.fakes import NO_CHAINS
+
+
+class TellCommand(Command):
+    def __init__(self, response: SSEResponse, fail: bool = False):
+        self.response = response
+        self.fail = fail
+
+    async def run(self, story: Story) -> None:
+        await self.response.send_message("Once upon a time")
+        if self.fail:
+            raise RuntimeError("Command failed")
+        story.current_messages.append(HumanMessage("Go on"))
+
+
+def create_engine(tmp_path, message: str) -> StoryEngine:
+    repo = FileStoryRepository(str(tmp_path))
+    story = Story.new()
+    story.current_messages = [HumanMessage(message)]
+    repo.save("s1", story)
+    return StoryEngine(repo)
+
+
+async def run(engine: StoryEngine, fail: bool = False) -> list[tuple[str, dict]]:
+    """The events streamed for a command, as names and data."""
+    events: asyncio.Queue[str | None] = asyncio.Queue()
+    cmd = TellCommand(SSEResponse(events), fail)
+    # Summaries that can't run fail, rather than calling a model.
+    scheduler = SummaryScheduler(NO_CHAINS, 10, 20, debounce_ms=0)
+    await run_streamed_command(engine, "s1", cmd, scheduler, events)
+
+    parsed = []
+    while (event := events.get_nowait()) is not None:
+        name, data = event.removesuffix("\n\n").split("\n")
+        parsed.append((name.removeprefix("event: "), json.loads(data[6:])))
+    return parsed
+
+
+def test_sse_event_format() -> None:
+    assert (
+        sse_event("token", {"text": "Hi"}) == 'event: token\ndata: {"text": "Hi"}\n\n'
+    )
+
+
+@pytest.mark.asyncio
+async def test_command_events_come_before_the_summary(tmp_path) -> None:
+    # Short enough that the summary has nothing to do.
+    engine = create_engine(tmp_path, "Short")
+
+    assert await run(engine) == [
+        ("message", {"text": "Once upon a time"}),
+        ("result", {"status": "success"}),
+        ("summary_done", {"status": "success"}),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_failed_summaries_are_reported_in_summary_done(tmp_path) -> None:
+    engine = create_engine(tmp_path, "Once upon a time " * 20)
+
+    events = await run(engine)
+
+    # The summary reports its progress before it gets to the chains.
+    assert [name for name, _ in events] == [
+        "message",
+        "result",
+        "summary_message",
+        "summary_message",
+        "summary_done",
+    ]
+    assert events[-1][1]["status"] == "error"
+
+
+@pytest.mark.asyncio
+async def test_failed_commands_end_with_an_error(tmp_path) -> None:
+    engine = create_engine(tmp_path, "Short")
+
+    assert await run(engine, fail=True) == [
+        ("message", {"text": "Once upon a time"}),
+        ("error", {"detail": "Command failed"}),
+    ]
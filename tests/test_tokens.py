@@ -0,0 +1,74 @@
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+from storyteller.models import Story
+from storyteller.tokens import TokenLedger
+
+
+class CountingTokenizer:
+    def __init__(self):
+        self.counted = 0
+
+    def __call__(self, message: BaseMessage) -> int:
+        self.counted += 1
+        return len(str(message.content))
+
+
+def create_messages(count: int) -> list[BaseMessage]:
+    return [
+        HumanMessage(f"User {idx}") if idx % 2 == 0 else AIMessage(f"Bot {idx}")
+        for idx in range(count)
+    ]
+
+
+def test_ledger_total_matches_approximate_count() -> None:
+    messages = create_messages(50)
+    ledger = TokenLedger().sync(messages)
+    assert ledger.total == count_tokens_approximately(messages)
+
+
+def test_ledger_only_counts_changed_messages() -> None:
+    tokenizer = CountingTokenizer()
+    ledger = TokenLedger(tokenizer)
+    messages = create_messages(10)
+    ledger.sync(messages)
+    assert tokenizer.counted == 10
+
+    # Append, replace the last message, rewind, and prune from the front.
+    messages.append(HumanMessage("More"))
+    ledger.sync(messages)
+    messages[-1] = AIMessage("Replaced")
+    ledger.sync(messages)
+    messages = messages[:-2]
+    ledger.sync(messages)
+    messages = messages[4:]
+    ledger.sync(messages)
+
+    assert tokenizer.counted == 12
+    assert ledger.total == sum(len(str(m.content)) for m in messages)
+    assert ledger.messages == messages
+
+
+def test_ledger_recounts_unrelated_messages() -> None:
+    ledger = TokenLedger(CountingTokenizer())
+    ledger.sync(create_messages(4))
+    other = [HumanMessage("Hello")]
+    assert ledger.sync(other).total == 5
+    assert ledger.sync([]).total == 0
+
+
+def test_split_point() -> None:
+    ledger = TokenLedger(lambda message: 10).sync(create_messages(10))
+    assert ledger.split_point(100) == 0
+    assert ledger.split_point(95) == 1
+    assert ledger.split_point(30) == 7
+    assert ledger.split_point(0) == 10
+
+
+def test_story_ledger_follows_current_messages() -> None:
+    story = Story.new()
+    story.current_messages = create_messages(6)
+    ledger = story.token_ledger()
+    story.current_messages.append(HumanMessage("Another one"))
+    assert story.token_ledger() is ledger
+    assert ledger.total == count_tokens_approximately(story.current_messages)
@@ -1,27 +1,39 @@
+import asyncio
 import hashlib
 import json
 import os
 import uuid
+from contextlib import asynccontextmanager
 from typing import Any, Optional
 from fastapi import FastAPI, HTTPException, Depends, status, Response
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from fastapi_plugin import Auth0FastAPI
 
-from storyteller.models import Story, Characters, StoryIndex
+from storyteller.models import Story, Characters, Prompts, StoryIndex
 from storyteller.engine import (
     FileStoryRepository,
     StoryEngine,
     Chains,
     StoryRepository,
+    ThreadedStoryRepository,
     create_prompts,
 )
+from storyteller.sqlite import SqliteStoryRepository
+from storyteller.cache import StoryCache
+from storyteller.pool import EnginePool, EnginePoolStats
+from storyteller.scheduler import LogResponse, SummaryScheduler
+from storyteller.sse import SSEResponse, run_streamed_command
+from storyteller.responsecache import BYPASS_CACHE, ResponseCache, ResponseCacheStats
+from storyteller.routing import ChainLatency, ChainRole
+from storyteller.looplag import LoopLagMonitor, LoopLagStats
+from storyteller.storyqueue import StoryBusy, StoryQueues, StoryQueueStats
 from storyteller import (
     commands as c,
 )  # Aliased to avoid clash with Response from fastapi
-from storyteller.common import add_standard_model_args, init_model
+from storyteller.common import add_standard_model_args, init_model, init_routes
 import argparse
 
 load_dotenv()
@@ -32,12 +44,39 @@ PROMPT_DIR = os.getenv("PROMPT_DIR", "prompts/storyteller/prompts")
 STORY_DIR = os.getenv("STORY_DIR", "prompts/storyteller/stories/genfantasy")
 HISTORY_MIN_TOKENS = int(os.getenv("HISTORY_MIN_TOKENS", "1024"))
 HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "4096"))
+SUMMARY_DEBOUNCE_MS = int(os.getenv("SUMMARY_DEBOUNCE_MS", "1500"))
+STORY_JOURNAL = os.getenv("STORY_JOURNAL", "false").lower() == "true"
+STORY_BACKEND = os.getenv("STORY_BACKEND", "file")
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", "")
+RESPONSE_CACHE_TTL_S = int(os.getenv("RESPONSE_CACHE_TTL_S", "86400"))
+RESPONSE_CACHE_MB = int(os.getenv("RESPONSE_CACHE_MB", "64"))
+CHAT_CANDIDATES = int(os.getenv("CHAT_CANDIDATES", "1"))
+STORY_QUEUE_DEPTH = int(os.getenv("STORY_QUEUE_DEPTH", "8"))
+STORY_QUEUE_TIMEOUT_S = int(os.getenv("STORY_QUEUE_TIMEOUT_S", "120"))
+STORY_CACHE_MB = int(os.getenv("STORY_CACHE_MB", "0"))
+USER_POOL_SIZE = int(os.getenv("USER_POOL_SIZE", "256"))
 
 AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN")
 AUTH0_API_AUDIENCE = os.getenv("AUTH0_API_AUDIENCE")
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
 
-app = FastAPI(title="Storyteller API", version="0.1.0")
+# Measures how long anything holds up the event loop, for /metrics.
+loop_lag = LoopLagMonitor()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop_lag.start()
+    try:
+        yield
+    finally:
+        await loop_lag.stop()
+        # Finish any pending summaries before the engines are closed.
+        await summary_scheduler.drain()
+        await engine_pool.close()
+
+
+app = FastAPI(title="Storyteller API", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -48,15 +87,17 @@ app.add_middleware(
 )
 
 model = None
-prompts = None
-chains = None
+# Set up before the app starts.
+prompts: Prompts
+chains: Chains
+summary_scheduler: SummaryScheduler
 
 auth = Auth0FastAPI(domain=AUTH0_DOMAIN, audience=AUTH0_API_AUDIENCE)
 
 use_scope = ["storyteller:use"]
 
 
-def get_story_repository(user_id: str) -> StoryRepository:
+def create_story_engine(user_id: str) -> StoryEngine:
     hashed_id = hashlib.sha256(user_id.encode()).hexdigest()
     repo_dir = os.path.expanduser(f"~/story_repo/{hashed_id}")
     os.makedirs(repo_dir, exist_ok=True)
@@ -64,7 +105,15 @@ def get_story_repository(user_id: str) -> StoryRepository:
     if not os.path.exists(userinfo_path):
         with open(userinfo_path, "w") as f:
             json.dump({"userid": user_id}, f)
-    return FileStoryRepository(repo_dir=repo_dir)
+    repo: StoryRepository
+    if STORY_BACKEND == "sqlite":
+        repo = SqliteStoryRepository(db_path=os.path.join(repo_dir, "stories.db"))
+    else:
+        repo = FileStoryRepository(repo_dir=repo_dir, journaled=STORY_JOURNAL)
+    # Pooled engines can be evicted mid-request, so cached stories are
+    # saved after every command.
+    cache = StoryCache(STORY_CACHE_MB * 1024 * 1024) if STORY_CACHE_MB > 0 else None
+    return StoryEngine(ThreadedStoryRepository(repo), cache, story_queues)
 
 
 class CommandRequest(BaseModel):
@@ -97,22 +146,37 @@ class APIResponse(c.Response):
             self.messages.append(msg)
 
 
+# Commands whose clients have gone away still run to completion.
+background_tasks: set[asyncio.Task] = set()
+
+# Shared by every request's engine, so commands for a story run in turn.
+story_queues = StoryQueues(STORY_QUEUE_DEPTH, STORY_QUEUE_TIMEOUT_S)
+
+# Each user's engine and repository are set up once, and kept while the
+# user is active.
+engine_pool = EnginePool(create_story_engine, USER_POOL_SIZE)
+
+
 class CreatedStory(Story):
     story_id: str
 
 
-def make_characters(descriptions: str) -> Characters:
-    return chains.character_create_chain.invoke({"characters": descriptions})
+async def make_characters(descriptions: str) -> Characters:
+    # The same descriptions should still give a new party each time.
+    return await chains.character_create_chain.ainvoke(
+        {"characters": descriptions}, BYPASS_CACHE
+    )
 
 
 @app.get("/stories")
 async def list_stories(
+    offset: int = 0,
+    limit: Optional[int] = None,
     claims: dict = Depends(auth.require_auth(scopes=use_scope)),
 ) -> list[StoryIndex]:
-    """List all stories for the current user"""
-    user_id = claims["sub"]
-    repo = get_story_repository(user_id)
-    return repo.list()
+    """List the current user's stories, most recently modified first"""
+    engine = await engine_pool.get(claims["sub"])
+    return await engine.story_repository.list(offset, limit)
 
 
 @app.post("/stories", status_code=status.HTTP_201_CREATED)
@@ -127,8 +191,8 @@ async def create_story(
 
     story = Story.new()
 
-    repo = get_story_repository(user_id)
-    repo.save(story_uuid, story)
+    engine = await engine_pool.get(user_id)
+    await engine.story_repository.save(story_uuid, story)
 
     response.headers["Location"] = f"/stories/{story_uuid}"
     return CreatedStory(**story.model_dump(), story_id=story_uuid)
@@ -143,7 +207,7 @@ async def generate_characters(
 
     print(claims)
 
-    characters = make_characters(request.prompt)
+    characters = await make_characters(request.prompt)
     return characters
 
 
@@ -153,15 +217,39 @@ async def get_story(
 ) -> Story:
     """Get the full story state"""
 
-    repo = get_story_repository(claims["sub"])
+    engine = await engine_pool.get(claims["sub"])
 
-    if not repo.story_exists(story_uuid):
+    if not await engine.story_exists(story_uuid):
         raise HTTPException(status_code=404, detail="Story not found")
 
-    story = repo.load(story_uuid)
+    story = await engine.export(story_uuid)
     return story
 
 
+class Metrics(BaseModel):
+    loop_lag: LoopLagStats
+    chain_latency: dict[ChainRole, ChainLatency]
+    response_cache: ResponseCacheStats | None
+    story_queue: StoryQueueStats
+    user_pool: EnginePoolStats
+
+
+@app.get("/metrics")
+async def get_metrics(
+    claims: dict = Depends(auth.require_auth(scopes=use_scope)),
+) -> Metrics:
+    """Service metrics: event loop lag, chain latency by role, response
+    cache stats, commands waiting for their story, and reuse of users'
+    story engines"""
+    return Metrics(
+        loop_lag=loop_lag.current_stats(),
+        chain_latency=chains.latency_stats(),
+        response_cache=chains.response_cache_stats(),
+        story_queue=story_queues.current_stats(),
+        user_pool=engine_pool.current_stats(),
+    )
+
+
 class CommandResponse(BaseModel):
     status: str
     messages: list[str]
@@ -175,42 +263,81 @@ async def execute_command(
 ) -> CommandResponse:
     """Execute a command on the story"""
 
-    repo = get_story_repository(claims["sub"])
+    engine = await engine_pool.get(claims["sub"])
 
-    if not repo.story_exists(story_uuid):
+    if not await engine.story_exists(story_uuid):
         raise HTTPException(status_code=404, detail="Story not found")
 
     response = APIResponse()
 
     try:
         cmd = parse_command(command_request, chains, response)
-        engine = StoryEngine(story_repository=repo)
+        await summary_scheduler.wait_for_running(story_uuid)
         await engine.run_command(story_uuid, cmd)
-        summarize_cmd = c.SummarizeCommand(
-            chains,
-            response=response,
-            min_tokens=HISTORY_MIN_TOKENS,
-            max_tokens=HISTORY_MAX_TOKENS,
-        )
-        await engine.run_command(story_uuid, summarize_cmd)
+        # Summarize after responding, so the client doesn't wait for it.
+        summary_scheduler.schedule(engine, story_uuid, LogResponse())
 
         return CommandResponse(status="success", messages=response.messages)
 
+    except StoryBusy as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/stories/{story_uuid}/stream")
+async def stream_command(
+    story_uuid: str,
+    command_request: CommandRequest,
+    claims: dict = Depends(auth.require_auth(scopes=use_scope)),
+) -> StreamingResponse:
+    """Execute a command on the story, streaming its output as server-sent
+    events: message, stream_start, token and stream_end as the command runs,
+    then result (or error) once it's saved. Summary progress follows as
+    summary_message events, ending with summary_done."""
+
+    engine = await engine_pool.get(claims["sub"])
+
+    if not await engine.story_exists(story_uuid):
+        raise HTTPException(status_code=404, detail="Story not found")
+
+    events: asyncio.Queue[str | None] = asyncio.Queue()
+
+    try:
+        cmd = parse_command(command_request, chains, SSEResponse(events))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    task = asyncio.create_task(
+        run_streamed_command(engine, story_uuid, cmd, summary_scheduler, events)
+    )
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+    async def stream():
+        while (event := await events.get()) is not None:
+            yield event
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 def parse_command(
-    command_request: CommandRequest, chains: Chains, response: APIResponse
+    command_request: CommandRequest, chains: Chains, response: c.Response
 ):
     """Parse command request into appropriate Command object"""
     cmd_name = command_request.command.lower()
     body = command_request.body or ""
 
     if cmd_name == "chat":
-        return c.ChatCommand(chains, response=response, user_input=body)
+        return c.ChatCommand(
+            chains, response=response, user_input=body, candidates=CHAT_CANDIDATES
+        )
     elif cmd_name == "retry":
-        return c.RetryCommand(chains, response=response)
+        return c.RetryCommand(chains, response=response, candidates=CHAT_CANDIDATES)
     elif cmd_name == "rewind":
         return c.RewindCommand(chains, response=response)
     elif cmd_name == "fix":
@@ -235,8 +362,27 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Tell a story")
     add_standard_model_args(parser)
-    model = init_model(parser.parse_args())
+    args = parser.parse_args()
+    model = init_model(args)
     prompts = create_prompts(PROMPT_DIR)
-    chains = Chains(model=model, prompts=prompts)
+    response_cache = (
+        ResponseCache(
+            RESPONSE_CACHE_DIR, RESPONSE_CACHE_TTL_S, RESPONSE_CACHE_MB * 1024 * 1024
+        )
+        if RESPONSE_CACHE_DIR
+        else None
+    )
+    chains = Chains(
+        model=model,
+        prompts=prompts,
+        routes=init_routes(args),
+        response_cache=response_cache,
+    )
+    summary_scheduler = SummaryScheduler(
+        chains,
+        min_tokens=HISTORY_MIN_TOKENS,
+        max_tokens=HISTORY_MAX_TOKENS,
+        debounce_ms=SUMMARY_DEBOUNCE_MS,
+    )
 
     uvicorn.run(app, host=HTTP_HOST, port=HTTP_PORT)